@@ -0,0 +1,369 @@
+# analytics.py
+"""
+In-memory, columnar copy of daily_sales for reports and dashboards.
+
+Sales are loaded once into NumPy arrays, one per column, summed per
+(day, hour, category) bucket. Money is kept as integer paise (money.py), so
+the sums are exact however many sales there are. After that only sales
+newer than the last id seen are fetched (id watermark). Group-bys, filters
+and top-N lists are then vectorized passes over the arrays, so they take a
+millisecond or two and no round trip.
+
+    analytics = sales_analytics()
+    analytics.refresh()
+    keys, totals = analytics.group_by("hour", start_date=date(2024, 1, 1))
+
+Sale ids are not committed in id order: several terminals and background
+workers write sales, and the journal flush reserves its ids up front. So
+every id the watermark skips over is remembered as a gap and looked up
+again on each refresh, until no transaction that could still commit it
+is running (see _drop_settled_gaps).
+
+Sales are append-only in this app. Only new ids are picked up, so call
+reload() after editing or deleting old rows by hand.
+"""
+
+import io
+import threading
+import time
+from datetime import date, timedelta
+import numpy as np
+from db import connection
+from categories import fetch_categories
+from money import PAISE
+
+# Sales fetched per COPY while loading, to bound the transfer buffer
+LOAD_BATCH = 200_000
+# Seconds a skipped id is looked up at least, on top of waiting for the
+# transactions that were running when it was skipped: a transaction that
+# has reserved an id may not have a transaction id of its own yet.
+GAP_GRACE = 60
+
+GROUPINGS = ("category", "day", "hour", "weekday", "month")
+MEASURES = ("sales_count", "quantity_sold", "total_revenue", "total_cost", "total_profit")
+
+_EPOCH = date(1970, 1, 1)
+
+# Every column is selected NOT NULL and fixed-width, so each tuple of the
+# binary COPY stream has the same layout and NumPy can decode the whole
+# batch at once: a field count, then a length word before every field.
+_COPY_SQL = """
+    COPY (
+        SELECT id,
+               COALESCE(sale_date, sale_time::date, CURRENT_DATE) - DATE '1970-01-01',
+               COALESCE(EXTRACT(HOUR FROM sale_time), 0)::int4,
+               COALESCE(category_id, -1),
+               quantity_sold,
+               (total_revenue * 100)::int8, (total_cost * 100)::int8, (total_profit * 100)::int8
+        FROM daily_sales
+        WHERE {where}
+        ORDER BY id
+        LIMIT {limit}
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+_COPY_ROW = np.dtype([
+    ("fields", ">i2"),
+    ("id_len", ">i4"), ("id", ">i4"),
+    ("day_len", ">i4"), ("day", ">i4"),
+    ("hour_len", ">i4"), ("hour", ">i4"),
+    ("category_len", ">i4"), ("category_id", ">i4"),
+    ("quantity_len", ">i4"), ("quantity", ">i4"),
+    ("revenue_len", ">i4"), ("revenue", ">i8"),
+    ("cost_len", ">i4"), ("cost", ">i8"),
+    ("profit_len", ">i4"), ("profit", ">i8"),
+])
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+# Bucket column name -> dtype. Sales are summed per (day, hour, category)
+# as they are loaded; every question below groups by those or by coarser
+# keys (weekday, month), so nothing is lost and a year of sales shrinks
+# to a few tens of thousands of buckets.
+COLUMNS = {
+    "day": np.int32,          # days since 1970-01-01
+    "hour": np.int8,
+    "category_id": np.int32,  # -1 for sales without a category
+    "sales_count": np.int64,
+    "quantity": np.int64,
+    "revenue": np.int64,      # paise
+    "cost": np.int64,         # paise
+    "profit": np.int64,       # paise
+}
+_SUMMED = ("sales_count", "quantity", "revenue", "cost", "profit")
+# Bucket code: (day * 24 + hour) * _CATEGORY_SPAN + category_id + 1
+_CATEGORY_SPAN = 1 << 32
+
+def _decode_copy(data):
+    """Decode a binary COPY stream of _COPY_SQL into a structured array."""
+    if not data.startswith(_COPY_SIGNATURE):
+        raise ValueError("not a binary COPY stream")
+    extension = int.from_bytes(data[15:19], "big")
+    body = data[19 + extension:-2]  # header, then the -1 trailer
+    if len(body) % _COPY_ROW.itemsize:
+        raise ValueError("unexpected binary COPY row layout")
+    rows = np.frombuffer(body, dtype=_COPY_ROW)
+    if len(rows) and (np.any(rows["fields"] != 8) or np.any(rows["id_len"] != 4)):
+        raise ValueError("unexpected binary COPY row layout")
+    return rows
+
+def _day_number(day):
+    return (day - _EPOCH).days
+
+def _empty_buckets():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+class SalesAnalytics:
+    """
+    daily_sales as NumPy columns of (day, hour, category) buckets (see
+    COLUMNS), ordered by day, hour and category. refresh() swaps in a new
+    set of arrays, so queries may run on any thread meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = _empty_buckets()
+        self._codes = np.empty(0, dtype=np.int64)
+        self.watermark = 0
+        # Skipped ids not seen yet: id -> (xmax of the snapshot that skipped
+        # it, time.monotonic() then)
+        self._gaps = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._codes)
+
+    def snapshot(self):
+        """The buckets as {column: array}; the arrays are never modified in place."""
+        return self._buckets
+
+    def _merge(self, batch):
+        """Add a decoded COPY batch of sales to the buckets."""
+        new_codes = ((batch["day"].astype(np.int64) * 24 + batch["hour"]) * _CATEGORY_SPAN
+                     + batch["category_id"] + 1)
+        codes, slots = np.unique(np.concatenate([self._codes, new_codes]), return_inverse=True)
+        old = self._buckets
+        added = {"sales_count": np.ones(len(batch)), "quantity": batch["quantity"],
+                 "revenue": batch["revenue"], "cost": batch["cost"], "profit": batch["profit"]}
+        buckets = {}
+        for name in _SUMMED:
+            # float64 sums of integers are exact below 2**53 (about 9e13 rupees)
+            sums = np.bincount(slots, weights=np.concatenate([old[name], added[name]]),
+                               minlength=len(codes))
+            buckets[name] = np.rint(sums).astype(COLUMNS[name])
+        day_hour, category = np.divmod(codes, _CATEGORY_SPAN)
+        buckets["day"] = (day_hour // 24).astype(np.int32)
+        buckets["hour"] = (day_hour % 24).astype(np.int8)
+        buckets["category_id"] = (category - 1).astype(np.int32)
+        self._codes = codes
+        self._buckets = buckets
+
+    def _fetch(self, cur, where, limit):
+        buffer = io.BytesIO()
+        cur.copy_expert(_COPY_SQL.format(where=where, limit=limit), buffer)
+        return _decode_copy(buffer.getvalue())
+
+    def _fetch_gaps(self, cur):
+        """Load the skipped ids committed since. Returns how many were found."""
+        if not self._gaps:
+            return 0
+        batch = self._fetch(cur, cur.mogrify("id = ANY(%s)", (sorted(self._gaps),)).decode(), len(self._gaps))
+        if len(batch):
+            self._merge(batch)
+            for sale_id in batch["id"].tolist():
+                del self._gaps[sale_id]
+        return len(batch)
+
+    def _note_gaps(self, batch, xmax):
+        """Remember the ids between the watermark and the batch's sales that were skipped."""
+        ids = batch["id"].astype(np.int64)
+        skipped = np.setdiff1d(np.arange(self.watermark + 1, int(ids[-1]) + 1), ids, assume_unique=True)
+        now = time.monotonic()
+        for sale_id in skipped.tolist():
+            self._gaps[sale_id] = (xmax, now)
+
+    def _drop_settled_gaps(self, xmin):
+        """
+        Forget skipped ids that can no longer appear: every transaction
+        running when they were skipped has ended before this snapshot
+        (its xmin is past their xmax), so they were rolled back or never
+        used, and GAP_GRACE has passed.
+        """
+        deadline = time.monotonic() - GAP_GRACE
+        self._gaps = {sale_id: (xmax, noticed) for sale_id, (xmax, noticed) in self._gaps.items()
+                      if xmin < xmax or noticed > deadline}
+
+    def refresh(self):
+        """
+        Fetch sales committed since the last refresh: new ids, and ids
+        skipped earlier because their transaction had not committed yet.
+        Returns the number of new sales, or None if the database is unavailable.
+        """
+        with self._lock:
+            with connection() as conn:
+                if not conn:
+                    return None
+                try:
+                    cur = conn.cursor()
+                    # One snapshot for all the COPYs below
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    cur.execute("SELECT txid_snapshot_xmin(s), txid_snapshot_xmax(s) FROM txid_current_snapshot() s")
+                    xmin, xmax = cur.fetchone()
+                    added = self._fetch_gaps(cur)
+                    self._drop_settled_gaps(xmin)
+                    while True:
+                        batch = self._fetch(cur, f"id > {int(self.watermark)}", LOAD_BATCH)
+                        if len(batch):
+                            self._note_gaps(batch, xmax)
+                            self._merge(batch)
+                            self.watermark = int(batch["id"][-1])
+                            added += len(batch)
+                        if len(batch) < LOAD_BATCH:
+                            break
+                    conn.rollback()
+                except Exception as e:
+                    print("refresh sales analytics error:", e)
+                    return None
+            self.loaded = True
+            return added
+
+    def reload(self):
+        """Drop everything and load daily_sales again from scratch."""
+        with self._lock:
+            self._buckets = _empty_buckets()
+            self._codes = np.empty(0, dtype=np.int64)
+            self.watermark = 0
+            self._gaps = {}
+            self.loaded = False
+        return self.refresh()
+
+    def mask(self, buckets, start_date=None, end_date=None, category_id=None):
+        """Boolean mask of the buckets matching the filters (dates inclusive), or None for all."""
+        keep = None
+        conditions = []
+        if start_date is not None:
+            conditions.append(buckets["day"] >= _day_number(start_date))
+        if end_date is not None:
+            conditions.append(buckets["day"] <= _day_number(end_date))
+        if category_id is not None:
+            conditions.append(buckets["category_id"] == category_id)
+        for condition in conditions:
+            keep = condition if keep is None else keep & condition
+        return keep
+
+    def group_by(self, by, start_date=None, end_date=None, category_id=None):
+        """
+        Totals per category, day, hour (0-23), weekday (0 = Monday) or month
+        for the matching sales.
+        Returns (keys, totals): keys ascending (category ids, day numbers
+        since 1970-01-01, hours, weekdays, or month numbers since 1970-01),
+        totals an (n, 5) float array with the MEASURES columns (money in
+        rupees, exact to the paisa).
+        """
+        if by not in GROUPINGS:
+            raise ValueError(f"Unknown analytics grouping: {by}")
+        buckets = self.snapshot()
+        keep = self.mask(buckets, start_date, end_date, category_id)
+        if keep is not None:
+            buckets = {name: column[keep] for name, column in buckets.items()}
+        if by == "category":
+            keys = buckets["category_id"]
+        elif by == "hour":
+            keys = buckets["hour"]
+        else:
+            keys = buckets["day"]
+            if by == "weekday":
+                keys = (keys + _EPOCH.weekday()) % 7
+            elif by == "month":
+                keys = keys.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        if not len(keys):
+            return np.empty(0, dtype=np.int64), np.empty((0, len(MEASURES)))
+
+        # Every grouping key is a small integer range, so a bincount per
+        # measure replaces sorting.
+        low = int(keys.min())
+        slots = keys.astype(np.intp) - low
+        totals = np.column_stack([np.bincount(slots, weights=buckets[name]) for name in _SUMMED])
+        present = np.flatnonzero(totals[:, 0])
+        totals = totals[present]
+        totals[:, 2:] /= PAISE
+        return present + low, totals
+
+    def top(self, n=5, measure="total_profit", by="category", start_date=None, end_date=None,
+            category_id=None):
+        """
+        The n groups with the largest measure (all of them for n=None),
+        largest first, as (keys, totals) like group_by().
+        """
+        keys, totals = self.group_by(by, start_date, end_date, category_id)
+        column = totals[:, MEASURES.index(measure)]
+        if n is not None and n < len(keys):
+            best = np.argpartition(-column, n - 1)[:n]
+        else:
+            best = np.arange(len(keys))
+        best = best[np.argsort(-column[best], kind="stable")]
+        return keys[best], totals[best]
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+def sales_analytics():
+    """The shared SalesAnalytics instance (loaded on first refresh)."""
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            _analytics = SalesAnalytics()
+        return _analytics
+
+def refresh_sales_analytics():
+    """Bring the shared sales arrays up to date. Returns the number of new sales or None."""
+    return sales_analytics().refresh()
+
+def _key_labels(by, keys):
+    if by == "category":
+        names = {row[0]: row[1] for row in fetch_categories()}
+        return [names.get(int(k), "Uncategorised") for k in keys]
+    if by == "day":
+        return [_EPOCH + timedelta(days=int(k)) for k in keys]
+    if by == "month":
+        return [date(1970 + int(k) // 12, int(k) % 12 + 1, 1) for k in keys]
+    return [int(k) for k in keys]
+
+def _report_rows(by, keys, totals):
+    return [(label, int(count), int(quantity), revenue, cost, profit)
+            for label, (count, quantity, revenue, cost, profit)
+            in zip(_key_labels(by, keys), totals.tolist())]
+
+def get_sales_totals(by="category", start_date=None, end_date=None, category_id=None):
+    """
+    Like inventory.get_sales_report() but answered from memory, for any
+    (also open-ended) date range, plus by="weekday" (0 = Monday).
+    Returns [(key, sales_count, quantity_sold, total_revenue, total_cost, total_profit), ...]
+    with categories ordered by profit (highest first), everything else by key.
+    """
+    analytics = sales_analytics()
+    if analytics.refresh() is None and not analytics.loaded:
+        return []
+    if by == "category":
+        keys, totals = analytics.top(None, "total_profit", "category",
+                                     start_date, end_date, category_id)
+    else:
+        keys, totals = analytics.group_by(by, start_date, end_date, category_id)
+    return _report_rows(by, keys, totals)
+
+def get_top_items(n=5, measure="total_profit", start_date=None, end_date=None):
+    """The n best-selling categories by measure (see MEASURES), as get_sales_totals() rows."""
+    analytics = sales_analytics()
+    if analytics.refresh() is None and not analytics.loaded:
+        return []
+    keys, totals = analytics.top(n, measure, "category", start_date, end_date)
+    return _report_rows("category", keys, totals)
+
+def get_daily_profit(days=7):
+    """
+    Per-day totals for the last N days, newest first, in the shape of
+    inventory.get_profit_summary():
+    [(date, sales_count, revenue, cost, profit, margin_percent), ...]
+    """
+    start_date = date.today() - timedelta(days=days)
+    rows = get_sales_totals("day", start_date)
+    return [(day, count, revenue, cost, profit, profit / revenue * 100 if revenue else 0.0)
+            for day, count, quantity, revenue, cost, profit in reversed(rows)]
@@ -0,0 +1,87 @@
+# background.py
+"""
+Runs blocking work (database queries, WhatsApp API calls) on a small
+thread pool so the Tk event loop never waits on the network.
+
+Tkinter must only be touched from the main thread, so workers never call
+back into Tk themselves: finished results are queued and the main thread
+picks them up on a root.after() timer and runs the callbacks there.
+
+    runner = BackgroundRunner(root, on_busy=show_busy)
+    runner.submit(fetch_inventory, on_done=render_rows)
+
+Workers finish in any order, so a slow refresh could land after a newer
+one and paint stale rows. Submits that redraw the same thing pass the
+same latest= key; each is numbered, and only the result of the newest
+one for its key is handed to on_done.
+"""
+
+import itertools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+class BackgroundRunner:
+    POLL_MS = 30
+
+    def __init__(self, root, workers=4, on_busy=None):
+        self.root = root
+        self.on_busy = on_busy
+        self.pending = 0
+        self._generations = {}   # latest= key -> generation of its newest submit still running
+        self._next_generation = itertools.count(1)
+        self._results = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-worker")
+        self._poll()
+
+    def submit(self, fn, *args, on_done=None, on_error=None, latest=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on a worker thread. on_done(result) or
+        on_error(exception) is then called on the Tk thread. Without
+        on_error, exceptions are printed like the rest of the app does.
+        With latest=key, neither is called if another submit with the same
+        key came after this one (its result is newer).
+        """
+        self.pending += 1
+        if self.pending == 1 and self.on_busy:
+            self.on_busy(True)
+        generation = None
+        if latest is not None:
+            generation = self._generations[latest] = next(self._next_generation)
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self._results.put((f, on_done, on_error, fn, latest, generation)))
+        return future
+
+    def _poll(self):
+        try:
+            while True:
+                future, on_done, on_error, fn, latest, generation = self._results.get_nowait()
+                if latest is not None:
+                    if self._generations.get(latest) == generation:
+                        del self._generations[latest]
+                    else:
+                        on_done = on_error = None  # superseded by a newer submit
+                self._finish(future, on_done, on_error, fn)
+        except queue.Empty:
+            pass
+        self.root.after(self.POLL_MS, self._poll)
+
+    def _finish(self, future, on_done, on_error, fn):
+        self.pending -= 1
+        if self.pending == 0 and self.on_busy:
+            self.on_busy(False)
+        try:
+            error = future.exception()
+            if error is not None:
+                if on_error:
+                    on_error(error)
+                else:
+                    print(f"{fn.__name__} error:", error)
+            elif on_done:
+                on_done(future.result())
+        except Exception as e:
+            # A callback failing (e.g. its window was closed meanwhile)
+            # must not stop the polling loop.
+            print("background callback error:", e)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark get_item_profitability against the old one-query-per-category
+approach, for a growing number of categories.
+
+Temporary categories named '__bench__<n>' are created (each mapped to up to
+8 existing raw materials), timed, and deleted again. Run it against a test
+database: python bench_item_profitability.py > bench_output.txt
+"""
+
+import time
+from psycopg2.extras import execute_values
+from db import get_connection
+from inventory import get_item_profitability, calculate_material_cost
+
+CATEGORY_COUNTS = [10, 100, 500, 1000]
+REPEATS = 3
+# Matched with left(), not LIKE, where "_" is a wildcard
+PREFIX = "__bench__"
+
+def n_plus_one_profitability():
+    """The previous implementation: one calculate_material_cost() call per category."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, selling_price FROM categories ORDER BY name")
+    categories = cur.fetchall()
+    conn.close()
+    results = []
+    for cat_id, name, selling_price in categories:
+        material_cost = calculate_material_cost(cat_id)
+        profit_per_unit = selling_price - material_cost
+        margin = round(float(profit_per_unit / selling_price) * 100, 2) if selling_price > 0 else 0
+        results.append((name, selling_price, material_cost, profit_per_unit, margin))
+    results.sort(key=lambda x: x[3], reverse=True)
+    return results
+
+def seed(count):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM raw_materials ORDER BY id LIMIT 8")
+    material_ids = [r[0] for r in cur.fetchall()]
+    cur.execute("SELECT COUNT(*) FROM categories WHERE left(name, length(%s)) = %s", (PREFIX, PREFIX))
+    existing = cur.fetchone()[0]
+    ids = execute_values(cur, "INSERT INTO categories (name, selling_price) VALUES %s RETURNING id",
+                         [(f"{PREFIX}{n}", 20) for n in range(existing, count)], fetch=True)
+    execute_values(cur, "INSERT INTO category_materials (category_id, material_id, amount_per_unit) VALUES %s",
+                   [(cid, mid, 0.05) for (cid,) in ids for mid in material_ids])
+    conn.commit()
+    conn.close()
+
+def cleanup():
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM categories WHERE left(name, length(%s)) = %s", (PREFIX, PREFIX))
+    conn.commit()
+    conn.close()
+
+def best_of(fn):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+if __name__ == "__main__":
+    if not get_connection():
+        raise SystemExit("Database connection failed")
+    print(f"{'categories':>10} | {'aggregate (ms)':>14} | {'N+1 (ms)':>10} | speedup")
+    print("-" * 52)
+    try:
+        for count in CATEGORY_COUNTS:
+            seed(count)
+            total = len(get_item_profitability())
+            aggregate_ms = best_of(get_item_profitability)
+            n_plus_one_ms = best_of(n_plus_one_profitability)
+            print(f"{total:>10} | {aggregate_ms:>14.1f} | {n_plus_one_ms:>10.1f} | {n_plus_one_ms / aggregate_ms:>6.1f}x")
+    finally:
+        cleanup()
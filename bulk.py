@@ -0,0 +1,368 @@
+# bulk.py
+"""
+Bulk CSV import and export of the setup tables: suppliers, raw materials,
+categories and recipes (category_materials). Used to set up a new outlet,
+or to copy a menu from one outlet to another.
+
+    python manage.py export setup/     # suppliers.csv, materials.csv, categories.csv, recipes.csv
+    python manage.py import setup/     # every one of those files that exists
+
+Rows refer to each other by name, never by id, so the files can be
+written by hand or in a spreadsheet and moved between databases:
+
+    suppliers.csv   name, whatsapp, phone, email, address, notes
+    materials.csv   name, quantity, unit, threshold, cost_per_unit, supplier
+    categories.csv  name, description, selling_price
+    recipes.csv     category, material, amount_per_unit
+
+Files are streamed with COPY into an all-text staging table, checked there
+with a few set-based queries (so a bad value is reported with its row
+instead of aborting the COPY), and then upserted with one statement per
+table. All files are imported in one transaction: if any row is wrong,
+nothing is changed. Importing the same file twice changes nothing the
+second time.
+
+Besides the names, only a recipe's amount is a required column (and a
+new material needs a unit). A column left out of a file keeps its current
+values; new rows get the defaults. So does a blank number (quantity,
+threshold, cost_per_unit, selling_price): an existing row keeps its
+value, a new one gets 0. A blank text cell clears it. A material's
+quantity, if given, replaces the stock on hand and the difference is
+written to the stock ledger (RESTOCK for a new material, ADJUSTMENT
+otherwise).
+"""
+
+import csv
+import os
+from db import get_connection
+from cache import invalidate
+
+# Kinds in dependency order: materials name their supplier, recipes their
+# category and material.
+KINDS = ("suppliers", "materials", "categories", "recipes")
+
+# Problems reported per import before giving up
+MAX_PROBLEMS = 20
+
+_DECIMAL = r"^\s*[0-9]*\.?[0-9]+\s*$"
+
+# Export query per kind; its columns are the CSV columns.
+_EXPORT = {
+    "suppliers": """
+        SELECT DISTINCT ON (name) name, whatsapp, phone, email, address, notes
+        FROM suppliers
+        ORDER BY name, id
+    """,
+    "materials": """
+        SELECT rm.name, rm.quantity, rm.unit, rm.threshold, rm.cost_per_unit, s.name AS supplier
+        FROM raw_materials rm
+        LEFT JOIN suppliers s ON s.id = rm.supplier_id
+        ORDER BY rm.name
+    """,
+    "categories": """
+        SELECT name, description, selling_price
+        FROM categories
+        ORDER BY name
+    """,
+    "recipes": """
+        SELECT c.name AS category, rm.name AS material, cm.amount_per_unit
+        FROM category_materials cm
+        JOIN categories c ON c.id = cm.category_id
+        JOIN raw_materials rm ON rm.id = cm.material_id
+        ORDER BY c.name, rm.name
+    """,
+}
+
+# kind -> (CSV columns, required columns)
+_COLUMNS = {
+    "suppliers": (("name", "whatsapp", "phone", "email", "address", "notes"), ("name",)),
+    "materials": (("name", "quantity", "unit", "threshold", "cost_per_unit", "supplier"), ("name",)),
+    "categories": (("name", "description", "selling_price"), ("name",)),
+    "recipes": (("category", "material", "amount_per_unit"), ("category", "material", "amount_per_unit")),
+}
+
+def _blank(column):
+    return f"coalesce(trim({column}), '') = ''"
+
+def _not_decimal(column, limit):
+    """Condition for a non-blank value that is not a number below limit."""
+    return (f"NOT {_blank(column)} AND (trim({column}) !~ '{_DECIMAL}' "
+            f"OR (CASE WHEN trim({column}) ~ '{_DECIMAL}' THEN trim({column})::numeric END) >= {limit})")
+
+def _duplicate(*columns):
+    """Condition for every row but the first with the same key."""
+    key = ", ".join(f"trim({c})" for c in columns)
+    return (f"csv_row IN (SELECT csv_row FROM (SELECT csv_row, row_number() OVER "
+            f"(PARTITION BY {key} ORDER BY csv_row) AS n FROM staging) d WHERE n > 1)")
+
+# kind -> [(condition on a staging row, problem)], checked in one query.
+# "staging" is the kind's staging table.
+_CHECKS = {
+    "suppliers": [
+        (_blank("name"), "name is required"),
+        (_duplicate("name"), "name appears more than once"),
+    ],
+    "materials": [
+        (_blank("name"), "name is required"),
+        (_blank("unit"), "unit is required"),
+        (_not_decimal("quantity", "1e8"), "quantity must be a number below 100000000"),
+        (_not_decimal("threshold", "1e8"), "threshold must be a number below 100000000"),
+        (_not_decimal("cost_per_unit", "1e8"), "cost_per_unit must be a number below 100000000"),
+        (f"NOT {_blank('supplier')} AND NOT EXISTS (SELECT 1 FROM suppliers s WHERE s.name = trim(supplier))",
+         "unknown supplier"),
+        (_duplicate("name"), "name appears more than once"),
+    ],
+    "categories": [
+        (_blank("name"), "name is required"),
+        (_not_decimal("selling_price", "1e8"), "selling_price must be a number below 100000000"),
+        (_duplicate("name"), "name appears more than once"),
+    ],
+    "recipes": [
+        (_blank("amount_per_unit"), "amount_per_unit is required"),
+        (_not_decimal("amount_per_unit", "1e7"), "amount_per_unit must be a number below 10000000"),
+        (f"NOT {_blank('amount_per_unit')} AND trim(amount_per_unit) ~ '{_DECIMAL}' "
+         "AND trim(amount_per_unit)::numeric = 0", "amount_per_unit must be more than 0"),
+        ("NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = trim(category))", "unknown category"),
+        ("NOT EXISTS (SELECT 1 FROM raw_materials rm WHERE rm.name = trim(material))", "unknown material"),
+        (_duplicate("category", "material"), "category and material appear together more than once"),
+    ],
+}
+
+# kind -> one statement upserting the checked staging rows; it returns
+# (inserted, updated). Rows that would not change are left alone, so they
+# send no cache notifications.
+_UPSERT = {
+    # suppliers.name is not unique (older databases hold duplicates), so
+    # update every supplier of that name and insert the names not found.
+    "suppliers": """
+        WITH incoming AS (
+            SELECT trim(name) AS name, nullif(trim(whatsapp), '') AS whatsapp,
+                   nullif(trim(phone), '') AS phone, nullif(trim(email), '') AS email,
+                   nullif(trim(address), '') AS address, nullif(trim(notes), '') AS notes
+            FROM staging
+        ), updated AS (
+            UPDATE suppliers s
+            SET whatsapp = i.whatsapp, phone = i.phone, email = i.email,
+                address = i.address, notes = i.notes, updated_at = CURRENT_TIMESTAMP
+            FROM incoming i
+            WHERE s.name = i.name
+              AND (s.whatsapp, s.phone, s.email, s.address, s.notes)
+                  IS DISTINCT FROM (i.whatsapp, i.phone, i.email, i.address, i.notes)
+            RETURNING s.name
+        ), inserted AS (
+            INSERT INTO suppliers (name, whatsapp, phone, email, address, notes)
+            SELECT name, whatsapp, phone, email, address, notes
+            FROM incoming i
+            WHERE NOT EXISTS (SELECT 1 FROM suppliers s WHERE s.name = i.name)
+            RETURNING id
+        )
+        SELECT (SELECT count(*) FROM inserted), (SELECT count(DISTINCT name) FROM updated)
+    """,
+    # Existing rows are locked in id order, like a sale locks them, and
+    # their old quantity goes to the stock ledger with the new one.
+    "materials": """
+        WITH incoming AS (
+            SELECT trim(st.name) AS name, nullif(trim(st.quantity), '')::numeric AS quantity,
+                   trim(st.unit) AS unit,
+                   nullif(trim(st.threshold), '')::numeric AS threshold,
+                   nullif(trim(st.cost_per_unit), '')::numeric AS cost_per_unit,
+                   s.id AS supplier_id
+            FROM staging st
+            LEFT JOIN (SELECT name, min(id) AS id FROM suppliers GROUP BY name) s ON s.name = trim(st.supplier)
+        ), old AS (
+            SELECT rm.id, rm.name, rm.quantity, rm.threshold, rm.cost_per_unit
+            FROM raw_materials rm
+            JOIN incoming i ON i.name = rm.name
+            ORDER BY rm.id
+            FOR UPDATE OF rm
+        ), upserted AS (
+            INSERT INTO raw_materials AS rm (name, quantity, unit, threshold, cost_per_unit, supplier_id, last_updated)
+            SELECT i.name, coalesce(i.quantity, o.quantity, 0), i.unit, coalesce(i.threshold, o.threshold, 0),
+                   coalesce(i.cost_per_unit, o.cost_per_unit, 0), i.supplier_id, CURRENT_TIMESTAMP
+            FROM incoming i
+            LEFT JOIN old o ON o.name = i.name
+            ON CONFLICT (name) DO UPDATE
+            SET quantity = EXCLUDED.quantity, unit = EXCLUDED.unit, threshold = EXCLUDED.threshold,
+                cost_per_unit = EXCLUDED.cost_per_unit, supplier_id = EXCLUDED.supplier_id,
+                last_updated = EXCLUDED.last_updated
+            WHERE (rm.quantity, rm.unit, rm.threshold, rm.cost_per_unit, rm.supplier_id)
+                  IS DISTINCT FROM (EXCLUDED.quantity, EXCLUDED.unit, EXCLUDED.threshold,
+                                    EXCLUDED.cost_per_unit, EXCLUDED.supplier_id)
+            RETURNING rm.id, rm.name, rm.quantity, xmax = 0 AS inserted
+        ), ledger AS (
+            INSERT INTO stock_transactions (
+                material_id, transaction_type, quantity_change,
+                previous_quantity, new_quantity, notes
+            )
+            SELECT u.id, CASE WHEN u.inserted THEN 'RESTOCK' ELSE 'ADJUSTMENT' END,
+                   u.quantity - coalesce(o.quantity, 0), coalesce(o.quantity, 0), u.quantity,
+                   CASE WHEN u.inserted THEN 'Initial stock' ELSE 'Imported from CSV' END
+            FROM upserted u
+            LEFT JOIN old o ON o.id = u.id
+            WHERE u.quantity <> coalesce(o.quantity, 0)
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    """,
+    "categories": """
+        WITH upserted AS (
+            INSERT INTO categories AS c (name, description, selling_price)
+            SELECT trim(st.name), nullif(trim(st.description), ''),
+                   coalesce(nullif(trim(st.selling_price), '')::numeric, old.selling_price, 0)
+            FROM staging st
+            LEFT JOIN categories old ON old.name = trim(st.name)
+            ON CONFLICT (name) DO UPDATE
+            SET description = EXCLUDED.description, selling_price = EXCLUDED.selling_price
+            WHERE (c.description, c.selling_price) IS DISTINCT FROM (EXCLUDED.description, EXCLUDED.selling_price)
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    """,
+    "recipes": """
+        WITH upserted AS (
+            INSERT INTO category_materials AS cm (category_id, material_id, amount_per_unit)
+            SELECT c.id, rm.id, trim(st.amount_per_unit)::numeric
+            FROM staging st
+            JOIN categories c ON c.name = trim(st.category)
+            JOIN raw_materials rm ON rm.name = trim(st.material)
+            ON CONFLICT (category_id, material_id) DO UPDATE
+            SET amount_per_unit = EXCLUDED.amount_per_unit
+            WHERE cm.amount_per_unit IS DISTINCT FROM EXCLUDED.amount_per_unit
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    """,
+}
+
+# Tables each kind writes, for the in-process cache
+_TABLES = {
+    "suppliers": ("suppliers",),
+    "materials": ("raw_materials",),
+    "categories": ("categories",),
+    "recipes": ("category_materials",),
+}
+
+def csv_path(directory, kind):
+    return os.path.join(directory, f"{kind}.csv")
+
+def export_csv(directory, kinds=KINDS):
+    """
+    Write <kind>.csv into directory (created if needed) for each kind, with
+    one COPY per file. Returns (True, {kind: rows}) or (False, error message).
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        cur = conn.cursor()
+        exported = {}
+        for kind in kinds:
+            with open(csv_path(directory, kind), "w", encoding="utf-8", newline="") as f:
+                cur.copy_expert(f"COPY ({_EXPORT[kind]}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            exported[kind] = cur.rowcount
+        conn.rollback()
+        conn.close()
+        return True, exported
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        return False, str(e)
+
+def _load_staging(cur, kind, f):
+    """
+    COPY an open CSV file into a fresh staging table (all text, with each
+    row's spreadsheet row number). Returns None, or a problem with the header.
+    """
+    columns, required = _COLUMNS[kind]
+    header = next(csv.reader([f.readline()]), [])
+    header = [name.strip().lower() for name in header]
+    unknown = [name for name in header if name not in columns]
+    if unknown:
+        return f"unknown column(s) {', '.join(unknown)}; expected {', '.join(columns)}"
+    missing = [name for name in required if name not in header]
+    if missing:
+        return f"missing column(s) {', '.join(missing)}"
+    cur.execute("DROP TABLE IF EXISTS staging")
+    cur.execute(f"""
+        CREATE TEMP TABLE staging (
+            csv_row BIGINT GENERATED BY DEFAULT AS IDENTITY (START WITH 2),
+            {', '.join(f'{name} TEXT' for name in columns)}
+        ) ON COMMIT DROP
+    """)
+    cur.copy_expert(f"COPY staging ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)", f)
+    # Columns left out of the file keep their current values: copy them
+    # in from the export query, which has the same columns.
+    absent = [name for name in columns if name not in header]
+    if absent:
+        cur.execute(f"""
+            UPDATE staging
+            SET {', '.join(f'{name} = existing.{name}::text' for name in absent)}
+            FROM ({_EXPORT[kind]}) existing
+            WHERE existing.name = trim(staging.name)
+        """)
+    # Row counts for the planner: the checks and the upsert join on it
+    cur.execute("ANALYZE staging")
+    return None
+
+def _check_staging(cur, kind):
+    """[(row number, problem), ...] for the staged rows, first MAX_PROBLEMS."""
+    checks = _CHECKS[kind]
+    cur.execute(
+        " UNION ALL ".join(f"SELECT csv_row, %s FROM staging WHERE {condition}"
+                           for condition, _problem in checks)
+        + " ORDER BY 1 LIMIT %s",
+        [problem for _condition, problem in checks] + [MAX_PROBLEMS])
+    return cur.fetchall()
+
+def import_csv(directory, kinds=None):
+    """
+    Import <kind>.csv from directory for each kind (default: every kind
+    whose file exists), all in one transaction.
+    Returns (True, {kind: {'rows', 'inserted', 'updated'}}) or
+    (False, error message listing the rows that are wrong).
+    """
+    if kinds is None:
+        kinds = [kind for kind in KINDS if os.path.exists(csv_path(directory, kind))]
+        if not kinds:
+            return False, f"No {', '.join(k + '.csv' for k in KINDS)} in {directory}"
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cur = conn.cursor()
+        imported = {}
+        for kind in sorted(kinds, key=KINDS.index):
+            name = os.path.basename(csv_path(directory, kind))
+            # utf-8-sig: spreadsheets often save CSV with a byte order mark
+            with open(csv_path(directory, kind), encoding="utf-8-sig", newline="") as f:
+                problem = _load_staging(cur, kind, f)
+            if problem:
+                conn.rollback()
+                conn.close()
+                return False, f"{name}: {problem}"
+            problems = _check_staging(cur, kind)
+            if problems:
+                conn.rollback()
+                conn.close()
+                return False, "\n".join(f"{name} row {row}: {problem}" for row, problem in problems)
+            cur.execute("SELECT count(*) FROM staging")
+            rows = cur.fetchone()[0]
+            cur.execute(_UPSERT[kind])
+            inserted, updated = cur.fetchone()
+            imported[kind] = {'rows': rows, 'inserted': inserted, 'updated': updated}
+        conn.commit()
+        for kind in imported:
+            for table in _TABLES[kind]:
+                invalidate(table)
+        conn.close()
+        return True, imported
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        return False, str(e)
@@ -0,0 +1,176 @@
+# cache.py
+"""
+Read-through cache for the small, hot tables (raw_materials, categories,
+category_materials, suppliers).
+
+Entries are dropped when PostgreSQL reports a change on the
+'cache_invalidation' channel (see notify_cache_invalidation in
+sql/database.sql), so every counter terminal sees the others' writes
+without polling. Writers in this process also call invalidate() right
+after their own commit, so they never read back their own stale rows.
+
+The cache only serves entries while the listener is connected; without
+it (listener not started, CANTEEN_CACHE=false, connection lost) every
+call goes straight to the database.
+"""
+
+import os
+import select
+import threading
+from functools import wraps
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from db import connect_direct
+
+CACHE_ENABLED = os.getenv("CANTEEN_CACHE", "true").lower() == "true"
+CHANNEL = "cache_invalidation"
+RECONNECT_AFTER = 5      # seconds between listener reconnect attempts
+PING_EVERY = 30          # seconds of silence before the listener pings
+
+_lock = threading.Lock()
+_entries = {}            # key -> value
+_tags = {}               # (table, id or None) -> set of keys
+_generation = 0          # bumped on every invalidation
+_listening = False
+_stop = threading.Event()
+_thread = None
+_counters = {}           # function name -> [hits, misses]
+
+def _drop(tag):
+    for key in _tags.pop(tag, ()):
+        _entries.pop(key, None)
+
+def invalidate(table, row_id=None):
+    """
+    Forget cached results that depend on a table. With row_id, only
+    entries for that row and whole-table entries are dropped.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        if row_id is None:
+            for tag in [t for t in _tags if t[0] == table]:
+                _drop(tag)
+        else:
+            _drop((table, row_id))
+            _drop((table, None))
+
+def clear():
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.clear()
+        _tags.clear()
+
+def cached(*tables, by_id=None):
+    """
+    Decorator for read functions. tables are the tables the result depends
+    on as a whole; by_id names the table whose row id is the function's
+    first argument (so a change to another row leaves the entry alone).
+    Empty results ([] / None, which is also what failures return) are not
+    cached. Lists are returned as copies.
+    """
+    def decorator(fn):
+        name = fn.__name__
+        _counters[name] = [0, 0]
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (name,) + args + tuple(sorted(kwargs.items()))
+            with _lock:
+                counter = _counters[name]
+                if _listening and key in _entries:
+                    counter[0] += 1
+                    value = _entries[key]
+                    return list(value) if isinstance(value, list) else value
+                counter[1] += 1
+                generation = _generation
+                listening = _listening
+            value = fn(*args, **kwargs)
+            if not value or not listening:
+                return value
+            with _lock:
+                # Skip storing if something was invalidated while we read
+                if _generation == generation and _listening:
+                    _entries[key] = value
+                    tags = [(table, None) for table in tables]
+                    if by_id:
+                        row_id = args[0] if args else next(iter(kwargs.values()))
+                        tags.append((by_id, row_id))
+                    for tag in tags:
+                        _tags.setdefault(tag, set()).add(key)
+            return list(value) if isinstance(value, list) else value
+        return wrapper
+    return decorator
+
+def stats():
+    """Hit/miss counters: {'hits', 'misses', 'entries', 'listening', 'by_function'}."""
+    with _lock:
+        by_function = {name: {"hits": h, "misses": m} for name, (h, m) in _counters.items()}
+        return {
+            "hits": sum(c["hits"] for c in by_function.values()),
+            "misses": sum(c["misses"] for c in by_function.values()),
+            "entries": len(_entries),
+            "listening": _listening,
+            "by_function": by_function
+        }
+
+def _set_listening(value):
+    global _listening
+    with _lock:
+        _listening = value
+    # Anything cached before (re)connecting may have missed notifications
+    clear()
+
+def _handle(payload):
+    table, _, row_id = payload.partition(":")
+    try:
+        invalidate(table, int(row_id) if row_id else None)
+    except ValueError:
+        invalidate(table)
+
+def _listen_loop():
+    while not _stop.is_set():
+        conn = connect_direct()
+        if conn is None:
+            _stop.wait(RECONNECT_AFTER)
+            continue
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CHANNEL}")
+            _set_listening(True)
+            idle = 0.0
+            while not _stop.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    idle += 1.0
+                    if idle >= PING_EVERY:
+                        cur.execute("SELECT 1")
+                        idle = 0.0
+                    continue
+                idle = 0.0
+                conn.poll()
+                while conn.notifies:
+                    _handle(conn.notifies.pop(0).payload)
+        except Exception as e:
+            print("cache listener error:", e)
+        finally:
+            _set_listening(False)
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _stop.wait(RECONNECT_AFTER)
+
+def start_listener():
+    """Start the background LISTEN thread (no-op if disabled or running)."""
+    global _thread
+    if not CACHE_ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_listen_loop, name="cache-listener", daemon=True)
+    _thread.start()
+
+def stop_listener():
+    _stop.set()
+    if _thread:
+        _thread.join(timeout=2)
@@ -1,15 +1,16 @@
 # categories.py
-from db import get_connection
+from db import get_connection, connection
+from cache import cached, invalidate
+import mirror
 
+@cached("categories")
 def fetch_categories():
-    conn = get_connection()
-    if not conn:
-        return []
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, description, selling_price FROM categories ORDER BY id")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with connection() as conn:
+        if not conn:
+            return mirror.fetch_categories()
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, description, selling_price FROM categories ORDER BY id")
+        return cur.fetchall()
 
 def create_category(name, description="", selling_price=0.0):
     conn = get_connection()
@@ -21,6 +22,7 @@ def create_category(name, description="", selling_price=0.0):
                    (name, description, selling_price))
         cid = cur.fetchone()[0]
         conn.commit()
+        invalidate("categories", cid)
         conn.close()
         return True, cid
     except Exception as e:
@@ -40,6 +42,7 @@ def update_category(category_id, name, description="", selling_price=0.0):
         cur.execute("UPDATE categories SET name = %s, description = %s, selling_price = %s WHERE id = %s", 
                    (name, description, selling_price, category_id))
         conn.commit()
+        invalidate("categories", category_id)
         conn.close()
         return True, None
     except Exception as e:
@@ -61,6 +64,8 @@ def delete_category(category_id):
         # Then delete the category
         cur.execute("DELETE FROM categories WHERE id = %s", (category_id,))
         conn.commit()
+        invalidate("categories", category_id)
+        invalidate("category_materials", category_id)
         conn.close()
         return True, None
     except Exception as e:
@@ -84,6 +89,7 @@ def set_category_material(category_id, material_id, amount_per_unit):
             DO UPDATE SET amount_per_unit = EXCLUDED.amount_per_unit
         """, (category_id, material_id, amount_per_unit))
         conn.commit()
+        invalidate("category_materials", category_id)
         conn.close()
         return True, None
     except Exception as e:
@@ -94,17 +100,16 @@ def set_category_material(category_id, material_id, amount_per_unit):
             pass
         return False, str(e)
 
+@cached("raw_materials", by_id="category_materials")
 def get_category_materials(category_id):
-    conn = get_connection()
-    if not conn:
-        return []
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT cm.material_id, rm.name, cm.amount_per_unit, rm.quantity, rm.unit, rm.threshold, rm.supplier_id
-        FROM category_materials cm
-        JOIN raw_materials rm ON cm.material_id = rm.id
-        WHERE cm.category_id = %s
-    """, (category_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with connection() as conn:
+        if not conn:
+            return mirror.get_category_materials(category_id)
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT cm.material_id, rm.name, cm.amount_per_unit, rm.quantity, rm.unit, rm.threshold, rm.supplier_id
+            FROM category_materials cm
+            JOIN raw_materials rm ON cm.material_id = rm.id
+            WHERE cm.category_id = %s
+        """, (category_id,))
+        return cur.fetchall()
@@ -1,10 +1,178 @@
 # db.py
 import os
+import time
+import random
+import threading
+import functools
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool as pg_pool
+
+# Pool settings (override with environment variables):
+#   PGPOOL_MIN (default: 2)       connections opened up front and kept
+#                                 open for reuse (extra ones are closed
+#                                 when handed back)
+#   PGPOOL_MAX (default: 10)      hard cap on open connections
+#   PGPOOL_THREADED (default: false)  use the thread-safe pool
+#   PGPOOL_PING_AFTER (default: 30)   seconds a connection may sit idle
+#                                     before it is pinged on checkout
+POOL_MIN = int(os.getenv("PGPOOL_MIN", 2))
+POOL_MAX = int(os.getenv("PGPOOL_MAX", 10))
+POOL_THREADED = os.getenv("PGPOOL_THREADED", "false").lower() == "true"
+POOL_PING_AFTER = float(os.getenv("PGPOOL_PING_AFTER", 30))
+
+# Transactions aborted by a deadlock or serialization failure lost a race
+# with another terminal and are simply run again (see retry_on_conflict):
+#   PG_TX_ATTEMPTS (default: 4)      tries before giving up
+#   PG_TX_BACKOFF (default: 0.05)    base backoff in seconds, doubled per retry
+TX_ATTEMPTS = int(os.getenv("PG_TX_ATTEMPTS", 4))
+TX_BACKOFF = float(os.getenv("PG_TX_BACKOFF", 0.05))
+RETRYABLE_SQLSTATES = ("40001", "40P01")  # serialization_failure, deadlock_detected
+# SQLSTATE classes for data the server refuses outright: running the same
+# statement again can never succeed
+REFUSED_SQLSTATE_CLASSES = ("22", "23")  # data_exception, integrity_constraint_violation
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}
+
+def _connect_kwargs():
+    return dict(
+        host=os.getenv("PGHOST", "localhost"),
+        port=int(os.getenv("PGPORT", 5432)),
+        database=os.getenv("PGDATABASE", "canteen_db"),
+        user=os.getenv("PGUSER", "postgres"),
+        password=os.getenv("PGPASSWORD", "123456789")
+    )
+
+def connect_direct():
+    """
+    Opens a dedicated (unpooled) connection, for long-lived jobs such as
+    LISTEN loops or bulk loads. Returns None on failure.
+    """
+    try:
+        return psycopg2.connect(**_connect_kwargs())
+    except Exception as e:
+        print("Database connection error:", e)
+        return None
+
+def init_pool(minconn=None, maxconn=None, threaded=None):
+    """
+    (Re)creates the connection pool. Called lazily by get_connection();
+    call it explicitly to change the size or switch to the thread-safe pool
+    (needed as soon as connections are used from more than one thread).
+    The choice is remembered, so a pool recreated lazily after a failed
+    connect keeps the same settings.
+    """
+    global _pool, POOL_MIN, POOL_MAX, POOL_THREADED
+    POOL_MIN = minconn = POOL_MIN if minconn is None else minconn
+    POOL_MAX = maxconn = POOL_MAX if maxconn is None else maxconn
+    POOL_THREADED = threaded = POOL_THREADED if threaded is None else threaded
+    pool_class = pg_pool.ThreadedConnectionPool if threaded else pg_pool.SimpleConnectionPool
+    with _pool_lock:
+        old = _pool
+        _pool = pool_class(minconn, maxconn, **_connect_kwargs())
+        _last_used.clear()
+    if old is not None:
+        old.closeall()
+    return _pool
+
+def close_pool():
+    """Closes every pooled connection (e.g. on application exit)."""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, None
+        _last_used.clear()
+    if old is not None:
+        old.closeall()
+
+def _get_pool():
+    if _pool is None:
+        init_pool()
+    return _pool
+
+def _is_alive(conn):
+    """Liveness check: cheap for recently used connections, a ping otherwise."""
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < POOL_PING_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchone()
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+class PooledConnection:
+    """
+    Thin wrapper around a pooled psycopg2 connection. Everything is delegated
+    to the real connection, except close(), which hands it back to the pool
+    instead of tearing down the TCP session. Used as a context manager it
+    commits like psycopg2's "with conn:" (rolls back if the block raises),
+    then returns the connection. A wrapper dropped without close() returns
+    its connection when it is garbage collected, and says so.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        _last_used[id(conn)] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        except Exception:
+            # The pool was closed or replaced meanwhile; just drop the connection
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __del__(self):
+        # A caller that never closed the connection (e.g. an early return
+        # on an error path) must not hold its pool slot forever: hand it
+        # back, rolled back, once the wrapper is garbage collected.
+        if self.__dict__.get("_conn") is None:
+            return
+        print("PooledConnection: connection garbage collected without close(); rolled back and returned to the pool")
+        try:
+            self._conn.rollback()
+        except Exception:
+            pass
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._conn is not None and exc_type is None:
+                self._conn.commit()
+            elif self._conn is not None:
+                try:
+                    self._conn.rollback()
+                except Exception:
+                    pass
+        finally:
+            self.close()
+        return False
 
 def get_connection():
     """
-    Returns a new psycopg2 connection or None on failure.
+    Returns a pooled psycopg2 connection or None on failure.
+    conn.close() returns the connection to the pool, so existing
+    open/query/close code keeps working unchanged.
     Configure DB via environment variables:
       PGHOST (default: localhost)
       PGPORT (default: 5432)
@@ -13,14 +181,74 @@ def get_connection():
       PGPASSWORD
     """
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("PGHOST", "localhost"),
-            port=int(os.getenv("PGPORT", 5432)),
-            database=os.getenv("PGDATABASE", "canteen_db"),
-            user=os.getenv("PGUSER", "postgres"),
-            password=os.getenv("PGPASSWORD", "123456789")
-        )
-        return conn
+        pool = _get_pool()
+        # A dead connection (server restart, network drop) is discarded and
+        # replaced; give up after a few tries rather than spinning.
+        for _ in range(3):
+            conn = pool.getconn()
+            if _is_alive(conn):
+                return PooledConnection(pool, conn)
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("no live connection available")
     except Exception as e:
         print("Database connection error:", e)
         return None
+
+@contextmanager
+def connection():
+    """
+    Context manager around get_connection(): yields a pooled connection
+    (or None if the database is unreachable), commits if the block
+    completes, rolls back if it raises, and always returns the connection
+    to the pool.
+
+        with connection() as conn:
+            if not conn:
+                return []
+            ...
+    """
+    conn = get_connection()
+    if conn is None:
+        yield None
+        return
+    with conn:
+        yield conn
+
+def is_retryable(error):
+    """True if error aborted the transaction only because of a concurrent one."""
+    return getattr(error, "pgcode", None) in RETRYABLE_SQLSTATES
+
+def is_refusal(error):
+    """True if the server refused the data itself (bad value, constraint violation)."""
+    return (getattr(error, "pgcode", None) or "")[:2] in REFUSED_SQLSTATE_CLASSES
+
+def is_disconnect(error):
+    """True if error is a lost connection rather than an error reported by the server."""
+    return (isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            and getattr(error, "pgcode", None) is None)
+
+def retry_on_conflict(fn=None, *, gave_up=None):
+    """
+    Decorator for transaction functions returning (ok, result). fn
+    re-raises the psycopg2 errors it is safe to run again for (after
+    rolling back and closing its connection): deadlocks and serialization
+    failures, or for idempotent calls also lost connections. It is then
+    run again after a short randomized backoff, up to TX_ATTEMPTS times;
+    then (False, error message) is returned, or gave_up(error) if given:
+
+        @retry_on_conflict(gave_up=lambda error: None)
+    """
+    if fn is None:
+        return functools.partial(retry_on_conflict, gave_up=gave_up)
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(TX_ATTEMPTS):
+            try:
+                return fn(*args, **kwargs)
+            except psycopg2.Error as e:
+                if attempt == TX_ATTEMPTS - 1:
+                    print(f"{fn.__name__} error:", e)
+                    return gave_up(e) if gave_up else (False, str(e))
+                time.sleep(TX_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
@@ -0,0 +1,183 @@
+# forecast.py
+"""
+Demand forecasting: how many units of every category will sell on a day.
+
+Each category gets an additive exponential smoothing model with weekly
+seasonality, fitted on its daily quantity sold:
+
+    forecast  = level + season[weekday]
+    error     = sold - forecast
+    level    += alpha * error
+    season[weekday] += gamma * error
+
+All categories and every (alpha, gamma) pair in the grid below are
+stepped together as NumPy arrays, one day at a time. Each category then
+uses the pair with the smallest one-step-ahead squared error so far. The
+state is kept between calls and only days that have closed since the
+last fit (up to yesterday) are stepped through, so after the first fit
+an update is a handful of array operations.
+
+Sales can still land in a day already fitted (a journal flush or offline
+replay, a backdated sale). The daily quantities fitted are kept, and if
+any of them no longer matches the sales arrays the models are fitted
+again from the first day.
+
+Daily quantities come from the in-memory sales arrays (analytics.py).
+"""
+
+import threading
+from datetime import date, timedelta
+import numpy as np
+from analytics import sales_analytics
+from categories import fetch_categories
+
+# Smoothing parameter grid; gamma <= 1 - alpha keeps every model stable
+ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5)
+GAMMAS = (0.05, 0.1, 0.2, 0.3)
+# Days of history used to initialise level and seasonality
+INIT_DAYS = 14
+
+_EPOCH = date(1970, 1, 1)
+
+def _day_number(day):
+    return (day - _EPOCH).days
+
+def _weekday(day_number):
+    return (day_number + _EPOCH.weekday()) % 7
+
+class DemandForecaster:
+    """
+    Per-category, per-weekday demand models over the closed days of
+    daily_sales, kept up to date incrementally by update().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        grid = [(a, g) for a in ALPHAS for g in GAMMAS if g <= 1 - a]
+        self.alphas = np.array([a for a, _ in grid])[:, None]
+        self.gammas = np.array([g for _, g in grid])[:, None]
+        self._reset(np.empty(0, dtype=np.int64))
+
+    def _reset(self, category_ids):
+        self.category_ids = category_ids
+        n_grid, n_categories = len(self.alphas), len(category_ids)
+        self.level = np.zeros((n_grid, n_categories))
+        self.season = np.zeros((n_grid, n_categories, 7))
+        self.sse = np.zeros((n_grid, n_categories))
+        # Last day number stepped through, None until initialised
+        self.fitted_through = None
+        # Daily quantities fitted so far, one row per day from first_day
+        self.first_day = None
+        self.fitted = None
+
+    def _daily_quantities(self, buckets, first_day, last_day):
+        """Quantity sold per day and category as a (days, categories) array."""
+        n_days, n_categories = last_day - first_day + 1, len(self.category_ids)
+        positions = np.searchsorted(self.category_ids, buckets["category_id"])
+        positions = np.minimum(positions, max(n_categories - 1, 0))
+        keep = ((buckets["day"] >= first_day) & (buckets["day"] <= last_day)
+                & (self.category_ids[positions] == buckets["category_id"]))
+        slots = (buckets["day"][keep].astype(np.intp) - first_day) * n_categories + positions[keep]
+        sold = np.bincount(slots, weights=buckets["quantity"][keep], minlength=n_days * n_categories)
+        return sold.reshape(n_days, n_categories)
+
+    def _initialise(self, history, first_day):
+        """Level and weekly seasonality from the first INIT_DAYS days."""
+        start = history[:INIT_DAYS]
+        level = start.mean(axis=0)
+        season = np.zeros((len(level), 7))
+        weekdays = _weekday(np.arange(first_day, first_day + INIT_DAYS))
+        for weekday in range(7):
+            season[:, weekday] = start[weekdays == weekday].mean(axis=0) - level
+        self.level[:] = level
+        self.season[:] = season
+        self.fitted_through = first_day + INIT_DAYS - 1
+
+    def _stale(self, buckets):
+        """True if the days already fitted no longer match the sales arrays."""
+        if self.fitted_through is None:
+            return False
+        if len(buckets["day"]) and int(buckets["day"].min()) < self.first_day:
+            return True
+        return not np.array_equal(self._daily_quantities(buckets, self.first_day, self.fitted_through),
+                                  self.fitted)
+
+    def _step(self, history, first_day):
+        """Run the smoothing recursions over history, one row per day from first_day."""
+        for offset, sold in enumerate(history):
+            weekday = _weekday(first_day + offset)
+            error = sold - (self.level + self.season[:, :, weekday])
+            self.sse += error * error
+            self.level += self.alphas * error
+            self.season[:, :, weekday] += self.gammas * error
+        self.fitted_through = first_day + len(history) - 1
+
+    def update(self, today=None):
+        """
+        Fit every day that has closed (up to yesterday) since the last call.
+        A change in the set of categories, or in the sales of a day already
+        fitted, starts the fit over.
+        Returns True if a model is available.
+        """
+        today = today or date.today()
+        with self._lock:
+            analytics = sales_analytics()
+            if analytics.refresh() is None and not analytics.loaded:
+                return self.fitted_through is not None
+            category_ids = np.array(sorted(row[0] for row in fetch_categories()), dtype=np.int64)
+            buckets = analytics.snapshot()
+            if not np.array_equal(category_ids, self.category_ids) or self._stale(buckets):
+                self._reset(category_ids)
+            last_closed = _day_number(today) - 1
+
+            if self.fitted_through is None:
+                if not len(buckets["day"]) or not len(category_ids):
+                    return False
+                first_day = int(buckets["day"].min())
+                if last_closed - first_day + 1 < INIT_DAYS:
+                    return False
+                history = self._daily_quantities(buckets, first_day, last_closed)
+                self.first_day, self.fitted = first_day, history
+                self._initialise(history, first_day)
+                history, first_day = history[INIT_DAYS:], first_day + INIT_DAYS
+            elif last_closed > self.fitted_through:
+                first_day = self.fitted_through + 1
+                history = self._daily_quantities(buckets, first_day, last_closed)
+                self.fitted = np.concatenate([self.fitted, history])
+            else:
+                return True
+            self._step(history, first_day)
+            return True
+
+    def forecast(self, day):
+        """Expected units sold on day as {category_id: units}, empty before the first fit."""
+        with self._lock:
+            if self.fitted_through is None:
+                return {}
+            best = np.argmin(self.sse, axis=0)
+            columns = np.arange(len(self.category_ids))
+            expected = self.level[best, columns] + self.season[best, columns, _weekday(_day_number(day))]
+            return dict(zip(self.category_ids.tolist(), np.maximum(expected, 0).tolist()))
+
+_forecaster = None
+_forecaster_lock = threading.Lock()
+
+def demand_forecaster():
+    """The shared DemandForecaster instance."""
+    global _forecaster
+    with _forecaster_lock:
+        if _forecaster is None:
+            _forecaster = DemandForecaster()
+        return _forecaster
+
+def expected_demand(day=None):
+    """
+    Expected units sold per category on day (default tomorrow), as
+    {category_id: units}. Empty when there is less than INIT_DAYS days
+    of sales history or the database is unavailable.
+    """
+    day = day or date.today() + timedelta(days=1)
+    forecaster = demand_forecaster()
+    if not forecaster.update():
+        return {}
+    return forecaster.forecast(day)
@@ -1,30 +1,79 @@
 # inventory.py
-from db import get_connection
-from datetime import datetime
+import os
+import io
+import csv
+from db import get_connection, connection, is_retryable, is_refusal, is_disconnect, retry_on_conflict
+import math
+from datetime import datetime, timedelta
+from decimal import Decimal
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+from production import load_recipe_matrix, production_capacity, material_requirements, plan_production
+from forecast import expected_demand
+from cache import cached, invalidate
+import mirror
+from money import to_paise, to_milli, line_total, recipe_cost, weighted_cost, margin_percent, rupees
 
+@cached("raw_materials")
 def fetch_inventory():
-    conn = get_connection()
-    if not conn:
-        return []
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, quantity, unit, threshold, cost_per_unit, supplier_id FROM raw_materials ORDER BY id")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with connection() as conn:
+        if not conn:
+            return mirror.fetch_inventory()
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, quantity, unit, threshold, cost_per_unit, supplier_id FROM raw_materials ORDER BY id")
+        return cur.fetchall()
 
+@cached(by_id="raw_materials")
 def get_material(material_id):
-    conn = get_connection()
-    if not conn:
-        return None
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, quantity, unit, threshold, cost_per_unit, supplier_id FROM raw_materials WHERE id = %s", (material_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with connection() as conn:
+        if not conn:
+            return None
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, quantity, unit, threshold, cost_per_unit, supplier_id FROM raw_materials WHERE id = %s", (material_id,))
+        return cur.fetchone()
+
+STOCK_TRANSACTION_TYPES = ("RESTOCK", "SALE", "ADJUSTMENT", "WASTE", "BATCH")
+
+# Strict stock mode: refuse any sale that needs more of a material than is
+# in stock, instead of clamping the material at zero
+# (CANTEEN_STRICT_STOCK=true, or checkout_order(..., strict=True)).
+STRICT_STOCK = os.getenv("CANTEEN_STRICT_STOCK", "false").lower() == "true"
+
+# Price of a cold drink brand sale when its category has no selling price
+DEFAULT_DRINK_PRICE = Decimal("25.00")
+
+def unit_price(selling_price, brand=None):
+    """The price a line is sold at: the category's, or DEFAULT_DRINK_PRICE for a brand with none set."""
+    if not selling_price and brand:
+        return DEFAULT_DRINK_PRICE
+    return selling_price or 0
 
-def adjust_material_quantity(material_id, delta):
+def _write_ledger(cur, entries, op_key=None, created_at=None):
+    """
+    Append stock movements to stock_transactions with one multi-row INSERT,
+    inside the caller's transaction.
+    entries: [(material_id, transaction_type, quantity_change, previous_quantity,
+               new_quantity, reference_id, notes), ...]
+    op_key and created_at are set on every row for a movement replayed
+    from the offline journal (created_at defaults to now).
+    """
+    if not entries:
+        return
+    execute_values(cur, """
+        INSERT INTO stock_transactions (
+            material_id, transaction_type, quantity_change,
+            previous_quantity, new_quantity, reference_id, notes, op_key, created_at
+        ) VALUES %s
+    """, [tuple(entry) + (op_key, created_at) for entry in entries],
+        template="(%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))")
+
+def adjust_material_quantity(material_id, delta, transaction_type=None, notes=None, op_key=None, created_at=None):
     """
     delta is negative to reduce, positive to increase.
+    The movement is written to the stock ledger as transaction_type
+    (default RESTOCK for additions, ADJUSTMENT for reductions).
+    op_key/created_at: see _write_ledger().
     Returns new_quantity or None on failure.
     """
     conn = get_connection()
@@ -44,7 +93,12 @@ def adjust_material_quantity(material_id, delta):
             new_q = 0.0
         cur.execute("UPDATE raw_materials SET quantity = %s, last_updated = %s WHERE id = %s",
                     (new_q, datetime.now(), material_id))
+        if transaction_type is None:
+            transaction_type = "RESTOCK" if delta > 0 else "ADJUSTMENT"
+        _write_ledger(cur, [(material_id, transaction_type, new_q - current, current, new_q, None, notes)],
+                      op_key, created_at)
         conn.commit()
+        invalidate("raw_materials", material_id)
         conn.close()
         return new_q
     except Exception as e:
@@ -56,6 +110,10 @@ def adjust_material_quantity(material_id, delta):
         print("adjust_material_quantity error:", e)
         return None
 
+def record_waste(material_id, quantity, notes=None, op_key=None):
+    """Write off spoiled or spilled stock. Returns new_quantity or None on failure."""
+    return adjust_material_quantity(material_id, -abs(quantity), "WASTE", notes, op_key)
+
 def add_material(name, quantity, unit, threshold, cost_per_unit=0.0, supplier_id=None):
     """Add new raw material to inventory"""
     conn = get_connection()
@@ -68,7 +126,10 @@ def add_material(name, quantity, unit, threshold, cost_per_unit=0.0, supplier_id
             VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
         """, (name, quantity, unit, threshold, cost_per_unit, supplier_id, datetime.now()))
         material_id = cur.fetchone()[0]
+        if quantity:
+            _write_ledger(cur, [(material_id, "RESTOCK", quantity, 0, quantity, None, "Initial stock")])
         conn.commit()
+        invalidate("raw_materials", material_id)
         conn.close()
         return True, material_id
     except Exception as e:
@@ -80,22 +141,31 @@ def add_material(name, quantity, unit, threshold, cost_per_unit=0.0, supplier_id
         return False, str(e)
 
 def update_material(material_id, name, quantity, unit, threshold, cost_per_unit=0.0, supplier_id=None):
-    """Update existing raw material"""
+    """Update existing raw material. A changed quantity is logged as an ADJUSTMENT."""
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
         cur = conn.cursor()
+        # The locked sub-select hands back the quantity as it was before this update
         cur.execute("""
-            UPDATE raw_materials 
+            UPDATE raw_materials AS rm
             SET name = %s, quantity = %s, unit = %s, threshold = %s, cost_per_unit = %s, supplier_id = %s, last_updated = %s 
-            WHERE id = %s
+            FROM (SELECT id, quantity FROM raw_materials WHERE id = %s FOR UPDATE) AS old
+            WHERE rm.id = old.id
+            RETURNING old.quantity, rm.quantity
         """, (name, quantity, unit, threshold, cost_per_unit, supplier_id, datetime.now(), material_id))
-        if cur.rowcount == 0:
+        row = cur.fetchone()
+        if not row:
             conn.rollback()
             conn.close()
             return False, "Material not found"
+        previous_q, new_q = row
+        if previous_q != new_q:
+            _write_ledger(cur, [(material_id, "ADJUSTMENT", new_q - previous_q, previous_q, new_q,
+                                 None, "Edited in inventory")])
         conn.commit()
+        invalidate("raw_materials", material_id)
         conn.close()
         return True, "Material updated successfully"
     except Exception as e:
@@ -119,6 +189,8 @@ def delete_material(material_id):
             conn.close()
             return False, "Material not found"
         conn.commit()
+        invalidate("raw_materials", material_id)
+        invalidate("category_materials")
         conn.close()
         return True, "Material deleted successfully"
     except Exception as e:
@@ -129,32 +201,82 @@ def delete_material(material_id):
             pass
         return False, str(e)
 
-def get_stock_history(material_id, limit=50):
-    """Get stock transaction history for a material"""
+STOCK_HISTORY_PAGE_SIZE = 500
+
+def get_stock_history_page(material_id, after=None, before=None, limit=STOCK_HISTORY_PAGE_SIZE,
+                           start_date=None, end_date=None):
+    """
+    One page of a material's stock ledger, newest first, as
+    (id, created_at, transaction_type, quantity_change, previous_quantity,
+     new_quantity, reference_id, notes) rows.
+
+    Keyset pagination on (created_at, id): after= is the key of the last
+    row already seen (next, older page), before= the key of the first one
+    (previous, newer page). start_date/end_date bound created_at by day,
+    inclusive. Returns None on failure.
+    """
+    conditions = ["material_id = %(material_id)s"]
+    params = {"material_id": material_id, "limit": limit}
+    if start_date:
+        conditions.append("created_at >= %(start_date)s")
+        params["start_date"] = start_date
+    if end_date:
+        conditions.append("created_at < %(end_date)s::date + 1")
+        params["end_date"] = end_date
+    order = "DESC"
+    if after:
+        conditions.append("(created_at, id) < (%(key_time)s, %(key_id)s)")
+        params.update(key_time=after[0], key_id=after[1])
+    elif before:
+        conditions.append("(created_at, id) > (%(key_time)s, %(key_id)s)")
+        params.update(key_time=before[0], key_id=before[1])
+        order = "ASC"
+
     conn = get_connection()
     if not conn:
-        return []
+        return None
     try:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT st.transaction_type, st.quantity_change, st.previous_quantity, 
-                   st.new_quantity, st.notes, st.created_at, rm.name as material_name
-            FROM stock_transactions st 
-            JOIN raw_materials rm ON st.material_id = rm.id 
-            WHERE st.material_id = %s 
-            ORDER BY st.created_at DESC 
-            LIMIT %s
-        """, (material_id, limit))
+        cur.execute(f"""
+            SELECT id, created_at, transaction_type, quantity_change, previous_quantity,
+                   new_quantity, reference_id, notes
+            FROM stock_transactions
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at {order}, id {order}
+            LIMIT %(limit)s
+        """, params)
         rows = cur.fetchall()
         conn.close()
-        return rows
+        return rows[::-1] if before else rows
     except Exception as e:
         try:
             conn.close()
         except:
             pass
-        print("get_stock_history error:", e)
-        return []
+        print("get_stock_history_page error:", e)
+        return None
+
+def iter_stock_history(material_id, start_date=None, end_date=None, page_size=STOCK_HISTORY_PAGE_SIZE):
+    """
+    Stream a material's whole ledger, newest first, one page at a time, so
+    auditing a busy material takes constant memory. Yields the rows of
+    get_stock_history_page(); the connection is only held while a page is
+    being fetched. Stops early (after printing the error) if a page fails.
+    """
+    after = None
+    while True:
+        rows = get_stock_history_page(material_id, after=after, limit=page_size,
+                                      start_date=start_date, end_date=end_date)
+        if not rows:
+            return
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+def get_stock_history(material_id, limit=50):
+    """Latest stock transactions for a material (first page of the ledger)"""
+    return get_stock_history_page(material_id, limit=limit) or []
 
 def get_low_stock_materials():
     """Get all materials that are at or below threshold"""
@@ -182,10 +304,10 @@ def get_low_stock_materials():
         return []
 
 def calculate_material_cost(category_id):
-    """Calculate total material cost for one unit of a category"""
+    """Calculate total material cost for one unit of a category, in rupees (Decimal, exact to the paisa)"""
     conn = get_connection()
     if not conn:
-        return 0.0
+        return rupees(0)
     try:
         cur = conn.cursor()
         # Get all materials used in this category with their costs
@@ -196,47 +318,71 @@ def calculate_material_cost(category_id):
             WHERE cm.category_id = %s
         """, (category_id,))
         
-        total_cost = 0.0
-        for amount_per_unit, cost_per_unit in cur.fetchall():
-            if amount_per_unit and cost_per_unit:
-                total_cost += float(amount_per_unit) * float(cost_per_unit)
+        rows = cur.fetchall()
+        total_cost = recipe_cost([to_milli(amount) for amount, _cost in rows],
+                                 [to_paise(cost) for _amount, cost in rows])
         
         conn.close()
-        return total_cost
+        return rupees(total_cost)
     except Exception as e:
         try:
             conn.close()
         except:
             pass
         print("calculate_material_cost error:", e)
-        return 0.0
+        return rupees(0)
 
-def record_sale_with_profit(category_id, quantity_sold, unit_price):
-    """Record a sale with automatic profit calculation"""
+def record_sale_with_profit(category_id, quantity_sold, unit_price, order_key=None):
+    """
+    Record a sale with automatic profit calculation.
+    With an order_key, submitting the same sale again returns the first
+    result instead of recording it twice.
+    """
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
         cur = conn.cursor()
+        if order_key:
+            cur.execute("""
+                SELECT id, material_cost_per_unit, profit_per_unit, total_profit, unit_price
+                FROM daily_sales WHERE order_key = %s AND order_line = 0
+            """, (order_key,))
+            row = cur.fetchone()
+            if row:
+                conn.rollback()
+                conn.close()
+                sale_id, material_cost, profit_per_unit, total_profit, price = row
+                return True, {
+                    'sale_id': sale_id,
+                    'material_cost': material_cost,
+                    'profit_per_unit': profit_per_unit,
+                    'total_profit': total_profit,
+                    'profit_margin': margin_percent(to_paise(profit_per_unit), to_paise(price)),
+                    'replayed': True
+                }
         
-        # Calculate material cost per unit
-        material_cost = calculate_material_cost(category_id)
-        profit_per_unit = unit_price - material_cost
+        # Calculate material cost per unit, in paise
+        price = to_paise(unit_price)
+        cost = to_paise(calculate_material_cost(category_id))
+        profit = price - cost
         
         # Calculate totals
-        total_revenue = unit_price * quantity_sold
-        total_cost = material_cost * quantity_sold
-        total_profit = profit_per_unit * quantity_sold
+        unit_price, material_cost, profit_per_unit = rupees(price), rupees(cost), rupees(profit)
+        total_revenue = rupees(line_total(price, quantity_sold))
+        total_cost = rupees(line_total(cost, quantity_sold))
+        total_profit = total_revenue - total_cost
         
         # Insert sale record
         cur.execute("""
             INSERT INTO daily_sales (
                 category_id, quantity_sold, unit_price, material_cost_per_unit,
-                profit_per_unit, total_revenue, total_cost, total_profit
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                profit_per_unit, total_revenue, total_cost, total_profit, order_key, order_line
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             RETURNING id
         """, (category_id, quantity_sold, unit_price, material_cost, 
-              profit_per_unit, total_revenue, total_cost, total_profit))
+              profit_per_unit, total_revenue, total_cost, total_profit,
+              order_key, 0 if order_key else None))
         
         sale_id = cur.fetchone()[0]
         conn.commit()
@@ -247,7 +393,8 @@ def record_sale_with_profit(category_id, quantity_sold, unit_price):
             'material_cost': material_cost,
             'profit_per_unit': profit_per_unit,
             'total_profit': total_profit,
-            'profit_margin': (profit_per_unit / unit_price * 100) if unit_price > 0 else 0
+            'profit_margin': margin_percent(profit, price),
+            'replayed': False
         }
     except Exception as e:
         try:
@@ -255,8 +402,752 @@ def record_sale_with_profit(category_id, quantity_sold, unit_price):
             conn.close()
         except:
             pass
+        if order_key and isinstance(e, psycopg2.errors.UniqueViolation):
+            # A concurrent attempt with the same key won; return its result
+            return record_sale_with_profit(category_id, quantity_sold, unit_price, order_key)
         return False, str(e)
 
+def _load_order_recipes(cur, lines):
+    """
+    Resolve what each order line consumes, in one round trip.
+    Returns {category_id: [(material_id, amount_per_unit)]} for recipe lines
+    and {brand name: material_id} for brand lines.
+    """
+    category_ids = list({cat_id for cat_id, _qty, brand in lines if not brand})
+    brands = list({brand for _cat_id, _qty, brand in lines if brand})
+    cur.execute("""
+        SELECT cm.category_id, NULL, cm.material_id, cm.amount_per_unit
+        FROM category_materials cm
+        WHERE cm.category_id = ANY(%s)
+        UNION ALL
+        SELECT NULL, rm.name, rm.id, 1.0
+        FROM raw_materials rm
+        WHERE rm.name = ANY(%s)
+    """, (category_ids, brands))
+    recipes = {}
+    brand_ids = {}
+    for cat_id, brand, material_id, amount_per_unit in cur.fetchall():
+        if brand is not None:
+            brand_ids[brand] = material_id
+        else:
+            recipes.setdefault(cat_id, []).append((material_id, float(amount_per_unit)))
+    return recipes, brand_ids
+
+def _lock_materials(cur, material_ids):
+    """
+    Lock raw material rows in one statement, always in id order, so two
+    terminals selling dishes that share ingredients queue up instead of
+    deadlocking. Returns {id: (name, quantity, unit, threshold, supplier_id, cost_per_unit)}.
+    """
+    cur.execute("""
+        SELECT id, name, quantity, unit, threshold, supplier_id, cost_per_unit
+        FROM raw_materials
+        WHERE id = ANY(%s)
+        ORDER BY id
+        FOR UPDATE
+    """, (sorted(material_ids),))
+    return {row[0]: row[1:] for row in cur.fetchall()}
+
+def _deduct_materials(cur, needed):
+    """
+    Take needed = {material_id: amount} out of stock with one conditional
+    UPDATE: a row is only decremented if it still holds at least amount,
+    so the check and the write are atomic and need no separate SELECT.
+    The rows are locked in id order first, in the same statement.
+    Returns (stock, short):
+      stock - {id: (name, quantity before, unit, threshold, supplier_id, cost_per_unit)}
+              for the rows decremented, shaped like _lock_materials()
+      short - [(name, amount needed, quantity available, unit), ...]; if
+              not empty the caller must roll back
+    """
+    rows = execute_values(cur, """
+        WITH need(id, amount) AS (VALUES %s),
+        locked AS (
+            SELECT rm.id, rm.quantity
+            FROM raw_materials rm
+            WHERE rm.id IN (SELECT id FROM need)
+            ORDER BY rm.id
+            FOR UPDATE
+        )
+        UPDATE raw_materials AS rm
+        SET quantity = rm.quantity - need.amount, last_updated = NOW()
+        FROM need
+        JOIN locked ON locked.id = need.id
+        WHERE rm.id = need.id AND rm.quantity >= need.amount
+        RETURNING rm.id, rm.name, locked.quantity, rm.unit, rm.threshold, rm.supplier_id, rm.cost_per_unit
+    """, sorted(needed.items()), template="(%s::integer, %s::numeric)", fetch=True,
+        page_size=max(len(needed), 1))
+    stock = {row[0]: row[1:] for row in rows}
+    short = []
+    missing = sorted(set(needed) - set(stock))
+    if missing:
+        cur.execute("SELECT id, name, quantity, unit FROM raw_materials WHERE id = ANY(%s) ORDER BY name",
+                    (missing,))
+        short = [(name, needed[mid], float(quantity), unit) for mid, name, quantity, unit in cur.fetchall()]
+    return stock, short
+
+def _shortage_message(short):
+    lines = [f"• {name}: need {amount:.2f} {unit}, available {available:.2f} {unit}"
+             for name, amount, available, unit in short]
+    return "Not enough stock:\n" + "\n".join(lines)
+
+def _apply_stock_levels(cur, new_levels):
+    """Write new quantities for locked materials in one statement: [(material_id, new_quantity), ...]"""
+    if not new_levels:
+        return
+    execute_values(cur, """
+        UPDATE raw_materials AS rm
+        SET quantity = v.new_quantity, last_updated = NOW()
+        FROM (VALUES %s) AS v(id, new_quantity)
+        WHERE rm.id = v.id
+    """, new_levels, template="(%s, %s::numeric)")
+
+# Lock order, in every transaction that takes more than one row lock:
+# prepared_stock rows by category id, then raw_materials rows by id, each
+# set in one statement. Two terminals then always queue in the same order
+# and cannot deadlock; anything else that aborts on a conflict is retried
+# (retry_on_conflict).
+
+def _lock_prepared(cur, category_ids):
+    """
+    Lock prepared-goods counters in category id order.
+    Returns {category_id: (quantity, unit_cost)}.
+    """
+    cur.execute("""
+        SELECT category_id, quantity, unit_cost
+        FROM prepared_stock
+        WHERE category_id = ANY(%s)
+        ORDER BY category_id
+        FOR UPDATE
+    """, (sorted(category_ids),))
+    return {cid: (int(quantity), float(unit_cost)) for cid, quantity, unit_cost in cur.fetchall()}
+
+def _apply_prepared_levels(cur, new_levels):
+    """Write new counts for locked prepared-goods counters: [(category_id, new_quantity), ...]"""
+    if not new_levels:
+        return
+    execute_values(cur, """
+        UPDATE prepared_stock AS ps
+        SET quantity = v.new_quantity, last_updated = NOW()
+        FROM (VALUES %s) AS v(category_id, new_quantity)
+        WHERE ps.category_id = v.category_id
+    """, new_levels, template="(%s, %s::integer)")
+
+def _plan_lines(cur, lines):
+    """
+    Work out what order lines consume: look up their categories, take what
+    is ready from the prepared-goods counters (locked, so the counts are
+    current) and resolve the recipes or brands for the rest, which is
+    cooked to order.
+    Returns (plan, None) or (None, error message). plan has 'categories'
+    {id: (name, selling_price)}, 'prepared' {id: (quantity, unit_cost)} as
+    locked, 'prepared_left' {id: quantity}, 'from_prepared' (units per
+    line), 'usage' ([(material_id, amount_per_unit)] per line), 'needed'
+    {material_id: amount} and 'brand_ids' {brand: material_id}.
+    """
+    cur.execute("""
+        SELECT c.id, c.name, c.selling_price, COALESCE(ps.quantity, 0)
+        FROM categories c
+        LEFT JOIN prepared_stock ps ON ps.category_id = c.id
+        WHERE c.id = ANY(%s)
+    """, (list({line[0] for line in lines}),))
+    categories = {}
+    ready = set()
+    for cid, name, price, prepared_quantity in cur.fetchall():
+        categories[cid] = (name, price)
+        if prepared_quantity > 0:
+            ready.add(cid)
+
+    ready.intersection_update(cat_id for cat_id, _qty, brand in lines if not brand)
+    prepared = _lock_prepared(cur, ready) if ready else {}
+    prepared_left = {cid: quantity for cid, (quantity, _cost) in prepared.items()}
+    from_prepared = []
+    for cat_id, qty, brand in lines:
+        take = 0
+        if not brand and prepared_left.get(cat_id, 0) > 0:
+            take = min(qty, prepared_left[cat_id])
+            prepared_left[cat_id] -= take
+        from_prepared.append(take)
+    cooked_lines = [line for line, take in zip(lines, from_prepared) if line[1] > take]
+    recipes, brand_ids = _load_order_recipes(cur, cooked_lines) if cooked_lines else ({}, {})
+
+    line_usage = []
+    needed = {}
+    for (cat_id, qty, brand), take in zip(lines, from_prepared):
+        if cat_id not in categories:
+            return None, f"Category {cat_id} not found"
+        if qty == take:
+            usage = []
+        elif brand:
+            if brand not in brand_ids:
+                return None, f"{brand} not found in inventory"
+            usage = [(brand_ids[brand], 1.0)]
+        else:
+            usage = recipes.get(cat_id)
+            if not usage:
+                return None, f"No materials mapped to {categories[cat_id][0]}"
+        line_usage.append(usage)
+        for mid, amount_per_unit in usage:
+            needed[mid] = needed.get(mid, 0.0) + amount_per_unit * (qty - take)
+    return {
+        'categories': categories,
+        'prepared': prepared,
+        'prepared_left': prepared_left,
+        'from_prepared': from_prepared,
+        'usage': line_usage,
+        'needed': needed,
+        'brand_ids': brand_ids
+    }, None
+
+def _price_lines(lines, plan, stock):
+    """
+    Price and cost every line from the locked rows: cooked units cost their
+    recipe at current material prices, prepared units what their batches
+    cost to cook. All in integer paise (money.py); returns one profit info
+    dict per line with the amounts as Decimal rupees.
+    """
+    line_info = []
+    for (cat_id, qty, brand), usage, take in zip(lines, plan['usage'], plan['from_prepared']):
+        category_name, selling_price = plan['categories'][cat_id]
+        price = to_paise(unit_price(selling_price, brand))
+        cost = recipe_cost([to_milli(amount) for _mid, amount in usage],
+                           [to_paise(stock[mid][5]) for mid, _amount in usage])
+        if take:
+            cost = weighted_cost([(take, to_paise(plan['prepared'][cat_id][1])), (qty - take, cost)])
+        revenue = line_total(price, qty)
+        total_cost = line_total(cost, qty)
+        line_info.append({
+            'category_id': cat_id,
+            'category_name': category_name,
+            'item_name': _item_name(category_name, brand),
+            'brand': brand,
+            'quantity': qty,
+            'selling_price': rupees(price),
+            'material_cost': rupees(cost),
+            'profit_per_unit': rupees(price - cost),
+            'total_revenue': rupees(revenue),
+            'total_cost': rupees(total_cost),
+            'total_profit': rupees(revenue - total_cost),
+            'profit_margin': margin_percent(price - cost, price),
+            'from_prepared': take
+        })
+    return line_info
+
+def _item_name(category_name, brand):
+    return f"{brand} ({category_name})" if brand else category_name
+
+def _sale_ledger(line_info, plan, stock):
+    """
+    Ledger entries for sold lines (each info needs its 'sale_id'): one SALE
+    row per line and material, chained so each shows the level it left
+    behind. Prepared units were already booked when their batch was cooked.
+    """
+    levels = {mid: float(stock[mid][1]) for mid in plan['needed']}
+    ledger = []
+    for info, usage in zip(line_info, plan['usage']):
+        cooked = info['quantity'] - info['from_prepared']
+        for mid, amount_per_unit in usage:
+            previous_q = levels[mid]
+            levels[mid] = max(previous_q - amount_per_unit * cooked, 0.0)
+            ledger.append((mid, "SALE", levels[mid] - previous_q, previous_q, levels[mid],
+                           info['sale_id'], f"{cooked} x {info['item_name']}"))
+    return ledger
+
+def _low_items(needed, stock):
+    """New levels [(material_id, quantity)] after taking needed, clamped at zero, and the materials left below threshold."""
+    new_levels = []
+    low_items = []
+    for mid in sorted(needed):
+        name, quantity, unit, threshold, supplier_id, _cost = stock[mid]
+        new_q = max(float(quantity) - needed[mid], 0.0)
+        new_levels.append((mid, new_q))
+        if new_q < float(threshold):
+            low_items.append({
+                "material_id": mid,
+                "name": name,
+                "new_q": new_q,
+                "unit": unit,
+                "threshold": threshold,
+                "supplier_id": supplier_id
+            })
+    return new_levels, low_items
+
+def _replay_order(cur, order_key):
+    """
+    The result checkout_order() returned for the order recorded under
+    order_key, rebuilt from its daily_sales rows (brand and from_prepared
+    included), or None if there is none. 'low_items' is empty, as they
+    were reported the first time.
+    """
+    cur.execute("""
+        SELECT ds.id, ds.category_id, c.name, ds.brand, ds.quantity_sold, ds.from_prepared,
+               ds.unit_price, ds.material_cost_per_unit, ds.profit_per_unit,
+               ds.total_revenue, ds.total_cost, ds.total_profit
+        FROM daily_sales ds
+        LEFT JOIN categories c ON c.id = ds.category_id
+        WHERE ds.order_key = %s
+        ORDER BY ds.order_line
+    """, (order_key,))
+    rows = cur.fetchall()
+    if not rows:
+        return None
+    line_info = []
+    for (sale_id, cat_id, category_name, brand, qty, from_prepared, price, material_cost,
+         profit_per_unit, revenue, cost, profit) in rows:
+        line_info.append({
+            'category_id': cat_id,
+            'category_name': category_name,
+            'item_name': _item_name(category_name, brand),
+            'brand': brand,
+            'quantity': qty,
+            'selling_price': price,
+            'material_cost': material_cost,
+            'profit_per_unit': profit_per_unit,
+            'total_revenue': revenue,
+            'total_cost': cost,
+            'total_profit': profit,
+            'profit_margin': margin_percent(to_paise(profit_per_unit), to_paise(price)),
+            'from_prepared': from_prepared,
+            'sale_id': sale_id
+        })
+    return _order_result(line_info, [], replayed=True)
+
+def _order_result(line_info, low_items, replayed=False):
+    return {
+        'lines': line_info,
+        'bill_items': [(i['item_name'], i['quantity'], i['selling_price']) for i in line_info],
+        'total_revenue': rupees(sum(to_paise(i['total_revenue']) for i in line_info)),
+        'total_cost': rupees(sum(to_paise(i['total_cost']) for i in line_info)),
+        'total_profit': rupees(sum(to_paise(i['total_profit']) for i in line_info)),
+        'low_items': low_items,
+        'replayed': replayed
+    }
+
+@retry_on_conflict(gave_up=lambda error: None if is_disconnect(error) else (False, str(error)))
+def checkout_order(lines, strict=None, order_key=None):
+    """
+    Record a whole customer order in a single transaction.
+
+    lines: [(category_id, quantity, brand), ...]; brand is the raw material
+    name sold directly (Cold Drinks) or None to use the category's recipe.
+
+    Recipe lines are served from prepared goods first (see cook_batch):
+    that only decrements the category's prepared_stock counter. Whatever
+    is not ready is made to order from raw materials.
+
+    The material requirements of all lines are added up and deducted with
+    one locking SELECT and one UPDATE, and every daily_sales row and stock
+    ledger row is written with one multi-row INSERT each, so the round
+    trips do not grow with the number of items or ingredients. Brand lines
+    are refused if the brand is short; recipe materials clamp at zero as
+    before, unless strict (default STRICT_STOCK): then the order is refused
+    if any material is short, listing every short material, and the check
+    and deduction are one conditional UPDATE (_deduct_materials).
+
+    order_key: client-generated key of the order (e.g. a uuid made when the
+    order is started). Submitting an order again under the same key, after
+    a timeout or from a second click, returns the first result (with
+    'replayed' set) instead of recording it twice; the unique index on
+    daily_sales(order_key, order_line) settles concurrent attempts. Keyed
+    orders are also retried automatically if the connection drops.
+
+    Returns (True, info), (False, error message), or None if the database
+    is unavailable (no connection, or a keyed order kept losing its
+    connection) - the caller may queue the order under the same key in
+    the sales journal. info has 'lines' (per-line profit figures incl.
+    sale_id and 'from_prepared' units), 'bill_items' for
+    generate_bill_text, order totals, 'low_items' and 'replayed'. Run
+    again automatically if it loses a deadlock or serialization race.
+    """
+    if not lines:
+        return False, "Order is empty"
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        if order_key:
+            replay = _replay_order(cur, order_key)
+            if replay:
+                conn.rollback()
+                conn.close()
+                return True, replay
+        plan, error = _plan_lines(cur, lines)
+        if error:
+            conn.rollback()
+            conn.close()
+            return False, error
+        prepared, prepared_left, needed = plan['prepared'], plan['prepared_left'], plan['needed']
+        _apply_prepared_levels(cur, [(cid, prepared_left[cid]) for cid in sorted(prepared)
+                                     if prepared_left[cid] != prepared[cid][0]])
+
+        strict = STRICT_STOCK if strict is None else strict
+        if not needed:
+            stock = {}
+        elif strict:
+            stock, short = _deduct_materials(cur, needed)
+            if short:
+                conn.rollback()
+                conn.close()
+                return False, _shortage_message(short)
+        else:
+            stock = _lock_materials(cur, needed)
+            brand_ids = plan['brand_ids']
+            for mid in sorted({brand_ids[brand] for _c, _q, brand in lines if brand}):
+                current_q = float(stock[mid][1])
+                if mid in needed and current_q < needed[mid]:
+                    conn.rollback()
+                    conn.close()
+                    return False, f"Not enough {stock[mid][0]} in stock! Available: {current_q}"
+        new_levels, low_items = _low_items(needed, stock)
+        if not strict:
+            _apply_stock_levels(cur, new_levels)
+
+        # Price and cost every line, then insert them all at once
+        line_info = _price_lines(lines, plan, stock)
+        sale_rows = [(i['category_id'], i['quantity'], i['selling_price'], i['material_cost'],
+                      i['profit_per_unit'], i['total_revenue'], i['total_cost'], i['total_profit'],
+                      i['brand'], i['from_prepared'], order_key, n if order_key else None)
+                     for n, i in enumerate(line_info)]
+        sale_ids = execute_values(cur, """
+            INSERT INTO daily_sales (
+                category_id, quantity_sold, unit_price, material_cost_per_unit,
+                profit_per_unit, total_revenue, total_cost, total_profit,
+                brand, from_prepared, order_key, order_line
+            ) VALUES %s
+            RETURNING id
+        """, sale_rows, fetch=True)
+        for info, (sale_id,) in zip(line_info, sale_ids):
+            info['sale_id'] = sale_id
+
+        _write_ledger(cur, _sale_ledger(line_info, plan, stock))
+        conn.commit()
+        if needed:
+            invalidate("raw_materials")
+        conn.close()
+        return True, _order_result(line_info, low_items)
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        # A keyed order is safe to run again: the next attempt finds the
+        # first one (duplicate key, or a commit whose reply was lost)
+        if is_retryable(e) or (order_key and (isinstance(e, psycopg2.errors.UniqueViolation)
+                                              or is_disconnect(e))):
+            raise
+        return False, str(e)
+
+def _copy_rows(cur, table, columns, rows):
+    """Bulk load rows into table with COPY (CSV; None is NULL), inside the caller's transaction."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+@retry_on_conflict(gave_up=lambda error: None)
+def flush_journaled_orders(orders):
+    """
+    Write orders acknowledged from the local sales journal (journal.py) in
+    one transaction. orders: [{'key', 'time' (ISO timestamp of the sale),
+    'lines': [[category_id, quantity, brand], ...]}, ...], oldest first.
+
+    Orders whose key is already in daily_sales are skipped, so replaying
+    the journal after a crash is harmless. The rest are planned and costed like checkout_order(), the stock of all of
+    them is deducted with one locking SELECT and one UPDATE, and their
+    daily_sales and ledger rows are loaded with COPY (the rollup triggers
+    fire once for the whole batch). The sales have already been made, so
+    nothing is refused for lack of stock: materials clamp at zero.
+
+    Returns (True, {'written', 'skipped', 'low_items'}), (False, error
+    message) if the batch can never be written as it is (a category or
+    brand was deleted, a value or constraint the server refuses), or None
+    if it failed for now (database unavailable, conflicts still losing
+    after every retry, any other server error) and should be tried again.
+    """
+    if not orders:
+        return True, {'written': 0, 'skipped': 0, 'low_items': []}
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT order_key FROM daily_sales WHERE order_key = ANY(%s)",
+                    ([order['key'] for order in orders],))
+        written = {row[0] for row in cur.fetchall()}
+        orders = [order for order in orders if order['key'] not in written]
+        skipped = len(written)
+        if not orders:
+            conn.rollback()
+            conn.close()
+            return True, {'written': 0, 'skipped': skipped, 'low_items': []}
+
+        lines = []
+        keys = []
+        times = []
+        for order in orders:
+            for n, (cat_id, qty, brand) in enumerate(order['lines']):
+                if not mirror.is_unit_count(qty):
+                    conn.rollback()
+                    conn.close()
+                    return False, f"Invalid quantity {qty!r} in order {order['key']}"
+                lines.append((cat_id, qty, brand or None))
+                keys.append((order['key'], n))
+                times.append(datetime.fromisoformat(order['time']))
+        plan, error = _plan_lines(cur, lines)
+        if error:
+            conn.rollback()
+            conn.close()
+            return False, error
+        prepared, prepared_left, needed = plan['prepared'], plan['prepared_left'], plan['needed']
+        _apply_prepared_levels(cur, [(cid, prepared_left[cid]) for cid in sorted(prepared)
+                                     if prepared_left[cid] != prepared[cid][0]])
+        stock = _lock_materials(cur, needed) if needed else {}
+        new_levels, low_items = _low_items(needed, stock)
+        _apply_stock_levels(cur, new_levels)
+
+        # COPY cannot return the new ids, so reserve them up front
+        line_info = _price_lines(lines, plan, stock)
+        cur.execute("SELECT nextval(pg_get_serial_sequence('daily_sales', 'id')) FROM generate_series(1, %s)",
+                    (len(line_info),))
+        for info, (sale_id,) in zip(line_info, cur.fetchall()):
+            info['sale_id'] = sale_id
+        _copy_rows(cur, "daily_sales", (
+            "id", "category_id", "quantity_sold", "unit_price", "material_cost_per_unit",
+            "profit_per_unit", "total_revenue", "total_cost", "total_profit", "sale_date", "sale_time",
+            "brand", "from_prepared", "order_key", "order_line"
+        ), [(i['sale_id'], i['category_id'], i['quantity'], i['selling_price'], i['material_cost'],
+             i['profit_per_unit'], i['total_revenue'], i['total_cost'], i['total_profit'],
+             sale_time.date(), sale_time, i['brand'], i['from_prepared'], key, n)
+            for i, sale_time, (key, n) in zip(line_info, times, keys)])
+        sale_times = {i['sale_id']: sale_time for i, sale_time in zip(line_info, times)}
+        _copy_rows(cur, "stock_transactions", (
+            "material_id", "transaction_type", "quantity_change", "previous_quantity",
+            "new_quantity", "reference_id", "notes", "created_at"
+        ), [entry + (sale_times[entry[5]],) for entry in _sale_ledger(line_info, plan, stock)])
+        conn.commit()
+        if needed:
+            invalidate("raw_materials")
+        conn.close()
+        return True, {'written': len(orders), 'skipped': skipped, 'low_items': low_items}
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        if is_retryable(e) or isinstance(e, psycopg2.errors.UniqueViolation):
+            raise  # run again; the orders written meanwhile are skipped
+        print("flush journaled orders error:", e)
+        # Only a refusal of the data is final; anything else from the
+        # server is retried on the next flush. A non-database error means
+        # a malformed journal entry.
+        if isinstance(e, psycopg2.Error) and not is_refusal(e):
+            return None
+        return False, str(e)
+
+def flush_journaled_movement(entry):
+    """
+    Replay a stock movement made offline and kept in the sales journal
+    (journal.py). entry: {'key', 'time', 'movement'}, the movement being
+    {'kind': 'adjust', 'material_id', 'delta', 'type', 'notes'} (restock,
+    waste, adjustment) or {'kind': 'cook', 'category_id', 'units', 'notes'}.
+
+    A movement whose key is already in the stock ledger is skipped. An
+    adjustment is applied to the current quantity, like every sale, so
+    movements from several counters add up.
+
+    Returns (True, {'written', 'skipped', 'low_items'}), (False, error
+    message) if the database refuses it for good, or None if it failed
+    for now and should be tried again.
+    """
+    movement = entry['movement']
+    created_at = datetime.fromisoformat(entry['time'])
+    with connection() as conn:
+        if not conn:
+            return None
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT EXISTS (SELECT 1 FROM stock_transactions WHERE op_key = %s)", (entry['key'],))
+            if cur.fetchone()[0]:
+                conn.rollback()
+                return True, {'written': 0, 'skipped': 1, 'low_items': []}
+            if movement['kind'] == 'adjust':
+                cur.execute("SELECT 1 FROM raw_materials WHERE id = %s", (movement['material_id'],))
+                if not cur.fetchone():
+                    conn.rollback()
+                    return False, f"Material {movement['material_id']} not found"
+            conn.rollback()
+        except Exception as e:
+            print("flush journaled movement error:", e)
+            return None
+    if movement['kind'] == 'adjust':
+        new_q = adjust_material_quantity(movement['material_id'], movement['delta'], movement['type'],
+                                         movement['notes'], entry['key'], created_at)
+        if new_q is None:
+            return None
+        return True, {'written': 1, 'skipped': 0, 'low_items': []}
+    if movement['kind'] == 'cook':
+        result = cook_batch(movement['category_id'], movement['units'], movement['notes'],
+                            entry['key'], created_at)
+        if result is None:
+            return None
+        ok, info = result
+        if not ok:
+            return False, info
+        return True, {'written': 1, 'skipped': 0, 'low_items': info['low_items']}
+    return False, f"Unknown stock movement {movement['kind']!r}"
+
+@retry_on_conflict(gave_up=lambda error: None)
+def cook_batch(category_id, units, notes=None, op_key=None, created_at=None):
+    """
+    Cook a batch of a category for the counter: deduct the recipe for
+    units in one go (one BATCH ledger row per material, referencing the
+    prepared_batches row) and add the units to the category's prepared
+    stock. Later sales of the category only decrement that counter.
+    Refused, listing every short ingredient, if any ingredient is short.
+    op_key/created_at: see _write_ledger().
+
+    Returns (True, info), (False, error message), or None if the database
+    is unavailable (for a keyed batch, also if the connection was lost; its
+    replay is skipped if it was committed). info has 'batch_id',
+    'unit_cost', 'prepared_quantity' (units now ready) and 'low_items'.
+    """
+    if units <= 0:
+        return False, "Batch size must be positive"
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM categories WHERE id = %s", (category_id,))
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            conn.close()
+            return False, f"Category {category_id} not found"
+        category_name = row[0]
+        recipes, _brands = _load_order_recipes(cur, [(category_id, units, None)])
+        usage = recipes.get(category_id)
+        if not usage:
+            conn.rollback()
+            conn.close()
+            return False, f"No materials mapped to {category_name}"
+
+        # Lock the counter before the materials, like checkout_order()
+        cur.execute("INSERT INTO prepared_stock (category_id) VALUES (%s) ON CONFLICT DO NOTHING",
+                    (category_id,))
+        _lock_prepared(cur, [category_id])
+        stock, short = _deduct_materials(cur, {mid: amount_per_unit * units for mid, amount_per_unit in usage})
+        if short:
+            conn.rollback()
+            conn.close()
+            return False, f"Cannot cook {units} x {category_name}. " + _shortage_message(short)
+        unit_cost = rupees(recipe_cost([to_milli(amount) for _mid, amount in usage],
+                                       [to_paise(stock[mid][5]) for mid, _amount in usage]))
+        ledger = []
+        low_items = []
+        for mid, amount_per_unit in sorted(usage):
+            name, quantity, unit, threshold, supplier_id, cost_per_unit = stock[mid]
+            current_q = float(quantity)
+            need = amount_per_unit * units
+            new_q = current_q - need
+            ledger.append([mid, "BATCH", -need, current_q, new_q, None, f"Batch of {units} x {category_name}"])
+            if new_q < float(threshold):
+                low_items.append({
+                    "material_id": mid,
+                    "name": name,
+                    "new_q": new_q,
+                    "unit": unit,
+                    "threshold": threshold,
+                    "supplier_id": supplier_id
+                })
+
+        cur.execute("""
+            INSERT INTO prepared_batches (category_id, quantity, unit_cost, notes)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id
+        """, (category_id, units, unit_cost, notes))
+        batch_id = cur.fetchone()[0]
+        for entry in ledger:
+            entry[5] = batch_id
+        _write_ledger(cur, [tuple(entry) for entry in ledger], op_key, created_at)
+
+        # Units on hand are costed at the weighted average of their batches
+        cur.execute("""
+            INSERT INTO prepared_stock AS ps (category_id, quantity, unit_cost)
+            VALUES (%(cid)s, %(units)s, %(cost)s)
+            ON CONFLICT (category_id) DO UPDATE SET
+                unit_cost = (ps.quantity * ps.unit_cost + EXCLUDED.quantity * EXCLUDED.unit_cost)
+                            / (ps.quantity + EXCLUDED.quantity),
+                quantity = ps.quantity + EXCLUDED.quantity,
+                last_updated = NOW()
+            RETURNING quantity
+        """, {"cid": category_id, "units": units, "cost": unit_cost})
+        prepared_quantity = cur.fetchone()[0]
+        conn.commit()
+        invalidate("raw_materials")
+        conn.close()
+        return True, {
+            'batch_id': batch_id,
+            'unit_cost': unit_cost,
+            'prepared_quantity': prepared_quantity,
+            'low_items': low_items
+        }
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        if is_retryable(e):
+            raise
+        if op_key and is_disconnect(e):
+            return None
+        return False, str(e)
+
+def fetch_prepared_stock():
+    """Prepared goods per category: [(category_id, name, quantity, unit_cost, last_updated), ...]"""
+    with connection() as conn:
+        if not conn:
+            return mirror.fetch_prepared_stock()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT ps.category_id, c.name, ps.quantity, ps.unit_cost, ps.last_updated
+            FROM prepared_stock ps
+            JOIN categories c ON c.id = ps.category_id
+            ORDER BY c.name
+        """)
+        return cur.fetchall()
+
+def record_sale(category_id, quantity_sold, brand=None, strict=None, order_key=None):
+    """
+    Record one sale in a single transaction: lock the materials it uses,
+    deduct stock, price and cost the sale and insert the daily_sales row.
+    Shortcut for a one-line checkout_order().
+
+    brand: raw material name to sell directly instead of the category's
+    recipe (Cold Drinks); the sale is refused if that brand is short.
+
+    order_key: see checkout_order(); a repeated submission returns the
+    first result.
+
+    Returns (True, info dict), (False, error message) or None if the
+    database is unavailable. info carries the profit figures plus
+    'low_items' - materials that fell below threshold.
+    """
+    result = checkout_order([(category_id, quantity_sold, brand)], strict, order_key)
+    if result is None:
+        return None
+    ok, order = result
+    if not ok:
+        return False, order
+    info = dict(order['lines'][0])
+    info['low_items'] = order['low_items']
+    info['replayed'] = order['replayed']
+    return True, info
+
 def get_profit_summary(days=7):
     """Get profit summary for the last N days"""
     conn = get_connection()
@@ -282,91 +1173,328 @@ def get_profit_summary(days=7):
         print("get_profit_summary error:", e)
         return []
 
-def get_item_profitability():
-    """Get profitability analysis for each menu item"""
+SALES_PAGE_SIZE = 200
+
+def get_sales_page(after=None, before=None, limit=SALES_PAGE_SIZE,
+                   start_date=None, end_date=None, category_id=None):
+    """
+    One page of individual sales, newest first, as
+    (id, sale_date, sale_time, item, quantity, unit_price, revenue, cost, profit) rows.
+
+    Keyset pagination on (sale_date, sale_time, id): pass the key of the
+    last row shown as after= for the next (older) page, or the key of the
+    first row as before= for the previous (newer) one. Each page is an
+    index range scan, however deep into the history it is. The date range
+    and category filters are applied in SQL. Returns None on failure.
+    """
+    conditions = []
+    params = {"limit": limit}
+    if start_date:
+        conditions.append("ds.sale_date >= %(start_date)s")
+        params["start_date"] = start_date
+    if end_date:
+        conditions.append("ds.sale_date <= %(end_date)s")
+        params["end_date"] = end_date
+    if category_id is not None:
+        conditions.append("ds.category_id = %(category_id)s")
+        params["category_id"] = category_id
+    order = "DESC"
+    if after:
+        conditions.append("(ds.sale_date, ds.sale_time, ds.id) < (%(key_date)s, %(key_time)s, %(key_id)s)")
+        params.update(key_date=after[0], key_time=after[1], key_id=after[2])
+    elif before:
+        # Walk forwards from the key, then flip the page back to newest first
+        conditions.append("(ds.sale_date, ds.sale_time, ds.id) > (%(key_date)s, %(key_time)s, %(key_id)s)")
+        params.update(key_date=before[0], key_time=before[1], key_id=before[2])
+        order = "ASC"
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
     conn = get_connection()
     if not conn:
-        return []
+        return None
     try:
         cur = conn.cursor()
-        cur.execute("SELECT id, name, selling_price FROM categories ORDER BY name")
-        categories = cur.fetchall()
+        cur.execute(f"""
+            SELECT ds.id, ds.sale_date, ds.sale_time, c.name, ds.quantity_sold, ds.unit_price,
+                   ds.total_revenue, ds.total_cost, ds.total_profit
+            FROM daily_sales ds
+            JOIN categories c ON ds.category_id = c.id
+            {where}
+            ORDER BY ds.sale_date {order}, ds.sale_time {order}, ds.id {order}
+            LIMIT %(limit)s
+        """, params)
+        rows = cur.fetchall()
         conn.close()
-        
-        results = []
-        for cat_id, name, selling_price in categories:
-            material_cost = calculate_material_cost(cat_id)
-            profit_per_unit = float(selling_price) - material_cost
-            
-            if selling_price > 0:
-                profit_margin_percent = round((profit_per_unit / float(selling_price)) * 100, 2)
+        return rows[::-1] if before else rows
+    except Exception as e:
+        try:
+            conn.close()
+        except:
+            pass
+        print("get_sales_page error:", e)
+        return None
+
+def rebuild_profit_summary():
+    """
+    Recompute the profit_summary rollup from daily_sales with one GROUP BY.
+    The summary is normally kept up to date by the daily_sales insert
+    trigger; use this after backfills or manual edits of daily_sales.
+    Returns (True, number of days) or (False, error message).
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cur = conn.cursor()
+        # Hold off new sales while rebuilding so none is missed or counted twice
+        cur.execute("LOCK TABLE daily_sales IN SHARE MODE")
+        cur.execute("DELETE FROM profit_summary")
+        cur.execute("""
+            INSERT INTO profit_summary (
+                summary_date, total_sales_count, total_revenue,
+                total_cost, total_profit, profit_margin_percent
+            )
+            SELECT sale_date, COUNT(*), SUM(total_revenue), SUM(total_cost), SUM(total_profit),
+                   CASE WHEN SUM(total_revenue) > 0
+                        THEN ROUND((SUM(total_profit) / SUM(total_revenue)) * 100, 2)
+                        ELSE 0
+                   END
+            FROM daily_sales
+            GROUP BY sale_date
+        """)
+        days = cur.rowcount
+        conn.commit()
+        conn.close()
+        return True, days
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        return False, str(e)
+
+def rebuild_sales_rollups():
+    """
+    Recompute the hourly, daily and monthly sales rollups from daily_sales.
+    Returns (True, {table: rows}) or (False, error message).
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cur = conn.cursor()
+        cur.execute("LOCK TABLE daily_sales IN SHARE MODE")
+        rebuilt = {}
+        for table, key_column, bucket in (
+                ("sales_rollup_hourly", "bucket", "date_trunc('hour', sale_time)"),
+                ("sales_rollup_daily", "sale_date", "sale_date"),
+                ("sales_rollup_monthly", "month", "date_trunc('month', sale_date)::date")):
+            cur.execute(f"DELETE FROM {table}")
+            cur.execute(f"""
+                INSERT INTO {table} (
+                    {key_column}, category_id, sales_count, quantity_sold,
+                    total_revenue, total_cost, total_profit
+                )
+                SELECT {bucket}, category_id, COUNT(*), SUM(quantity_sold),
+                       SUM(total_revenue), SUM(total_cost), SUM(total_profit)
+                FROM daily_sales
+                WHERE category_id IS NOT NULL
+                GROUP BY 1, 2
+            """)
+            rebuilt[table] = cur.rowcount
+        conn.commit()
+        conn.close()
+        return True, rebuilt
+    except Exception as e:
+        try:
+            conn.rollback()
+            conn.close()
+        except:
+            pass
+        return False, str(e)
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def get_sales_report(start_date, end_date, by="category", category_id=None):
+    """
+    Sales totals from start_date to end_date (inclusive), read from the
+    coarsest rollup table that can answer the question instead of scanning
+    daily_sales:
+
+      by="category" - one row per category
+      by="month"    - one row per month
+      by="day"      - one row per day (daily rollup)
+      by="hour"     - one row per hour of day 0-23 (hourly rollup), for staffing
+
+    For "category" and "month", whole calendar months inside the range come
+    from the monthly rollup and only the partial months at either end from
+    the daily rollup, so a 12-month report reads about a dozen rows per category.
+
+    Returns [(key, sales_count, quantity_sold, total_revenue, total_cost, total_profit), ...]
+    where key is the category name, month start date, date or hour.
+    """
+    if by not in ("category", "month", "day", "hour"):
+        raise ValueError(f"Unknown report grouping: {by}")
+    conn = get_connection()
+    if not conn:
+        return []
+    try:
+        cur = conn.cursor()
+        totals = """SUM(sales_count), SUM(quantity_sold),
+                    SUM(total_revenue), SUM(total_cost), SUM(total_profit)"""
+        params = {"start": start_date, "end": end_date, "category_id": category_id}
+        category_filter = "AND category_id = %(category_id)s" if category_id is not None else ""
+
+        if by == "hour":
+            cur.execute(f"""
+                SELECT EXTRACT(HOUR FROM bucket)::int AS key, {totals}
+                FROM sales_rollup_hourly
+                WHERE bucket >= %(start)s AND bucket < %(end)s::date + 1 {category_filter}
+                GROUP BY 1
+                ORDER BY 1
+            """, params)
+        elif by == "day":
+            cur.execute(f"""
+                SELECT sale_date AS key, {totals}
+                FROM sales_rollup_daily
+                WHERE sale_date BETWEEN %(start)s AND %(end)s {category_filter}
+                GROUP BY 1
+                ORDER BY 1
+            """, params)
+        else:
+            # Whole months covered by the range: [full_start, full_end)
+            full_start = start_date if start_date.day == 1 else _next_month(start_date)
+            full_end = _month_start(end_date + timedelta(days=1))
+            if full_end < full_start:
+                full_end = full_start
+            params.update(full_start=full_start, full_end=full_end)
+            if by == "category":
+                monthly_key = daily_key = "category_id"
+                key, join, order = "c.name", "JOIN categories c ON c.id = buckets.key", "SUM(total_profit) DESC"
             else:
-                profit_margin_percent = 0
-            
-            results.append((name, selling_price, material_cost, profit_per_unit, profit_margin_percent))
-        
-        # Sort by profit per unit descending
-        results.sort(key=lambda x: x[3], reverse=True)
-        return results
+                monthly_key, daily_key = "month", "date_trunc('month', sale_date)::date"
+                key, join, order = "buckets.key", "", "1"
+            cur.execute(f"""
+                SELECT {key}, {totals}
+                FROM (
+                    SELECT {monthly_key} AS key, sales_count, quantity_sold,
+                           total_revenue, total_cost, total_profit
+                    FROM sales_rollup_monthly
+                    WHERE month >= %(full_start)s AND month < %(full_end)s {category_filter}
+                    UNION ALL
+                    SELECT {daily_key} AS key, sales_count, quantity_sold,
+                           total_revenue, total_cost, total_profit
+                    FROM sales_rollup_daily
+                    WHERE sale_date BETWEEN %(start)s AND %(end)s
+                      AND NOT (sale_date >= %(full_start)s AND sale_date < %(full_end)s)
+                      {category_filter}
+                ) buckets
+                {join}
+                GROUP BY 1
+                ORDER BY {order}
+            """, params)
+        rows = cur.fetchall()
+        conn.close()
+        return rows
     except Exception as e:
         try:
             conn.close()
         except:
             pass
-        print("get_item_profitability error:", e)
+        print("get_sales_report error:", e)
         return []
 
-def predict_tomorrow_production():
-    """Predict how many items can be prepared tomorrow based on current inventory"""
+def get_item_profitability():
+    """
+    Get profitability analysis for each menu item.
+    Material cost for every category comes from a single aggregate query,
+    so the cost stays one round trip however many categories there are;
+    profit per unit and margin are then worked out in paise (money.py).
+    Returns [(name, selling_price, material_cost, profit_per_unit, margin_percent), ...]
+    sorted by profit per unit, highest first.
+    """
     conn = get_connection()
     if not conn:
         return []
     try:
         cur = conn.cursor()
-        cur.execute("SELECT id, name FROM categories ORDER BY name")
-        categories = cur.fetchall()
-        
-        predictions = []
-        for cat_id, cat_name in categories:
-            # Get materials needed for this category directly from database
-            cur.execute("""
-                SELECT cm.material_id, rm.name, cm.amount_per_unit, rm.quantity, rm.unit, rm.threshold, rm.supplier_id
-                FROM category_materials cm
-                JOIN raw_materials rm ON cm.material_id = rm.id
-                WHERE cm.category_id = %s
-            """, (cat_id,))
-            materials_needed = cur.fetchall()
-            
-            if not materials_needed:
-                predictions.append((cat_name, 0, "No materials mapped"))
-                continue
-            
-            min_possible = float('inf')
-            limiting_material = ""
-            
-            for material_id, material_name, amount_per_unit, current_qty, unit, threshold, supplier_id in materials_needed:
-                if amount_per_unit and amount_per_unit > 0:
-                    possible_units = int(float(current_qty) / float(amount_per_unit))
-                    if possible_units < min_possible:
-                        min_possible = possible_units
-                        limiting_material = f"{material_name} ({current_qty} {unit} available)"
-            
-            if min_possible == float('inf'):
-                min_possible = 0
-                limiting_material = "Invalid material amounts"
-            
-            predictions.append((cat_name, min_possible, limiting_material))
-        
+        cur.execute("""
+            SELECT name, selling_price, material_cost
+            FROM (
+                SELECT c.name, COALESCE(c.selling_price, 0) AS selling_price,
+                       COALESCE(SUM(cm.amount_per_unit * rm.cost_per_unit), 0) AS material_cost
+                FROM categories c
+                LEFT JOIN category_materials cm ON cm.category_id = c.id
+                LEFT JOIN raw_materials rm ON rm.id = cm.material_id
+                GROUP BY c.id, c.name, c.selling_price
+            ) costs
+            ORDER BY selling_price - material_cost DESC, name
+        """)
+        # Profit and margin from integer paise (money.py)
+        results = []
+        for name, selling_price, material_cost in cur.fetchall():
+            price, cost = to_paise(selling_price), to_paise(material_cost)
+            results.append((name, rupees(price), rupees(cost), rupees(price - cost),
+                            round(margin_percent(price - cost, price), 2)))
         conn.close()
-        return predictions
+        return results
     except Exception as e:
         try:
             conn.close()
         except:
             pass
-        print("predict_tomorrow_production error:", e)
+        print("get_item_profitability error:", e)
         return []
 
+def predict_tomorrow_production():
+    """
+    Predict how many items can be prepared tomorrow based on current inventory.
+    Loads the whole recipe matrix in one query and computes every category's
+    capacity and limiting material in one vectorized pass (see production.py),
+    next to the units expected to sell tomorrow (see forecast.py).
+    Returns [(category_name, max_units, expected_demand, limiting_factor), ...];
+    expected_demand is None until there are two weeks of sales history.
+    """
+    matrix = load_recipe_matrix()
+    if matrix is None:
+        return []
+    demand = expected_demand()
+    return [(name, max_units, demand.get(category_id), limiting_factor)
+            for category_id, (name, max_units, limiting_factor)
+            in zip(matrix.category_ids.tolist(), production_capacity(matrix))]
+
+def plan_tomorrow_production():
+    """
+    Jointly optimal production plan for tomorrow: the most profit the menu
+    can make from current stock, with categories sharing materials and each
+    capped at its expected demand when there is a forecast.
+    See production.plan_production() for the result; 'capped' tells
+    whether demand caps were applied.
+    """
+    demand = expected_demand()
+    plan = plan_production(caps={category_id: math.ceil(units) for category_id, units in demand.items()})
+    if plan is not None:
+        plan["capped"] = bool(demand)
+    return plan
+
+def get_shopping_list(day=None):
+    """
+    What to buy for the demand expected on day (default tomorrow), grouped
+    by supplier: see production.material_requirements(). Units already
+    cooked and waiting at the counter need no more materials. Materials
+    already below threshold are listed even without a forecast.
+    """
+    demand = expected_demand(day)
+    for category_id, _name, ready, _cost, _updated in fetch_prepared_stock():
+        if category_id in demand:
+            demand[category_id] = max(demand[category_id] - ready, 0)
+    return material_requirements(demand)
+
 def generate_bill_text(items, customer_name="", customer_phone=""):
     """Generate formatted bill text"""
     from datetime import datetime
@@ -384,14 +1512,16 @@ def generate_bill_text(items, customer_name="", customer_phone=""):
     bill_text += "ITEMS:\n"
     bill_text += "-" * 35 + "\n"
     
-    total_amount = 0
+    total_paise = 0
     for item_name, quantity, unit_price in items:
-        item_total = quantity * unit_price
-        total_amount += item_total
+        price = to_paise(unit_price)
+        item_total = line_total(price, quantity)
+        total_paise += item_total
         bill_text += f"{item_name}\n"
-        bill_text += f"  {quantity} x ₹{unit_price} = ₹{item_total}\n"
+        bill_text += f"  {quantity} x ₹{rupees(price)} = ₹{rupees(item_total)}\n"
         bill_text += "-" * 35 + "\n"
     
+    total_amount = rupees(total_paise)
     bill_text += f"💰 TOTAL AMOUNT: ₹{total_amount}\n"
     bill_text += "=" * 35 + "\n"
     bill_text += "Thank you for your purchase! 😊\n"
@@ -0,0 +1,372 @@
+# journal.py
+"""
+Write-behind sales journal: a counter sale is acknowledged as soon as it
+is safely on the local disk, and written to PostgreSQL afterwards.
+
+    journal = sales_journal()
+    key = journal.append([(category_id, quantity, brand)])   # durable on return
+    ok, result = journal.flush()                             # later, off the Tk thread
+
+Each order is one JSON line in an append-only file. Appends are group
+committed: whichever caller gets to fsync first writes and syncs every
+order buffered so far, so concurrent sales share one fsync instead of
+queueing for one each.
+
+flush() hands every durable, unwritten order to
+inventory.flush_journaled_orders(), which writes them in one transaction
+with COPY, every row carrying its order's key (daily_sales.order_key).
+After a successful flush the file is rewritten with only the orders
+still pending. On startup the file is read back and everything in it is
+flushed again: keys already in daily_sales are skipped, so a crash at
+any point neither loses nor duplicates a sale.
+
+An order the database refuses for good (e.g. its category was deleted) is
+moved to <journal>.rejected so it cannot hold back the rest. Transient
+failures (lost connection, deadlocks still losing after every retry)
+leave every order pending for the next flush.
+
+The journal is also what keeps the counter selling offline: appends need
+no database, every sale is deducted from the local mirror (mirror.py)
+right away, and flush() catches up in bulk once PostgreSQL is back.
+Restocks, waste and cooked batches made offline (queue_stock_movement())
+are journaled the same way as {'key', 'time', 'movement'} entries and
+replayed one at a time, in journal order with the sales around them, by
+inventory.flush_journaled_movement().
+"""
+
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from db import connection
+from inventory import flush_journaled_orders, flush_journaled_movement
+from mirror import apply_sale, apply_movement, check_movement, refresh_mirror, OFFLINE_MODE
+
+# CANTEEN_WRITE_BEHIND=false records every sale synchronously instead (offline
+# mode, mirror.OFFLINE_MODE, still queues whatever fails for lack of a connection)
+WRITE_BEHIND = os.getenv("CANTEEN_WRITE_BEHIND", "true").lower() == "true"
+JOURNAL_PATH = os.getenv("CANTEEN_JOURNAL",
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), "sales_journal.log"))
+# Orders written per flush transaction
+FLUSH_BATCH = 500
+
+def _fsync_directory(path):
+    """Make a rename in path's directory durable (not supported on Windows)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class SalesJournal:
+    """
+    Append-only file of acknowledged orders not yet known to be in the
+    database. Safe to use from any thread.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()        # buffer, sequence numbers, pending orders
+        self._sync_lock = threading.Lock()   # the file: one writer/fsync at a time
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._buffer = []                    # [(seq, order, encoded line)] not yet written
+        self._pending = []                   # [(seq, order)] not yet in the database
+        self._next_seq = 1
+        self._synced = 0                     # highest seq known to be on disk
+        self._recover()
+        self._file = open(self.path, "ab")
+
+    def _recover(self):
+        """Load the orders left in the file; a torn last line (crash mid-write) is cut off."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        good_end = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                order = json.loads(line)
+            except ValueError:
+                break
+            good_end += len(line)
+            self._pending.append((self._next_seq, order))
+            self._next_seq += 1
+        if good_end < len(data):
+            print(f"sales journal: dropping {len(data) - good_end} bytes of an incomplete entry")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_end)
+                f.flush()
+                os.fsync(f.fileno())
+        self._synced = self._next_seq - 1
+
+    def pending(self):
+        """Every entry (order or stock movement) not yet written to the database, oldest first."""
+        with self._lock:
+            return ([order for _seq, order in self._pending]
+                    + [order for _seq, order, _data in self._buffer])
+
+    def __len__(self):
+        """Orders and stock movements acknowledged but not yet written to the database."""
+        with self._lock:
+            return len(self._pending) + len(self._buffer)
+
+    def append(self, lines, key=None):
+        """
+        Journal an order: lines = [(category_id, quantity, brand), ...].
+        key is the order's idempotency key (daily_sales.order_key), new if
+        not given. Returns the key once the order is on disk (fsynced).
+        """
+        key = self._append({"lines": [[cat_id, qty, brand] for cat_id, qty, brand in lines]}, key)
+        try:
+            apply_sale(lines)
+        except Exception as e:
+            # The sale is journaled; the mirror catches up on its next refresh
+            print("sales journal: mirror update error:", e)
+        return key
+
+    def append_movement(self, movement, key=None):
+        """
+        Journal a stock movement made offline (see
+        inventory.flush_journaled_movement() for its fields) and apply it to
+        the mirror. Returns (key, what mirror.apply_movement() returned).
+        """
+        key = self._append({"movement": movement}, key)
+        try:
+            result = apply_movement(movement)
+        except Exception as e:
+            print("sales journal: mirror update error:", e)
+            result = None
+        return key, result
+
+    def _append(self, entry, key):
+        """Add the key and time to entry and journal it. Returns the key once it is on disk."""
+        order = dict({"key": key or uuid.uuid4().hex, "time": datetime.now().isoformat()}, **entry)
+        data = (json.dumps(order) + "\n").encode()
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._buffer.append((seq, order, data))
+        self._sync_through(seq)
+        return order["key"]
+
+    def _sync_through(self, seq):
+        """
+        Write and fsync the buffer unless another caller already synced past
+        seq. If that fails, the other callers' orders go back in the buffer
+        for the next writer and ours is withdrawn: the caller gets the error.
+        """
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            end = self._file.tell()
+            try:
+                self._file.write(b"".join(data for _seq, _order, data in batch))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                with self._lock:
+                    self._buffer[:0] = [entry for entry in batch if entry[0] != seq]
+                self._reopen(end)
+                raise
+            with self._lock:
+                self._pending.extend((s, order) for s, order, _data in batch)
+                self._synced = batch[-1][0]
+
+    def _reopen(self, end):
+        """Drop whatever a failed write left after end and reopen the file."""
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.path, end)
+        except OSError as e:
+            print("sales journal: truncate error:", e)
+        self._file = open(self.path, "ab")
+
+    def flush(self):
+        """
+        Write pending orders to the database, FLUSH_BATCH per transaction.
+        Returns (True, {'written', 'skipped', 'low_items', 'pending'}),
+        (False, error message) if the database is unavailable (the orders
+        stay journaled), or None if another flush is already running.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return None
+        try:
+            total = {'written': 0, 'skipped': 0, 'low_items': []}
+            error = None
+            removed = False   # orders left _pending, written or rejected
+            with self._lock:
+                # Not the orders journaled while this flush runs
+                last = self._pending[-1][0] if self._pending else 0
+            while True:
+                with self._lock:
+                    batch = self._next_batch(last)
+                if not batch:
+                    break
+                if 'movement' in batch[0][1]:
+                    done, result = self._flush_movement(batch[0][1])
+                else:
+                    done, result = self._flush_batch(batch)
+                if result is None:
+                    error = "Database unavailable; the orders stay journaled"
+                else:
+                    for name in ('written', 'skipped'):
+                        total[name] += result[name]
+                    total['low_items'].extend(result['low_items'])
+                if done:
+                    with self._lock:
+                        flushed = {seq for seq, _order in batch}
+                        self._pending = [p for p in self._pending if p[0] not in flushed]
+                    removed = True
+                if error:
+                    break
+            if removed:
+                self._compact()
+                refresh_mirror(self.pending())
+            if error:
+                return False, error
+            total['pending'] = len(self)
+            return True, total
+        finally:
+            self._flush_lock.release()
+
+    def _next_batch(self, last):
+        """
+        The next entries to write, up to seq last; call with _lock held. A
+        stock movement is written on its own, orders up to FLUSH_BATCH at a
+        time, so everything reaches the database in journal order.
+        """
+        batch = []
+        for seq, order in self._pending:
+            if seq > last or len(batch) == FLUSH_BATCH:
+                break
+            if 'movement' in order:
+                return batch or [(seq, order)]
+            batch.append((seq, order))
+        return batch
+
+    def _flush_movement(self, entry):
+        """Write one stock movement, rejecting it if the database refuses it for good. Same returns as _flush_batch()."""
+        result = flush_journaled_movement(entry)
+        if result is None:
+            return False, None
+        ok, info = result
+        if ok:
+            return True, info
+        self._reject(entry, info)
+        return True, {'written': 0, 'skipped': 0, 'low_items': []}
+
+    def _flush_batch(self, batch):
+        """
+        Write one batch; if the database refuses it, write its orders one
+        at a time and reject the ones it refuses for good. Anything that
+        may succeed later (see flush_journaled_orders) stays pending.
+        Returns (batch done, totals or None if the database is unavailable).
+        """
+        result = flush_journaled_orders([order for _seq, order in batch])
+        if result is None:
+            return False, None
+        ok, info = result
+        if ok:
+            return True, info
+        total = {'written': 0, 'skipped': 0, 'low_items': []}
+        for _seq, order in batch:
+            result = flush_journaled_orders([order])
+            if result is None:
+                # Failed for now (e.g. connection lost half way): the orders
+                # written so far are skipped on the next flush by their key.
+                return False, None
+            ok, info = result
+            if ok:
+                for name in ('written', 'skipped'):
+                    total[name] += info[name]
+                total['low_items'].extend(info['low_items'])
+            else:
+                self._reject(order, info)
+        return True, total
+
+    def _reject(self, order, error):
+        print(f"sales journal: order {order['key']} rejected by the database:", error)
+        with open(self.path + ".rejected", "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(order, error=error)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self):
+        """Rewrite the file with only the orders still pending (atomic rename)."""
+        with self._sync_lock:
+            with self._lock:
+                keep = [order for seq, order in self._pending if seq <= self._synced]
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(b"".join((json.dumps(order) + "\n").encode() for order in keep))
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(temp_path, self.path)
+            _fsync_directory(self.path)
+            self._file = open(self.path, "ab")
+
+    def close(self):
+        with self._sync_lock:
+            self._file.close()
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def sales_journal():
+    """The shared SalesJournal (recovering the file left by the last run)."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = SalesJournal()
+        return _journal
+
+def flush_sales_journal():
+    """Flush the shared journal; see SalesJournal.flush()."""
+    return sales_journal().flush()
+
+def refresh_offline_mirror():
+    """
+    Copy the current tables into the offline mirror, with the sales and
+    stock movements still in the journal applied. Returns False if the
+    database is unavailable.
+    """
+    return refresh_mirror(sales_journal().pending())
+
+def queue_stock_movement(movement, key=None):
+    """
+    Offline fallback for a restock, waste or cooked batch the database did
+    not take: journal it (SalesJournal.append_movement()) if offline mode
+    is on, the database is unreachable and the mirror would accept it.
+    Returns (True, the mirror's new quantity), (False, why it was not
+    queued), or None if the database is reachable (the failure was not the
+    connection, so nothing is queued).
+    """
+    if not OFFLINE_MODE:
+        return False, "Database unavailable"
+    with connection() as conn:
+        if conn:
+            return None
+    problem = check_movement(movement)
+    if problem:
+        return False, problem
+    try:
+        _key, result = sales_journal().append_movement(movement, key)
+    except OSError as e:
+        return False, str(e)
+    return True, result
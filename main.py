@@ -2,13 +2,28 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, font
 from decimal import Decimal
+from datetime import date, timedelta
 import time
 import os
-from inventory import fetch_inventory, get_material, adjust_material_quantity, add_material, update_material, delete_material, calculate_material_cost, record_sale_with_profit, get_profit_summary, get_item_profitability, predict_tomorrow_production, generate_bill_text
+import uuid
+from inventory import fetch_inventory, get_material, get_stock_history_page, STOCK_HISTORY_PAGE_SIZE, adjust_material_quantity, record_waste, add_material, update_material, delete_material, calculate_material_cost, record_sale, checkout_order, cook_batch, fetch_prepared_stock, get_sales_page, SALES_PAGE_SIZE, get_item_profitability, predict_tomorrow_production, plan_tomorrow_production, get_shopping_list, generate_bill_text, unit_price, STRICT_STOCK
 from categories import fetch_categories, create_category, update_category, delete_category, set_category_material, get_category_materials
 from suppliers import fetch_suppliers, get_supplier_by_id, update_supplier, get_supplier_for_material
 from whatsapp_notify import send_whatsapp_twilio, open_whatsapp_web, TWILIO_ENABLED
-from db import get_connection
+from db import get_connection, init_pool, close_pool
+from background import BackgroundRunner
+from analytics import refresh_sales_analytics, get_sales_totals, get_top_items, get_daily_profit
+from journal import sales_journal, flush_sales_journal, refresh_offline_mirror, queue_stock_movement, WRITE_BEHIND
+from mirror import check_sale, OFFLINE_MODE
+import cache
+from money import to_paise, line_total, div_round, rupees
+
+# Database calls run on background threads (see run_db), so use the
+# thread-safe pool
+try:
+    init_pool(threaded=True)
+except Exception as e:
+    print("Database connection error:", e)
 
 # Main window
 root = tk.Tk()
@@ -128,6 +143,35 @@ title_label = tk.Label(header_content, text="🍽️ Canteen Inventory Managemen
                       font=('Arial', 18, 'bold'), fg='white', bg=PRIMARY_COLOR)
 title_label.pack(pady=20)
 
+# Busy indicator, shown while background database work is running
+busy_label = tk.Label(header_frame, text="", font=('Arial', 10, 'bold'), fg='white', bg=PRIMARY_COLOR)
+busy_label.place(relx=1.0, rely=0.5, x=-20, anchor="e")
+
+# Offline badge, shown while the database is unreachable and sales and
+# stock movements are only journaled locally (see flush_journal below)
+offline_label = tk.Label(header_frame, text="", font=('Arial', 10, 'bold'), fg='white', bg=PRIMARY_COLOR)
+offline_label.place(relx=0.0, rely=0.5, x=20, anchor="w")
+
+def show_offline(offline):
+    if offline:
+        queued = len(sales_journal())
+        offline_label.config(text=f"📴 Offline - {queued} change(s) queued" if queued else "📴 Offline")
+    else:
+        offline_label.config(text="")
+
+def show_busy(busy):
+    busy_label.config(text="⏳ Working..." if busy else "")
+    root.config(cursor="watch" if busy else "")
+
+runner = BackgroundRunner(root, on_busy=show_busy)
+
+def run_db(fn, *args, on_done=None, **kwargs):
+    """
+    Run a blocking call (database, WhatsApp) off the Tk thread; on_done(result) runs back on it.
+    Pass latest=<widget> when on_done redraws it, so a slower, older result never overwrites a newer one.
+    """
+    return runner.submit(fn, *args, on_done=on_done, **kwargs)
+
 # Clean main content frame
 main_frame = tk.Frame(root, bg=LIGHT_BG)
 main_frame.pack(fill="both", expand=True, padx=15, pady=15)
@@ -172,6 +216,9 @@ inv_title.pack(side="left")
 status_frame = tk.Frame(inv_title_frame, bg=CARD_BG)
 status_frame.pack(side="right")
 
+status_label = tk.Label(status_frame, text="", bg=CARD_BG, font=('Arial', 10, 'bold'))
+status_label.pack()
+
 # Simple inventory tree
 inv_tree_frame = tk.Frame(inv_left, bg=CARD_BG)
 inv_tree_frame.pack(fill="both", expand=True, padx=15, pady=(0,15))
@@ -194,14 +241,56 @@ inv_tree.pack(side="left", fill="both", expand=True)
 inv_v_scroll.pack(side="right", fill="y")
 inv_h_scroll.pack(side="bottom", fill="x")
 
+# Row colors
+inv_tree.tag_configure("out_of_stock", background="#ffebee", foreground="#c62828")
+inv_tree.tag_configure("low_stock", background="#fff3e0", foreground="#ef6c00")
+inv_tree.tag_configure("in_stock", background="#e8f5e8", foreground="#2e7d32")
+
+def sync_tree(tree, rows):
+    """
+    Bring a Treeview in line with rows = [(iid, values, tags), ...] by
+    touching only what changed since the last sync: stale rows are
+    deleted, new ones inserted, changed ones updated in place. Rows are
+    only moved when the order itself changed.
+    What the tree shows, {iid: (values, tags)}, is kept on the widget
+    itself so it goes away with the window.
+    """
+    previous = getattr(tree, "sync_snapshot", None)
+    if previous is None:
+        previous = tree.sync_snapshot = {}
+    wanted = {iid for iid, _values, _tags in rows}
+    stale = [iid for iid in previous if iid not in wanted]
+    if stale:
+        tree.delete(*stale)
+        for iid in stale:
+            del previous[iid]
+    
+    for index, (iid, values, tags) in enumerate(rows):
+        row = (values, tags)
+        if iid not in previous:
+            tree.insert("", index, iid=iid, values=values, tags=tags)
+        elif previous[iid] != row:
+            tree.item(iid, values=values, tags=tags)
+        previous[iid] = row
+    
+    order = [iid for iid, _values, _tags in rows]
+    current = list(tree.get_children())
+    if current != order:
+        for index, iid in enumerate(order):
+            if current[index] != iid:
+                tree.move(iid, "", index)
+                current.remove(iid)
+                current.insert(index, iid)
+
 def load_inventory():
-    for i in inv_tree.get_children():
-        inv_tree.delete(i)
-    
+    run_db(fetch_inventory, on_done=render_inventory, latest=inv_tree)
+
+def render_inventory(rows):
+    tree_rows = []
     low_stock_count = 0
     total_items = 0
     
-    for r in fetch_inventory():
+    for r in rows:
         total_items += 1
         # r = (id, name, quantity, unit, threshold, cost_per_unit, supplier_id)
         quantity = float(r[2]) if r[2] else 0
@@ -218,25 +307,15 @@ def load_inventory():
             status = "✅ In Stock"
             tag = "in_stock"
         
-        values = list(r) + [status]
-        item = inv_tree.insert("", "end", values=values, tags=(tag,))
+        tree_rows.append((str(r[0]), tuple(r) + (status,), (tag,)))
     
-    # Configure row colors
-    inv_tree.tag_configure("out_of_stock", background="#ffebee", foreground="#c62828")
-    inv_tree.tag_configure("low_stock", background="#fff3e0", foreground="#ef6c00")
-    inv_tree.tag_configure("in_stock", background="#e8f5e8", foreground="#2e7d32")
+    sync_tree(inv_tree, tree_rows)
     
     # Simple status indicator
-    for widget in status_frame.winfo_children():
-        widget.destroy()
-    
     if low_stock_count > 0:
-        status_label = tk.Label(status_frame, text=f"⚠️ {low_stock_count} items low", 
-                               fg=WARNING_COLOR, bg=CARD_BG, font=('Arial', 10, 'bold'))
+        status_label.config(text=f"⚠️ {low_stock_count} items low", fg=WARNING_COLOR)
     else:
-        status_label = tk.Label(status_frame, text="✅ All items stocked", 
-                               fg=SUCCESS_COLOR, bg=CARD_BG, font=('Arial', 10, 'bold'))
-    status_label.pack()
+        status_label.config(text="✅ All items stocked", fg=SUCCESS_COLOR)
 
 # MATERIAL MANAGEMENT FUNCTIONS
 def add_material_popup():
@@ -320,14 +399,17 @@ def add_material_popup():
                 messagebox.showerror("❌ Error", "Supplier ID must be a number!")
                 return
         
-        ok, result = add_material(name, quantity, unit, threshold, cost_per_unit, supplier_id)
-        if ok:
-            messagebox.showinfo("✅ Success", f"Material '{name}' added successfully with ID: {result}")
-            load_inventory()
-            update_stats()
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", f"Failed to add material: {result}")
+        def saved(res):
+            ok, result = res
+            if ok:
+                messagebox.showinfo("✅ Success", f"Material '{name}' added successfully with ID: {result}")
+                load_inventory()
+                update_stats()
+                win.destroy()
+            else:
+                messagebox.showerror("❌ Error", f"Failed to add material: {result}")
+        
+        run_db(add_material, name, quantity, unit, threshold, cost_per_unit, supplier_id, on_done=saved)
     
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
@@ -433,14 +515,18 @@ def edit_material_popup():
                 messagebox.showerror("❌ Error", "Supplier ID must be a number!")
                 return
         
-        ok, result = update_material(material_id, name, quantity, unit, threshold, cost_per_unit, supplier_id)
-        if ok:
-            messagebox.showinfo("✅ Success", f"Material updated successfully!")
-            load_inventory()
-            update_stats()
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", f"Failed to update material: {result}")
+        def saved(res):
+            ok, result = res
+            if ok:
+                messagebox.showinfo("✅ Success", f"Material updated successfully!")
+                load_inventory()
+                update_stats()
+                win.destroy()
+            else:
+                messagebox.showerror("❌ Error", f"Failed to update material: {result}")
+        
+        run_db(update_material, material_id, name, quantity, unit, threshold, cost_per_unit, supplier_id,
+               on_done=saved)
     
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
@@ -509,14 +595,21 @@ def restock_material_popup():
             messagebox.showerror("❌ Error", "Please enter a valid positive quantity!")
             return
         
-        new_qty = adjust_material_quantity(material_id, add_qty)
-        if new_qty is not None:
-            messagebox.showinfo("✅ Success", f"Added {add_qty} {unit} to {material_name}!\nNew stock: {new_qty} {unit}")
-            load_inventory()
-            update_stats()
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", "Failed to update stock. Please try again.")
+        key = uuid.uuid4().hex
+        
+        def saved(new_qty, offline=False):
+            if new_qty is not None:
+                messagebox.showinfo("✅ Success", f"Added {add_qty} {unit} to {material_name}!\nNew stock: {new_qty} {unit}"
+                                    + (OFFLINE_SAVED_NOTE if offline else ""))
+                load_inventory()
+                update_stats()
+                win.destroy()
+            else:
+                queue_offline({"kind": "adjust", "material_id": material_id, "delta": add_qty,
+                               "type": "RESTOCK", "notes": None}, key,
+                              "Failed to update stock. Please try again.", lambda q: saved(q, offline=True))
+        
+        run_db(adjust_material_quantity, material_id, add_qty, op_key=key, on_done=saved)
     
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
@@ -527,6 +620,193 @@ def restock_material_popup():
     
     e_qty.focus_set()
 
+def waste_material_popup():
+    sel = inv_tree.selection()
+    if not sel:
+        messagebox.showerror("❌ Error", "Please select a material to write off!")
+        return
+    
+    material_data = inv_tree.item(sel[0])['values']
+    material_id = material_data[0]
+    material_name = material_data[1]
+    current_qty = material_data[2]
+    unit = material_data[3]
+    
+    win = tk.Toplevel(root)
+    win.title("🗑️ Record Waste")
+    win.geometry("450x380")
+    win.configure(bg='white')
+    win.resizable(False, False)
+    win.transient(root)
+    win.grab_set()
+    
+    # Header
+    header = tk.Frame(win, bg=DANGER_COLOR, height=60)
+    header.pack(fill="x")
+    header.pack_propagate(False)
+    
+    tk.Label(header, text="🗑️ Record Waste", font=('Arial', 14, 'bold'), 
+             fg='white', bg=DANGER_COLOR).pack(pady=20)
+    
+    # Info frame
+    info_frame = tk.LabelFrame(win, text="📦 Material Information", font=('Arial', 10, 'bold'), 
+                              fg=PRIMARY_COLOR, bg='white', bd=2, relief='groove')
+    info_frame.pack(fill="x", padx=20, pady=10)
+    
+    tk.Label(info_frame, text=f"Material: {material_name}", font=('Arial', 10), 
+             fg=DARK_TEXT, bg='white').pack(anchor="w", padx=10, pady=5)
+    tk.Label(info_frame, text=f"Current Stock: {current_qty} {unit}", font=('Arial', 10), 
+             fg=DARK_TEXT, bg='white').pack(anchor="w", padx=10, pady=5)
+    
+    # Form frame
+    form_frame = tk.Frame(win, bg='white')
+    form_frame.pack(fill="both", expand=True, padx=30, pady=20)
+    
+    tk.Label(form_frame, text=f"Quantity Wasted ({unit}) *", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=0, sticky="w", pady=(0,5))
+    e_qty = tk.Entry(form_frame, width=35, font=('Arial', 10), relief='solid', bd=1)
+    e_qty.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(0,10))
+    
+    tk.Label(form_frame, text="Reason", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=2, column=0, sticky="w", pady=(0,5))
+    e_reason = tk.Entry(form_frame, width=35, font=('Arial', 10), relief='solid', bd=1)
+    e_reason.grid(row=3, column=0, columnspan=2, sticky="ew", pady=(0,20))
+    
+    form_frame.columnconfigure(0, weight=1)
+    
+    def write_off():
+        try:
+            waste_qty = float(e_qty.get())
+            if waste_qty <= 0:
+                raise ValueError()
+        except ValueError:
+            messagebox.showerror("❌ Error", "Please enter a valid positive quantity!")
+            return
+        
+        key = uuid.uuid4().hex
+        reason = e_reason.get().strip() or None
+        
+        def saved(new_qty, offline=False):
+            if new_qty is not None:
+                messagebox.showinfo("✅ Success", f"Wrote off {waste_qty} {unit} of {material_name}.\nNew stock: {new_qty} {unit}"
+                                    + (OFFLINE_SAVED_NOTE if offline else ""))
+                load_inventory()
+                update_stats()
+                win.destroy()
+            else:
+                queue_offline({"kind": "adjust", "material_id": material_id, "delta": -waste_qty,
+                               "type": "WASTE", "notes": reason}, key,
+                              "Failed to record waste. Please try again.", lambda q: saved(q, offline=True))
+        
+        run_db(record_waste, material_id, waste_qty, reason, op_key=key, on_done=saved)
+    
+    # Buttons frame
+    btn_frame = tk.Frame(form_frame, bg='white')
+    btn_frame.grid(row=4, column=0, columnspan=2, pady=10)
+    
+    ttk.Button(btn_frame, text="Cancel", command=win.destroy).pack(side="left", padx=(0,10))
+    ttk.Button(btn_frame, text="🗑️ Record Waste", command=write_off, style='Danger.TButton').pack(side="left")
+    
+    e_qty.focus_set()
+
+def fetch_stock_history_page(filters, after=None, before=None):
+    """Load and format one page of a material's ledger (runs on a worker thread)"""
+    rows = get_stock_history_page(after=after, before=before, **filters)
+    if rows is None:
+        return None
+    return [(str(tx_id),
+             (created_at.strftime("%Y-%m-%d %H:%M"),
+              tx_type,
+              f"{change:+}",
+              previous_q,
+              new_q,
+              (f"Batch #{reference_id}" if tx_type == "BATCH" else f"Sale #{reference_id}") if reference_id else "",
+              notes or ""),
+             (created_at, tx_id))
+            for tx_id, created_at, tx_type, change, previous_q, new_q, reference_id, notes in rows]
+
+def stock_history_popup():
+    sel = inv_tree.selection()
+    if not sel:
+        messagebox.showerror("❌ Error", "Please select a material to view its history!")
+        return
+    
+    material_data = inv_tree.item(sel[0])['values']
+    material_id = material_data[0]
+    material_name = material_data[1]
+    unit = material_data[3]
+    
+    win = tk.Toplevel(root)
+    win.title(f"📜 Stock History - {material_name}")
+    win.geometry("950x550")
+    win.configure(bg='white')
+    win.transient(root)
+    
+    # Header
+    header = tk.Frame(win, bg=PRIMARY_COLOR, height=60)
+    header.pack(fill="x")
+    header.pack_propagate(False)
+    
+    tk.Label(header, text=f"📜 Stock History - {material_name} ({unit})", font=('Arial', 14, 'bold'), 
+             fg='white', bg=PRIMARY_COLOR).pack(pady=20)
+    
+    # Filters
+    filter_frame = tk.Frame(win, bg='white')
+    filter_frame.pack(fill="x", padx=20, pady=(15,0))
+    
+    tk.Label(filter_frame, text="From (YYYY-MM-DD)", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').pack(side="left")
+    e_from = tk.Entry(filter_frame, width=12, font=('Arial', 10), relief='solid', bd=1)
+    e_from.pack(side="left", padx=(5,15))
+    
+    tk.Label(filter_frame, text="To", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').pack(side="left")
+    e_to = tk.Entry(filter_frame, width=12, font=('Arial', 10), relief='solid', bd=1)
+    e_to.pack(side="left", padx=(5,15))
+    
+    # Content frame
+    content_frame = tk.Frame(win, bg='white')
+    content_frame.pack(fill="both", expand=True, padx=20, pady=15)
+    
+    history_cols = ("Date", "Type", "Change", "Before", "After", "Reference", "Notes")
+    history_tree = ttk.Treeview(content_frame, columns=history_cols, show="headings", height=15, style='Custom.Treeview')
+    
+    for c in history_cols:
+        history_tree.heading(c, text=c)
+        history_tree.column(c, anchor="w" if c == "Notes" else "center", width=220 if c == "Notes" else 100)
+    
+    history_scroll = ttk.Scrollbar(content_frame, orient="vertical", command=history_tree.yview)
+    
+    history_tree.pack(side="left", fill="both", expand=True)
+    history_scroll.pack(side="right", fill="y")
+    
+    # Footer
+    footer = tk.Frame(win, bg='white')
+    footer.pack(fill="x", padx=20, pady=(0,15))
+    
+    error_label = tk.Label(footer, text="", font=('Arial', 10, 'bold'), fg=DANGER_COLOR, bg='white')
+    error_label.pack(side="left")
+    ttk.Button(footer, text="Close", command=win.destroy).pack(side="right")
+    
+    load_history = attach_paged_loader(win, history_tree, history_scroll, fetch_stock_history_page,
+                                       STOCK_HISTORY_PAGE_SIZE,
+                                       lambda: error_label.config(text="❌ Error loading stock history"))
+    
+    def apply_filters():
+        try:
+            start_date = date.fromisoformat(e_from.get().strip()) if e_from.get().strip() else None
+            end_date = date.fromisoformat(e_to.get().strip()) if e_to.get().strip() else None
+        except ValueError:
+            messagebox.showerror("❌ Error", "Please enter dates as YYYY-MM-DD!")
+            return
+        error_label.config(text="")
+        load_history({"material_id": material_id, "start_date": start_date, "end_date": end_date})
+    
+    ttk.Button(filter_frame, text="🔍 Apply", command=apply_filters, 
+               style='Primary.TButton').pack(side="left")
+    
+    apply_filters()
+
 def delete_material_popup():
     sel = inv_tree.selection()
     if not sel:
@@ -540,13 +820,16 @@ def delete_material_popup():
     result = messagebox.askyesno("⚠️ Confirm Delete", 
                                 f"Are you sure you want to delete '{material_name}'?\n\nThis action cannot be undone!")
     if result:
-        ok, message = delete_material(material_id)
-        if ok:
-            messagebox.showinfo("✅ Success", f"Material '{material_name}' deleted successfully!")
-            load_inventory()
-            update_stats()
-        else:
-            messagebox.showerror("❌ Error", f"Failed to delete material: {message}")
+        def deleted(res):
+            ok, message = res
+            if ok:
+                messagebox.showinfo("✅ Success", f"Material '{material_name}' deleted successfully!")
+                load_inventory()
+                update_stats()
+            else:
+                messagebox.showerror("❌ Error", f"Failed to delete material: {message}")
+        
+        run_db(delete_material, material_id, on_done=deleted)
 
 def show_item_profitability():
     """Show profitability analysis for each menu item"""
@@ -583,41 +866,159 @@ def show_item_profitability():
     profit_tree.pack(side="left", fill="both", expand=True)
     profit_scroll.pack(side="right", fill="y")
     
-    # Populate data
-    items = get_item_profitability()
-    for item in items:
-        name, selling_price, material_cost, profit_per_unit, margin = item
-        values = (
-            name,
-            f"₹{selling_price:.2f}",
-            f"₹{material_cost:.2f}",
-            f"₹{profit_per_unit:.2f}",
-            f"{margin:.1f}%"
-        )
-        
-        # Color code based on profitability
-        if profit_per_unit > 5:
-            tag = "high_profit"
-        elif profit_per_unit > 2:
-            tag = "medium_profit"
-        else:
-            tag = "low_profit"
+    # Populate data once loaded
+    def populate(items):
+        for item in items:
+            name, selling_price, material_cost, profit_per_unit, margin = item
+            values = (
+                name,
+                f"₹{selling_price:.2f}",
+                f"₹{material_cost:.2f}",
+                f"₹{profit_per_unit:.2f}",
+                f"{margin:.1f}%"
+            )
+        
+            # Color code based on profitability
+            if profit_per_unit > 5:
+                tag = "high_profit"
+            elif profit_per_unit > 2:
+                tag = "medium_profit"
+            else:
+                tag = "low_profit"
         
-        profit_tree.insert("", "end", values=values, tags=(tag,))
+            profit_tree.insert("", "end", values=values, tags=(tag,))
+    
+        # Configure row colors
+        profit_tree.tag_configure("high_profit", background="#e8f5e8", foreground="#2e7d32")
+        profit_tree.tag_configure("medium_profit", background="#fff3e0", foreground="#ef6c00")
+        profit_tree.tag_configure("low_profit", background="#ffebee", foreground="#c62828")
     
-    # Configure row colors
-    profit_tree.tag_configure("high_profit", background="#e8f5e8", foreground="#2e7d32")
-    profit_tree.tag_configure("medium_profit", background="#fff3e0", foreground="#ef6c00")
-    profit_tree.tag_configure("low_profit", background="#ffebee", foreground="#c62828")
+    run_db(get_item_profitability, on_done=populate)
     
     # Close button
     ttk.Button(content_frame, text="Close", command=win.destroy).pack(pady=(10,0))
 
+PAGED_WINDOW_PAGES = 5   # pages kept in a paged tree at once
+
+def attach_paged_loader(win, tree, scrollbar, fetch_page, page_size, on_error):
+    """
+    Make a Treeview page through a keyset-paginated query as the user
+    scrolls, keeping at most PAGED_WINDOW_PAGES pages in the tree: pages far
+    out of view are dropped and fetched again when scrolled back to.
+
+    fetch_page(filters, after=None, before=None) runs on a worker thread and
+    returns [(iid, values, key), ...] newest first, or None on failure.
+    Returns load(filters), which clears the tree and starts from the top.
+    """
+    # pages: [(first_key, last_key, [iid, ...]), ...] currently in the tree, newest first
+    state = {"filters": {}, "pages": [], "loading": False, "at_start": True, "at_end": False, "generation": 0}
+    
+    def keep_view(change_above, change):
+        """Hold the rows on screen still while rows are added/removed above them"""
+        first = tree.yview()[0]
+        total = len(tree.get_children())
+        change()
+        new_total = len(tree.get_children())
+        if new_total:
+            tree.yview_moveto((round(first * total) + change_above()) / new_total)
+    
+    def page_loaded(page, generation, older):
+        if generation != state["generation"] or not win.winfo_exists():
+            return  # filters changed or window closed meanwhile
+        state["loading"] = False
+        if page is None:
+            on_error()
+            return
+        if len(page) < page_size:
+            state["at_end" if older else "at_start"] = True
+        if not page:
+            return
+        pages = state["pages"]
+        entry = (page[0][2], page[-1][2], [iid for iid, _values, _key in page])
+        added_above = [0]
+        
+        def apply():
+            if older:
+                for iid, values, _key in page:
+                    tree.insert("", "end", iid=iid, values=values)
+                pages.append(entry)
+                if len(pages) > PAGED_WINDOW_PAGES:
+                    dropped = pages.pop(0)
+                    tree.delete(*dropped[2])
+                    added_above[0] = -len(dropped[2])
+                    state["at_start"] = False
+            else:
+                for index, (iid, values, _key) in enumerate(page):
+                    tree.insert("", index, iid=iid, values=values)
+                pages.insert(0, entry)
+                added_above[0] = len(page)
+                if len(pages) > PAGED_WINDOW_PAGES:
+                    tree.delete(*pages.pop()[2])
+                    state["at_end"] = False
+        
+        keep_view(lambda: added_above[0], apply)
+    
+    def load_page(older):
+        pages = state["pages"]
+        state["loading"] = True
+        generation = state["generation"]
+        if older:
+            after = pages[-1][1] if pages else None
+            run_db(fetch_page, state["filters"], after=after,
+                   on_done=lambda page: page_loaded(page, generation, True))
+        else:
+            run_db(fetch_page, state["filters"], before=pages[0][0],
+                   on_done=lambda page: page_loaded(page, generation, False))
+    
+    def on_scroll(first, last):
+        scrollbar.set(first, last)
+        if state["loading"] or not state["pages"]:
+            return
+        if float(last) > 0.9 and not state["at_end"]:
+            load_page(older=True)
+        elif float(first) < 0.1 and not state["at_start"]:
+            load_page(older=False)
+    
+    tree.configure(yscrollcommand=on_scroll)
+    
+    def load(filters):
+        state.update(filters=filters, pages=[], loading=False, at_start=True, at_end=False,
+                     generation=state["generation"] + 1)
+        tree.delete(*tree.get_children())
+        load_page(older=True)
+    
+    return load
+
+def fetch_sales_page(filters, after=None, before=None):
+    """
+    Load one Sales History page and format it for display. Runs on a worker
+    thread, so the UI thread only inserts ready-made rows.
+    Returns [(iid, values, key), ...] or None on failure.
+    """
+    rows = get_sales_page(after=after, before=before, **filters)
+    if rows is None:
+        return None
+    return [(str(sale_id),
+             (sale_date.strftime("%Y-%m-%d"),
+              sale_time.strftime("%H:%M") if sale_time else "",
+              item,
+              qty,
+              f"₹{unit_price:.2f}",
+              f"₹{revenue:.2f}",
+              f"₹{cost:.2f}",
+              f"₹{profit:.2f}"),
+             (sale_date, sale_time, sale_id))
+            for sale_id, sale_date, sale_time, item, qty, unit_price, revenue, cost, profit in rows]
+
 def show_sales_history():
-    """Show individual sales records"""
+    """
+    Browse individual sales records, newest first. Pages are fetched as the
+    user scrolls (see attach_paged_loader), so a whole year of sales can be
+    browsed without loading it all.
+    """
     win = tk.Toplevel(root)
     win.title("📋 Sales History")
-    win.geometry("900x500")
+    win.geometry("1000x600")
     win.configure(bg='white')
     win.transient(root)
     
@@ -629,64 +1030,93 @@ def show_sales_history():
     tk.Label(header, text="📋 Individual Sales Records", font=('Arial', 14, 'bold'), 
              fg='white', bg=SECONDARY_COLOR).pack(pady=20)
     
+    # Filters
+    filter_frame = tk.Frame(win, bg='white')
+    filter_frame.pack(fill="x", padx=20, pady=(15,0))
+    
+    tk.Label(filter_frame, text="From (YYYY-MM-DD)", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').pack(side="left")
+    e_from = tk.Entry(filter_frame, width=12, font=('Arial', 10), relief='solid', bd=1)
+    e_from.pack(side="left", padx=(5,15))
+    e_from.insert(0, (date.today() - timedelta(days=365)).isoformat())
+    
+    tk.Label(filter_frame, text="To", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').pack(side="left")
+    e_to = tk.Entry(filter_frame, width=12, font=('Arial', 10), relief='solid', bd=1)
+    e_to.pack(side="left", padx=(5,15))
+    e_to.insert(0, date.today().isoformat())
+    
+    tk.Label(filter_frame, text="Category", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').pack(side="left")
+    category_combo = ttk.Combobox(filter_frame, values=["All categories"], state="readonly", 
+                                  width=20, font=('Arial', 10))
+    category_combo.pack(side="left", padx=(5,15))
+    category_combo.current(0)
+    category_ids = {}
+    
+    def categories_loaded(categories):
+        category_ids.update({c[1]: c[0] for c in categories})
+        category_combo.config(values=["All categories"] + [c[1] for c in categories])
+    
+    run_db(fetch_categories, on_done=categories_loaded)
+    
     # Content frame
     content_frame = tk.Frame(win, bg='white')
-    content_frame.pack(fill="both", expand=True, padx=20, pady=20)
+    content_frame.pack(fill="both", expand=True, padx=20, pady=15)
     
     # Create treeview for sales history
-    sales_cols = ("Date", "Item", "Qty", "Unit Price (₹)", "Revenue (₹)", "Cost (₹)", "Profit (₹)")
+    sales_cols = ("Date", "Time", "Item", "Qty", "Unit Price (₹)", "Revenue (₹)", "Cost (₹)", "Profit (₹)")
     sales_tree = ttk.Treeview(content_frame, columns=sales_cols, show="headings", height=15, style='Custom.Treeview')
     
     for c in sales_cols:
         sales_tree.heading(c, text=c)
-        sales_tree.column(c, anchor="center", width=120)
+        sales_tree.column(c, anchor="center", width=170 if c == "Item" else 100)
     
     # Add scrollbar
     sales_scroll = ttk.Scrollbar(content_frame, orient="vertical", command=sales_tree.yview)
-    sales_tree.configure(yscrollcommand=sales_scroll.set)
     
     sales_tree.pack(side="left", fill="both", expand=True)
     sales_scroll.pack(side="right", fill="y")
     
-    # Get sales data from database
-    conn = get_connection()
-    if conn:
+    # Footer: totals for the filter and close button
+    footer = tk.Frame(win, bg='white')
+    footer.pack(fill="x", padx=20, pady=(0,15))
+    
+    totals_label = tk.Label(footer, text="", font=('Arial', 10, 'bold'), fg=SUCCESS_COLOR, bg='white')
+    totals_label.pack(side="left")
+    ttk.Button(footer, text="Close", command=win.destroy).pack(side="right")
+    
+    def show_error():
+        totals_label.config(text="❌ Error loading sales data", fg=DANGER_COLOR)
+    
+    load_sales = attach_paged_loader(win, sales_tree, sales_scroll, fetch_sales_page, SALES_PAGE_SIZE, show_error)
+    
+    def show_totals(report):
+        if not win.winfo_exists():
+            return
+        sales_count = sum(r[1] for r in report)
+        revenue = rupees(sum(to_paise(r[3]) for r in report))
+        profit = rupees(sum(to_paise(r[5]) for r in report))
+        totals_label.config(text=f"📊 {sales_count} sales • Revenue ₹{revenue:.2f} • Profit ₹{profit:.2f}",
+                            fg=SUCCESS_COLOR)
+    
+    def apply_filters():
         try:
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT ds.sale_date, c.name, ds.quantity_sold, ds.unit_price, 
-                       ds.total_revenue, ds.total_cost, ds.total_profit
-                FROM daily_sales ds
-                JOIN categories c ON ds.category_id = c.id
-                ORDER BY ds.sale_date DESC, ds.sale_time DESC
-                LIMIT 100
-            """)
-            sales_data = cur.fetchall()
-            conn.close()
-            
-            # Populate data
-            for sale in sales_data:
-                date, item, qty, unit_price, revenue, cost, profit = sale
-                values = (
-                    date.strftime("%Y-%m-%d"),
-                    item,
-                    qty,
-                    f"₹{unit_price:.2f}",
-                    f"₹{revenue:.2f}",
-                    f"₹{cost:.2f}",
-                    f"₹{profit:.2f}"
-                )
-                sales_tree.insert("", "end", values=values)
-                
-        except Exception as e:
-            tk.Label(content_frame, text=f"Error loading sales data: {e}", 
-                     font=('Arial', 12), fg='red', bg='white').pack(expand=True)
-    else:
-        tk.Label(content_frame, text="Database connection failed", 
-                 font=('Arial', 12), fg='red', bg='white').pack(expand=True)
+            start_date = date.fromisoformat(e_from.get().strip()) if e_from.get().strip() else None
+            end_date = date.fromisoformat(e_to.get().strip()) if e_to.get().strip() else None
+        except ValueError:
+            messagebox.showerror("❌ Error", "Please enter dates as YYYY-MM-DD!")
+            return
+        category_id = category_ids.get(category_combo.get())
+        
+        totals_label.config(text="")
+        load_sales({"start_date": start_date, "end_date": end_date, "category_id": category_id})
+        run_db(get_sales_totals, "category", start_date, end_date, category_id, on_done=show_totals)
     
-    # Close button
-    ttk.Button(content_frame, text="Close", command=win.destroy).pack(pady=(10,0))
+    ttk.Button(filter_frame, text="🔍 Apply", command=apply_filters, 
+               style='Primary.TButton').pack(side="left")
+    
+    apply_filters()
 
 def show_profit_summary():
     """Show daily profit summary"""
@@ -723,34 +1153,46 @@ def show_profit_summary():
     summary_tree.pack(side="left", fill="both", expand=True)
     summary_scroll.pack(side="right", fill="y")
     
-    # Populate data
-    summaries = get_profit_summary(7)
-    total_profit = 0
-    total_revenue = 0
-    
-    for summary in summaries:
-        date, sales_count, revenue, cost, profit, margin = summary
-        total_profit += float(profit)
-        total_revenue += float(revenue)
-        
-        values = (
-            date.strftime("%Y-%m-%d"),
-            sales_count,
-            f"₹{revenue:.2f}",
-            f"₹{cost:.2f}",
-            f"₹{profit:.2f}",
-            f"{margin:.1f}%"
-        )
-        summary_tree.insert("", "end", values=values)
-    
-    # Summary stats
+    # Summary stats, filled in with the data
     stats_frame = tk.Frame(content_frame, bg='white')
     stats_frame.pack(fill="x", pady=(10,0))
     
-    tk.Label(stats_frame, text=f"Total 7-Day Profit: ₹{total_profit:.2f}", 
-             font=('Arial', 12, 'bold'), fg=SUCCESS_COLOR, bg='white').pack()
-    tk.Label(stats_frame, text=f"Average Daily Profit: ₹{total_profit/7:.2f}", 
-             font=('Arial', 10), fg=DARK_TEXT, bg='white').pack()
+    # Populate data once loaded
+    def populate(summaries):
+        total_profit = 0
+        total_revenue = 0
+    
+        for summary in summaries:
+            date, sales_count, revenue, cost, profit, margin = summary
+            total_profit += to_paise(profit)
+            total_revenue += to_paise(revenue)
+        
+            values = (
+                date.strftime("%Y-%m-%d"),
+                sales_count,
+                f"₹{revenue:.2f}",
+                f"₹{cost:.2f}",
+                f"₹{profit:.2f}",
+                f"{margin:.1f}%"
+            )
+            summary_tree.insert("", "end", values=values)
+    
+        tk.Label(stats_frame, text=f"Total 7-Day Profit: ₹{rupees(total_profit)}", 
+                 font=('Arial', 12, 'bold'), fg=SUCCESS_COLOR, bg='white').pack()
+        tk.Label(stats_frame, text=f"Average Daily Profit: ₹{rupees(div_round(total_profit, 7))}", 
+                 font=('Arial', 10), fg=DARK_TEXT, bg='white').pack()
+    
+    top_label = tk.Label(content_frame, text="", font=('Arial', 10), fg=DARK_TEXT, bg='white')
+    top_label.pack()
+    
+    def show_top_items(items):
+        if items and win.winfo_exists():
+            top_text = " • ".join(f"{name} ₹{profit:.0f}" for name, _, _, _, _, profit in items)
+            top_label.config(text=f"🏆 Top Sellers: {top_text}")
+    
+    # Both answered from the in-memory sales arrays (analytics.py)
+    run_db(get_daily_profit, 7, on_done=populate)
+    run_db(get_top_items, 3, "total_profit", date.today() - timedelta(days=7), on_done=show_top_items)
     
     # Close button
     ttk.Button(content_frame, text="Close", command=win.destroy).pack(pady=(10,0))
@@ -787,20 +1229,15 @@ cat_v_scroll.pack(side="right", fill="y")
 cat_h_scroll.pack(side="bottom", fill="x")
 
 def load_categories():
-    for i in cat_tree.get_children():
-        cat_tree.delete(i)
-    for c in fetch_categories():
-        cat_tree.insert("", "end", values=c)
-    
-    # Add alternating row colors
-    for i, item in enumerate(cat_tree.get_children()):
-        if i % 2 == 0:
-            cat_tree.item(item, tags=("even",))
-        else:
-            cat_tree.item(item, tags=("odd",))
-    
-    cat_tree.tag_configure("even", background="#f8f9fa")
-    cat_tree.tag_configure("odd", background="white")
+    run_db(fetch_categories, on_done=render_categories, latest=cat_tree)
+
+# Alternating row colors
+cat_tree.tag_configure("even", background="#f8f9fa")
+cat_tree.tag_configure("odd", background="white")
+
+def render_categories(categories):
+    sync_tree(cat_tree, [(str(c[0]), tuple(c), ("even",) if i % 2 == 0 else ("odd",))
+                         for i, c in enumerate(categories)])
 
 # INVENTORY CONTROLS PANEL
 inv_controls_title = tk.Label(inv_right, text="🔧 Inventory Controls", 
@@ -813,20 +1250,31 @@ stats_frame = tk.LabelFrame(inv_right, text="Quick Stats", font=('Arial', 10, 'b
 stats_frame.pack(fill="x", padx=15, pady=10)
 
 def update_stats():
-    inventory = fetch_inventory()
+    run_db(fetch_inventory, on_done=render_stats, latest=stats_frame)
+
+# Simple clean stats
+total_items_label = tk.Label(stats_frame, text="Total Items: -", bg=CARD_BG, font=('Arial', 9))
+total_items_label.pack(anchor="w", padx=10, pady=2)
+low_stock_label = tk.Label(stats_frame, text="Low Stock: -", bg=CARD_BG, font=('Arial', 9))
+low_stock_label.pack(anchor="w", padx=10, pady=2)
+out_of_stock_label = tk.Label(stats_frame, text="Out of Stock: -", bg=CARD_BG, font=('Arial', 9))
+out_of_stock_label.pack(anchor="w", padx=10, pady=2)
+cache_label = tk.Label(stats_frame, text="", bg=CARD_BG, font=('Arial', 8), fg='gray')
+
+def render_stats(inventory):
     total_items = len(inventory)
     low_stock = sum(1 for item in inventory if float(item[2] or 0) <= float(item[4] or 0))
     out_of_stock = sum(1 for item in inventory if float(item[2] or 0) <= 0)
     
-    for widget in stats_frame.winfo_children():
-        widget.destroy()
-    
-    # Simple clean stats
-    tk.Label(stats_frame, text=f"Total Items: {total_items}", bg=CARD_BG, font=('Arial', 9)).pack(anchor="w", padx=10, pady=2)
-    tk.Label(stats_frame, text=f"Low Stock: {low_stock}", bg=CARD_BG, font=('Arial', 9), 
-             fg=WARNING_COLOR if low_stock > 0 else 'black').pack(anchor="w", padx=10, pady=2)
-    tk.Label(stats_frame, text=f"Out of Stock: {out_of_stock}", bg=CARD_BG, font=('Arial', 9), 
-             fg=DANGER_COLOR if out_of_stock > 0 else 'black').pack(anchor="w", padx=10, pady=2)
+    total_items_label.config(text=f"Total Items: {total_items}")
+    low_stock_label.config(text=f"Low Stock: {low_stock}", fg=WARNING_COLOR if low_stock > 0 else 'black')
+    out_of_stock_label.config(text=f"Out of Stock: {out_of_stock}", fg=DANGER_COLOR if out_of_stock > 0 else 'black')
+    cache_stats = cache.stats()
+    if cache_stats["listening"]:
+        cache_label.config(text=f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+        cache_label.pack(anchor="w", padx=10, pady=2)
+    else:
+        cache_label.pack_forget()
 
 # Simple Material Management
 material_frame = tk.LabelFrame(inv_right, text="Material Management", font=('Arial', 10, 'bold'), 
@@ -839,6 +1287,10 @@ ttk.Button(material_frame, text="Edit Material", command=lambda: edit_material_p
           style='Primary.TButton').pack(fill="x", padx=10, pady=5)
 ttk.Button(material_frame, text="Restock Material", command=lambda: restock_material_popup(), 
           style='Warning.TButton').pack(fill="x", padx=10, pady=5)
+ttk.Button(material_frame, text="Record Waste", command=lambda: waste_material_popup(), 
+          style='Danger.TButton').pack(fill="x", padx=10, pady=5)
+ttk.Button(material_frame, text="Stock History", command=lambda: stock_history_popup(), 
+          style='Primary.TButton').pack(fill="x", padx=10, pady=5)
 ttk.Button(material_frame, text="Delete Material", command=lambda: delete_material_popup(), 
           style='Danger.TButton').pack(fill="x", padx=10, pady=5)
 
@@ -921,13 +1373,16 @@ def add_category_popup():
             messagebox.showerror("❌ Error", "Please enter a valid selling price!")
             return
         
-        ok, res = create_category(name, desc, selling_price)
-        if ok:
-            messagebox.showinfo("✅ Success", f"Category '{name}' created successfully with price ₹{selling_price}!")
-            load_categories()
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", res)
+        def saved(result):
+            ok, res = result
+            if ok:
+                messagebox.showinfo("✅ Success", f"Category '{name}' created successfully with price ₹{selling_price}!")
+                load_categories()
+                win.destroy()
+            else:
+                messagebox.showerror("❌ Error", res)
+        
+        run_db(create_category, name, desc, selling_price, on_done=saved)
     
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
@@ -1013,13 +1468,16 @@ def edit_category_popup():
             messagebox.showerror("❌ Error", "Please enter a valid selling price!")
             return
         
-        ok, res = update_category(cat_id, name, desc, selling_price)
-        if ok:
-            messagebox.showinfo("✅ Success", f"Category '{name}' updated successfully!")
-            load_categories()
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", res)
+        def saved(result):
+            ok, res = result
+            if ok:
+                messagebox.showinfo("✅ Success", f"Category '{name}' updated successfully!")
+                load_categories()
+                win.destroy()
+            else:
+                messagebox.showerror("❌ Error", res)
+        
+        run_db(update_category, cat_id, name, desc, selling_price, on_done=saved)
     
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
@@ -1046,12 +1504,15 @@ def delete_category_confirm():
                                 "This action cannot be undone!")
     
     if result:
-        ok, res = delete_category(cat_id)
-        if ok:
-            messagebox.showinfo("✅ Success", f"Category '{cat_name}' deleted successfully!")
-            load_categories()
-        else:
-            messagebox.showerror("❌ Error", f"Failed to delete category: {res}")
+        def deleted(result):
+            ok, res = result
+            if ok:
+                messagebox.showinfo("✅ Success", f"Category '{cat_name}' deleted successfully!")
+                load_categories()
+            else:
+                messagebox.showerror("❌ Error", f"Failed to delete category: {res}")
+        
+        run_db(delete_category, cat_id, on_done=deleted)
 
 def map_material_popup():
     sel = cat_tree.selection()
@@ -1060,7 +1521,9 @@ def map_material_popup():
         return
     cat_id = cat_tree.item(sel[0])['values'][0]
     cat_name = cat_tree.item(sel[0])['values'][1]
-    
+    run_db(fetch_inventory, on_done=lambda materials: map_material_window(cat_id, cat_name, materials))
+
+def map_material_window(cat_id, cat_name, materials):
     win = tk.Toplevel(root)
     win.title("🔗 Map Material to Category")
     win.geometry("600x320")
@@ -1084,8 +1547,7 @@ def map_material_popup():
     tk.Label(form_frame, text="Select Material *", font=('Arial', 10, 'bold'), 
              fg=DARK_TEXT, bg='white').grid(row=0, column=0, sticky="w", pady=(0,5))
     
-    # Get all materials for dropdown
-    materials = fetch_inventory()
+    # All materials for the dropdown
     material_options = []
     material_map = {}  # To map display text to material ID
     
@@ -1140,13 +1602,16 @@ def map_material_popup():
             messagebox.showerror("❌ Error", "Please enter valid values!")
             return
         
-        ok, err = set_category_material(cat_id, mid, amt)
-        if ok:
-            material_name = selected_material.split(' - ')[0]
-            messagebox.showinfo("✅ Success", f"Material mapping saved successfully!\n\nCategory: {cat_name}\nMaterial: {material_name}\nAmount per unit: {amt}")
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", err)
+        def saved(result):
+            ok, err = result
+            if ok:
+                material_name = selected_material.split(' - ')[0]
+                messagebox.showinfo("✅ Success", f"Material mapping saved successfully!\n\nCategory: {cat_name}\nMaterial: {material_name}\nAmount per unit: {amt}")
+                win.destroy()
+            else:
+                messagebox.showerror("❌ Error", err)
+        
+        run_db(set_category_material, cat_id, mid, amt, on_done=saved)
     
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
@@ -1164,7 +1629,9 @@ def view_category_materials():
         return
     cat_id = cat_tree.item(sel[0])['values'][0]
     cat_name = cat_tree.item(sel[0])['values'][1]
-    
+    run_db(get_category_materials, cat_id, on_done=lambda rows: category_materials_window(cat_name, rows))
+
+def category_materials_window(cat_name, rows):
     win = tk.Toplevel(root)
     win.title(f"👁️ Materials in '{cat_name}'")
     win.geometry("800x500")
@@ -1183,8 +1650,6 @@ def view_category_materials():
     content_frame = tk.Frame(win, bg='white')
     content_frame.pack(fill="both", expand=True, padx=20, pady=20)
     
-    rows = get_category_materials(cat_id)
-    
     if not rows:
         tk.Label(content_frame, text="📭 No materials mapped to this category yet.", 
                 font=('Arial', 12), fg=DARK_TEXT, bg='white').pack(expand=True)
@@ -1214,14 +1679,53 @@ def view_category_materials():
     # Close button
     ttk.Button(content_frame, text="Close", command=win.destroy).pack(pady=(10,0))
 
-# Sale popup and deduction logic
-def sale_popup():
-    sel = cat_tree.selection()
+COLD_DRINK_BRANDS = ["Coca Cola", "Pepsi", "Sprite", "Fanta", "Thumbs Up", "Limca"]
+
+def get_cold_drink_brand_options():
+    """Combobox entries for the cold drink brands, with their current stock"""
+    # Get available cold drink brands from inventory
+    cold_drink_brands = []
+    try:
+        conn = get_connection()
+        if conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT name, quantity, unit FROM raw_materials 
+                WHERE name = ANY(%s)
+                ORDER BY name
+            """, (COLD_DRINK_BRANDS,))
+            brands = cur.fetchall()
+            conn.close()
+        else:
+            # Offline: the mirror's stock (fetch_inventory falls back to it)
+            brands = sorted((r[1], r[2], r[3]) for r in fetch_inventory() if r[1] in COLD_DRINK_BRANDS)
+        
+        for brand_name, qty, unit in brands:
+            qty = float(qty)
+            if qty > 0:
+                cold_drink_brands.append(f"{brand_name} (Stock: {qty} {unit})")
+            else:
+                cold_drink_brands.append(f"{brand_name} (Out of Stock)")
+    except Exception as e:
+        cold_drink_brands = list(COLD_DRINK_BRANDS)
+    return cold_drink_brands
+
+def parse_brand_option(option):
+    """'Pepsi (Stock: 46.0 bottles)' -> 'Pepsi'"""
+    return option.split(" (Stock:")[0].split(" (Out of Stock)")[0]
+
+# Sale popup and deduction logic
+def sale_popup():
+    sel = cat_tree.selection()
     if not sel:
         messagebox.showerror("❌ Error", "Please select a category first!")
         return
     cat_id = cat_tree.item(sel[0])['values'][0]
     cat_name = cat_tree.item(sel[0])['values'][1]
+    cat_price = float(cat_tree.item(sel[0])['values'][3] or 0)
+    # One key per sale: submitting again after an error or timeout returns
+    # the sale already recorded instead of recording it twice
+    order_key = uuid.uuid4().hex
 
     win = tk.Toplevel(root)
     win.title(f"🛒 Record Sale - {cat_name}")
@@ -1258,33 +1762,11 @@ def sale_popup():
                  fg=DARK_TEXT, bg='white').grid(row=current_row, column=0, sticky="w", pady=(0,5))
         current_row += 1
         
-        # Get available cold drink brands from inventory
-        cold_drink_brands = []
-        try:
-            conn = get_connection()
-            if conn:
-                cur = conn.cursor()
-                cur.execute("""
-                    SELECT name, quantity, unit FROM raw_materials 
-                    WHERE name IN ('Coca Cola', 'Pepsi', 'Sprite', 'Fanta', 'Thumbs Up', 'Limca')
-                    ORDER BY name
-                """)
-                brands = cur.fetchall()
-                conn.close()
-                
-                for brand_name, qty, unit in brands:
-                    qty = float(qty)
-                    if qty > 0:
-                        cold_drink_brands.append(f"{brand_name} (Stock: {qty} {unit})")
-                    else:
-                        cold_drink_brands.append(f"{brand_name} (Out of Stock)")
-        except Exception as e:
-            cold_drink_brands = ["Coca Cola", "Pepsi", "Sprite", "Fanta", "Thumbs Up", "Limca"]
-        
-        brand_combo = ttk.Combobox(form_frame, values=cold_drink_brands, state="readonly", 
+        brand_combo = ttk.Combobox(form_frame, values=[], state="readonly", 
                                   width=32, font=('Arial', 10))
         brand_combo.grid(row=current_row, column=0, columnspan=2, sticky="ew", pady=(0,15))
         current_row += 1
+        run_db(get_cold_drink_brand_options, on_done=lambda options: brand_combo.config(values=options))
     
     tk.Label(form_frame, text="Customer Name (optional)", font=('Arial', 10, 'bold'), 
              fg=DARK_TEXT, bg='white').grid(row=current_row, column=0, sticky="w", pady=(0,5))
@@ -1316,213 +1798,175 @@ def sale_popup():
 
     def process_sale():
         try:
-            qty_sold = float(e_qty.get())
+            qty_sold = int(e_qty.get())
             if qty_sold <= 0:
                 raise ValueError()
         except Exception:
-            messagebox.showerror("Error", "Enter valid positive quantity")
+            messagebox.showerror("Error", "Enter a valid positive whole quantity")
             return
 
-        # Special handling for cold drinks
+        # Cold drinks are sold per brand straight from its raw material stock
+        selected_brand = None
         if cat_name.lower() == "cold drinks":
             if not brand_combo or not brand_combo.get():
                 messagebox.showerror("Error", "Please select a brand!")
                 return
             
             # Extract brand name from selection (remove stock info)
-            selected_brand = brand_combo.get().split(" (Stock:")[0].split(" (Out of Stock)")[0]
+            selected_brand = parse_brand_option(brand_combo.get())
             
             # Check if brand is out of stock
             if "Out of Stock" in brand_combo.get():
                 messagebox.showerror("Error", f"{selected_brand} is out of stock!")
                 return
-            
-            # For cold drinks, directly deduct from the selected brand's inventory
-            conn = get_connection()
-            if not conn:
-                messagebox.showerror("Error", "DB connection failed")
-                return
-            
-            try:
-                cur = conn.cursor()
-                # Get current stock of selected brand
-                cur.execute("SELECT quantity FROM raw_materials WHERE name = %s FOR UPDATE", (selected_brand,))
-                result = cur.fetchone()
-                
-                if not result:
-                    conn.rollback()
-                    conn.close()
-                    messagebox.showerror("Error", f"{selected_brand} not found in inventory")
-                    return
-                
-                current_stock = float(result[0])
-                if current_stock < qty_sold:
-                    conn.rollback()
-                    conn.close()
-                    messagebox.showerror("Error", f"Not enough {selected_brand} in stock! Available: {current_stock}")
-                    return
-                
-                # Deduct the stock
-                new_stock = current_stock - qty_sold
-                cur.execute("UPDATE raw_materials SET quantity = %s, last_updated = NOW() WHERE name = %s", 
-                           (new_stock, selected_brand))
-                
-                # Get selling price for cold drinks
-                cur.execute("SELECT selling_price FROM categories WHERE id = %s", (cat_id,))
-                price_row = cur.fetchone()
-                selling_price = float(price_row[0]) if price_row and price_row[0] else 25.0  # Default price for cold drinks
-                
-                # Calculate profit for cold drinks (cost is the material cost)
-                cur.execute("SELECT cost_per_unit FROM raw_materials WHERE name = %s", (selected_brand,))
-                cost_row = cur.fetchone()
-                material_cost = float(cost_row[0]) if cost_row and cost_row[0] else 0.0
-                
-                conn.commit()
-                conn.close()
-                
-                profit_per_unit = selling_price - material_cost
-                total_profit = profit_per_unit * qty_sold
-                profit_margin = (profit_per_unit / selling_price * 100) if selling_price > 0 else 0
-                
-                profit_msg = f"""Sale recorded successfully! 
 
-📊 PROFIT ANALYSIS:
-• Units Sold: {qty_sold}
-• Selling Price: ₹{selling_price} per unit
-• Material Cost: ₹{material_cost:.2f} per unit
-• Profit per Unit: ₹{profit_per_unit:.2f}
-• Total Profit: ₹{total_profit:.2f}
-• Profit Margin: {profit_margin:.1f}%"""
-                
-                # Generate bill for cold drinks
-                customer_name = e_customer.get().strip()
-                customer_phone = e_phone.get().strip()
-                items = [(f"{selected_brand} ({cat_name})", qty_sold, selling_price)]
-                bill_text, total_amount = generate_bill_text(items, customer_name, customer_phone)
-                
-                # Show bill and offer WhatsApp sending
-                show_bill_popup(bill_text, customer_phone, f"{selected_brand} sale", profit_msg)
-                
-                load_inventory()
-                update_stats()
-                win.destroy()
-                return
-                
-            except Exception as e:
-                try:
-                    conn.rollback()
-                    conn.close()
-                except:
-                    pass
-                messagebox.showerror("Error", f"Failed to process sale: {e}")
-                return
-
-        # Regular processing for non-cold drinks
-        mats = get_category_materials(cat_id)
-        if not mats:
-            messagebox.showerror("Error", "No materials mapped to this category")
+        # Deduct stock, price, cost and record the sale in one transaction;
+        # the button stays disabled until it is done so it is not recorded twice
+        confirm_btn.config(state="disabled")
+        customer = (e_customer.get().strip(), e_phone.get().strip())
+        # Write-behind: a recipe sale the local mirror vouches for is done as
+        # soon as it is in the journal. Brand sales (their stock must be
+        # checked), sales the mirror cannot vouch for and strict mode (the
+        # database refuses short sales) are recorded synchronously.
+        if WRITE_BEHIND and not STRICT_STOCK and not selected_brand \
+                and check_sale([(cat_id, qty_sold, None)]) is None:
+            journal_sale(qty_sold, selected_brand, *customer)
             return
+        run_db(record_sale, cat_id, qty_sold, brand=selected_brand, order_key=order_key,
+               on_done=lambda result: sale_recorded(result, qty_sold, selected_brand, *customer))
 
-        deductions = []
-        for mat in mats:
-            mid, name, per_unit, stock, unit, threshold, supplier_id = mat
-            total_needed = float(per_unit) * qty_sold
-            deductions.append({
-                "material_id": mid,
-                "name": name,
-                "total_needed": total_needed,
-                "unit": unit,
-                "threshold": threshold,
-                "stock": stock,
-                "supplier_id": supplier_id
-            })
-
-        # Apply deductions in a transaction
-        conn = get_connection()
-        if not conn:
-            messagebox.showerror("Error", "DB connection failed")
-            return
+    def journal_sale(qty_sold, selected_brand, customer_name, customer_phone):
+        # The sale is written to the database in the background
         try:
-            cur = conn.cursor()
-            low_items = []
-            for d in deductions:
-                cur.execute("SELECT quantity, threshold FROM raw_materials WHERE id = %s FOR UPDATE", (d["material_id"],))
-                row = cur.fetchone()
-                if not row:
-                    conn.rollback()
-                    conn.close()
-                    messagebox.showerror("Error", f"Material id {d['material_id']} not found")
-                    return
-                current_q = float(row[0])
-                new_q = current_q - d["total_needed"]
-                if new_q < 0:
-                    new_q = 0.0
-                cur.execute("UPDATE raw_materials SET quantity=%s, last_updated=NOW() WHERE id=%s", (new_q, d["material_id"]))
-                if new_q < float(d["threshold"]):
-                    low_items.append({
-                        "material_id": d["material_id"],
-                        "name": d["name"],
-                        "new_q": new_q,
-                        "unit": d["unit"],
-                        "threshold": d["threshold"],
-                        "supplier_id": d["supplier_id"]
-                    })
-            conn.commit()
-            conn.close()
-        except Exception as ex:
-            try:
-                conn.rollback()
-                conn.close()
-            except:
-                pass
-            messagebox.showerror("Error", f"Failed to record sale: {ex}")
+            sales_journal().append([(cat_id, qty_sold, selected_brand)], order_key)
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to record sale: {e}")
+            if win.winfo_exists():
+                confirm_btn.config(state="normal")
             return
+        price = unit_price(cat_price, selected_brand)
+        profit_msg = f"""Sale recorded successfully! 
 
-        # Calculate and record profit
-        # cat_id is already available from the parent scope
-        
-        # Get selling price from categories table
-        conn = get_connection()
-        if conn:
-            try:
-                cur = conn.cursor()
-                cur.execute("SELECT selling_price FROM categories WHERE id = %s", (cat_id,))
-                price_row = cur.fetchone()
-                selling_price = float(price_row[0]) if price_row else 0.0
-                conn.close()
-                
-                # Record sale with profit calculation
-                ok, profit_info = record_sale_with_profit(cat_id, qty_sold, selling_price)
-                
-                # Generate bill
-                customer_name = e_customer.get().strip()
-                customer_phone = e_phone.get().strip()
-                items = [(cat_name, qty_sold, selling_price)]
-                bill_text, total_amount = generate_bill_text(items, customer_name, customer_phone)
-                
-                if ok:
-                    profit_msg = f"""Sale recorded successfully! 
+• Units Sold: {qty_sold}
+• Selling Price: ₹{price} per unit
+
+📊 Cost and profit are worked out when the sale is saved to the database."""
+        show_sale_bill(qty_sold, price, selected_brand, customer_name, customer_phone, profit_msg)
+        flush_journal()
+
+    def sale_recorded(result, qty_sold, selected_brand, customer_name, customer_phone):
+        if result is None:
+            # Database unavailable: queue the sale if the mirror says the
+            # database would take it
+            problem = check_sale([(cat_id, qty_sold, selected_brand)])
+            if OFFLINE_MODE and not STRICT_STOCK and not problem:
+                show_offline(True)
+                journal_sale(qty_sold, selected_brand, customer_name, customer_phone)
+                return
+            result = (False, problem or "Database unavailable")
+        ok, sale_info = result
+        if not ok:
+            messagebox.showerror("Error", f"Failed to record sale: {sale_info}")
+            if win.winfo_exists():
+                confirm_btn.config(state="normal")
+            return
+
+        selling_price = sale_info['selling_price']
+        profit_msg = f"""Sale recorded successfully! 
 
 📊 PROFIT ANALYSIS:
 • Units Sold: {qty_sold}
 • Selling Price: ₹{selling_price} per unit
-• Material Cost: ₹{profit_info['material_cost']:.2f} per unit
-• Profit per Unit: ₹{profit_info['profit_per_unit']:.2f}
-• Total Profit: ₹{profit_info['total_profit']:.2f}
-• Profit Margin: {profit_info['profit_margin']:.1f}%"""
-                    
-                    # Show bill popup
-                    show_bill_popup(bill_text, customer_phone, f"{cat_name} sale", profit_msg)
-            except Exception as e:
-                messagebox.showinfo("✅ Success", f"Sale recorded successfully! Deducted materials for {qty_sold} units.")
+• Material Cost: ₹{sale_info['material_cost']:.2f} per unit
+• Profit per Unit: ₹{sale_info['profit_per_unit']:.2f}
+• Total Profit: ₹{sale_info['total_profit']:.2f}
+• Profit Margin: {sale_info['profit_margin']:.1f}%"""
+        show_sale_bill(qty_sold, selling_price, selected_brand, customer_name, customer_phone, profit_msg)
+        load_inventory()
+        update_stats()
+        notify_low_stock(sale_info['low_items'])
+
+    def show_sale_bill(qty_sold, selling_price, selected_brand, customer_name, customer_phone, profit_msg):
+        # Generate bill
+        if selected_brand:
+            items = [(f"{selected_brand} ({cat_name})", qty_sold, selling_price)]
+            sale_type = f"{selected_brand} sale"
         else:
-            messagebox.showinfo("✅ Success", f"Sale recorded successfully! Deducted materials for {qty_sold} units.")
+            items = [(cat_name, qty_sold, selling_price)]
+            sale_type = f"{cat_name} sale"
+        bill_text, total_amount = generate_bill_text(items, customer_name, customer_phone)
         
+        # Show bill and offer WhatsApp sending
+        show_bill_popup(bill_text, customer_phone, sale_type, profit_msg)
+        if win.winfo_exists():
+            win.destroy()
+
+    # Buttons frame
+    btn_frame = tk.Frame(form_frame, bg='white')
+    btn_frame.grid(row=current_row, column=0, columnspan=2, pady=10)
+    
+    ttk.Button(btn_frame, text="Cancel", command=win.destroy).pack(side="left", padx=(0,10))
+    confirm_btn = ttk.Button(btn_frame, text="🛒 Confirm Sale", command=process_sale, style='Warning.TButton')
+    confirm_btn.pack(side="left")
+    
+    e_qty.focus_set()
+
+# Sales in the local journal (journal.py) are written to the database in
+# the background: right after each sale, and on a timer while any are left
+# (e.g. the database was unreachable, or orders recovered at startup).
+# While offline, screens read the local mirror (mirror.py), refreshed every
+# MIRROR_REFRESH_MS while the database is reachable.
+JOURNAL_FLUSH_MS = 3000
+MIRROR_REFRESH_MS = 60000
+
+def flush_journal():
+    run_db(flush_sales_journal, on_done=journal_flushed)
+
+def journal_flushed(result):
+    if not result:
+        return  # another flush is running
+    ok, info = result
+    show_offline(not ok)
+    if not ok:
+        return
+    if info['written']:
         load_inventory()
         update_stats()
-        win.destroy()
+        notify_low_stock(info['low_items'])
+
+def refresh_mirror_periodically():
+    run_db(refresh_offline_mirror, on_done=lambda online: show_offline(not online))
+    root.after(MIRROR_REFRESH_MS, refresh_mirror_periodically)
+
+def flush_journal_periodically():
+    if len(sales_journal()):
+        flush_journal()
+    root.after(JOURNAL_FLUSH_MS, flush_journal_periodically)
 
-        # For each low item, notify associated supplier (auto-select) via popup (edit allowed)
+OFFLINE_SAVED_NOTE = "\n\n📴 Saved offline: it is written to the database once the connection is back."
+
+def queue_offline(movement, key, failed, on_queued, on_failed=None):
+    """
+    Offline fallback for a restock, waste or cooked batch the database did
+    not take: journal it (see queue_stock_movement) and call
+    on_queued(new quantity), or show failed (and why) and call on_failed().
+    """
+    def queued(result):
+        if result and result[0]:
+            show_offline(True)
+            on_queued(result[1])
+            return
+        messagebox.showerror("❌ Error", failed if result is None else f"{failed}\n\n{result[1]}")
+        if on_failed:
+            on_failed()
+    run_db(queue_stock_movement, movement, key, on_done=queued)
+
+def notify_low_stock(low_items):
+    """Open a supplier notification popup for every supplier of a material that fell below threshold"""
+    def find_suppliers():
+        # For each low item, notify associated supplier (auto-select) via popup (edit allowed),
+        # one popup per supplier
+        alerts = {}
         for li in low_items:
             supplier = None
             if li["supplier_id"]:
@@ -1531,17 +1975,390 @@ def sale_popup():
             if not supplier:
                 suppliers = fetch_suppliers(limit=3)
                 supplier = suppliers[0] if suppliers else None
+            alerts.setdefault(supplier[0] if supplier else None, (supplier, []))[1].append(li)
+        return list(alerts.values()), fetch_suppliers(limit=10)
 
-            show_supplier_notify_popup(li, supplier)
+    def show_alerts(result):
+        alerts, suppliers = result
+        for supplier, items in alerts:
+            show_supplier_notify_popup(items, supplier, suppliers)
 
+    if low_items:
+        run_db(find_suppliers, on_done=show_alerts)
+
+def cook_batch_popup():
+    """Cook a batch of an item ahead of time so counter sales only take from the prepared stock"""
+    def load():
+        return fetch_categories(), fetch_prepared_stock()
+    
+    run_db(load, on_done=cook_batch_window)
+
+def cook_batch_window(result):
+    categories, prepared = result
+    category_ids = {c[1]: c[0] for c in categories}
+    
+    win = tk.Toplevel(root)
+    win.title("🍳 Cook Batch")
+    win.geometry("560x560")
+    win.configure(bg='white')
+    win.transient(root)
+    win.grab_set()
+    
+    # Header
+    header = tk.Frame(win, bg=PRIMARY_COLOR, height=60)
+    header.pack(fill="x")
+    header.pack_propagate(False)
+    
+    tk.Label(header, text="🍳 Cook Batch", font=('Arial', 14, 'bold'), 
+             fg='white', bg=PRIMARY_COLOR).pack(pady=20)
+    
+    # Prepared stock frame
+    ready_frame = tk.LabelFrame(win, text="🍽️ Ready at the Counter", font=('Arial', 10, 'bold'), 
+                               fg=PRIMARY_COLOR, bg='white', bd=2, relief='groove')
+    ready_frame.pack(fill="both", expand=True, padx=20, pady=10)
+    
+    ready_cols = ("Item", "Ready", "Cost/Unit", "Last Cooked")
+    ready_tree = ttk.Treeview(ready_frame, columns=ready_cols, show="headings", height=6, style='Custom.Treeview')
+    for c in ready_cols:
+        ready_tree.heading(c, text=c)
+        ready_tree.column(c, anchor="center", width=115)
+    ready_tree.pack(fill="both", expand=True, padx=10, pady=10)
+    
+    def show_prepared(rows):
+        if not win.winfo_exists():
+            return
+        sync_tree(ready_tree, [(str(cat_id), (name, quantity, f"₹{unit_cost:.2f}", 
+                                              last_updated.strftime("%Y-%m-%d %H:%M") if last_updated else "—"), ())
+                               for cat_id, name, quantity, unit_cost, last_updated in rows])
+    
+    show_prepared(prepared)
+    
+    # Form frame
+    form_frame = tk.Frame(win, bg='white')
+    form_frame.pack(fill="x", padx=30, pady=10)
+    
+    tk.Label(form_frame, text="Item *", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=0, sticky="w", pady=(0,5))
+    category_combo = ttk.Combobox(form_frame, values=list(category_ids), state="readonly", 
+                                  width=33, font=('Arial', 10))
+    category_combo.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(0,10))
+    
+    tk.Label(form_frame, text="Units to Cook *", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=2, column=0, sticky="w", pady=(0,5))
+    e_units = tk.Entry(form_frame, width=35, font=('Arial', 10), relief='solid', bd=1)
+    e_units.grid(row=3, column=0, columnspan=2, sticky="ew", pady=(0,10))
+    
+    tk.Label(form_frame, text="Notes", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=4, column=0, sticky="w", pady=(0,5))
+    e_notes = tk.Entry(form_frame, width=35, font=('Arial', 10), relief='solid', bd=1)
+    e_notes.grid(row=5, column=0, columnspan=2, sticky="ew", pady=(0,10))
+    
+    form_frame.columnconfigure(0, weight=1)
+    
+    def cook():
+        category_name = category_combo.get()
+        if category_name not in category_ids:
+            messagebox.showerror("❌ Error", "Please select an item to cook!")
+            return
+        try:
+            units = int(e_units.get())
+            if units <= 0:
+                raise ValueError()
+        except ValueError:
+            messagebox.showerror("❌ Error", "Please enter a valid positive number of units!")
+            return
+        
+        key = uuid.uuid4().hex
+        notes = e_notes.get().strip() or None
+        
+        def cooked(result):
+            if result is None:
+                # Database unavailable: queue the batch if the mirror says it can be cooked
+                queue_offline({"kind": "cook", "category_id": category_ids[category_name], "units": units,
+                               "notes": notes}, key, "Failed to cook the batch. Please try again.",
+                              cooked_offline, on_failed=enable_cook)
+                return
+            ok, info = result
+            enable_cook()
+            if ok:
+                messagebox.showinfo("✅ Batch Cooked", f"Cooked {units} x {category_name} (₹{info['unit_cost']:.2f} each).\n"
+                                                      f"Ready at the counter: {info['prepared_quantity']}")
+                batch_done(info['low_items'])
+            else:
+                messagebox.showerror("❌ Error", info)
+        
+        def enable_cook():
+            if win.winfo_exists():
+                cook_btn.config(state="normal")
+        
+        def cooked_offline(prepared_quantity):
+            enable_cook()
+            messagebox.showinfo("✅ Batch Cooked", f"Cooked {units} x {category_name}.\n"
+                                                  f"Ready at the counter: {prepared_quantity}" + OFFLINE_SAVED_NOTE)
+            batch_done([])
+        
+        def batch_done(low_items):
+            load_inventory()
+            update_stats()
+            if win.winfo_exists():
+                e_units.delete(0, tk.END)
+                run_db(fetch_prepared_stock, on_done=show_prepared, latest=ready_tree)
+            notify_low_stock(low_items)
+        
+        cook_btn.config(state="disabled")
+        run_db(cook_batch, category_ids[category_name], units, notes, op_key=key, on_done=cooked)
+    
     # Buttons frame
     btn_frame = tk.Frame(form_frame, bg='white')
-    btn_frame.grid(row=current_row, column=0, columnspan=2, pady=10)
+    btn_frame.grid(row=6, column=0, columnspan=2, pady=10)
+    
+    ttk.Button(btn_frame, text="Close", command=win.destroy).pack(side="left", padx=(0,10))
+    cook_btn = ttk.Button(btn_frame, text="🍳 Cook Batch", command=cook, style='Success.TButton')
+    cook_btn.pack(side="left")
+    
+    category_combo.focus_set()
+
+def order_popup():
+    """Multi-item order: build a cart, then check everything out in one transaction and one bill"""
+    run_db(fetch_categories, on_done=order_window)
+
+def order_window(categories):
+    if not categories:
+        messagebox.showerror("❌ Error", "No categories available. Please add categories first!")
+        return
+    
+    win = tk.Toplevel(root)
+    win.title("🛒 New Order")
+    win.geometry("650x680")
+    win.configure(bg='white')
+    win.resizable(True, True)
+    win.transient(root)
+    win.grab_set()
+    
+    # Header
+    header = tk.Frame(win, bg=WARNING_COLOR, height=60)
+    header.pack(fill="x")
+    header.pack_propagate(False)
+    
+    tk.Label(header, text="🛒 New Order (Multiple Items)", font=('Arial', 14, 'bold'), 
+             fg='white', bg=WARNING_COLOR).pack(pady=20)
+    
+    # Item entry frame
+    item_frame = tk.LabelFrame(win, text="➕ Add Item", font=('Arial', 10, 'bold'), 
+                              fg=PRIMARY_COLOR, bg='white', bd=2, relief='groove')
+    item_frame.pack(fill="x", padx=20, pady=10)
+    
+    # c = (id, name, description, selling_price)
+    category_options = [f"{c[1]} - ₹{c[3]}" for c in categories]
+    category_map = {opt: c for opt, c in zip(category_options, categories)}
+    
+    tk.Label(item_frame, text="Item *", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=0, sticky="w", padx=10, pady=(10,5))
+    category_combo = ttk.Combobox(item_frame, values=category_options, state="readonly", 
+                                  width=28, font=('Arial', 10))
+    category_combo.grid(row=1, column=0, sticky="ew", padx=10, pady=(0,10))
+    
+    tk.Label(item_frame, text="Brand (Cold Drinks)", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=1, sticky="w", padx=10, pady=(10,5))
+    brand_combo = ttk.Combobox(item_frame, values=[], state="disabled", width=24, font=('Arial', 10))
+    brand_combo.grid(row=1, column=1, sticky="ew", padx=10, pady=(0,10))
+    
+    tk.Label(item_frame, text="Qty *", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=2, sticky="w", padx=10, pady=(10,5))
+    e_qty = tk.Entry(item_frame, width=6, font=('Arial', 10), relief='solid', bd=1)
+    e_qty.grid(row=1, column=2, sticky="ew", padx=10, pady=(0,10))
+    e_qty.insert(0, "1")
+    
+    item_frame.columnconfigure(0, weight=1)
+    
+    def on_category_selected(event=None):
+        cat = category_map.get(category_combo.get())
+        if cat and cat[1].lower() == "cold drinks":
+            brand_combo.config(state="readonly")
+            run_db(get_cold_drink_brand_options, on_done=lambda options: brand_combo.config(values=options))
+        else:
+            brand_combo.set("")
+            brand_combo.config(state="disabled")
+    
+    category_combo.bind("<<ComboboxSelected>>", on_category_selected)
+    
+    # Cart table
+    cart_frame = tk.Frame(win, bg='white')
+    cart_frame.pack(fill="both", expand=True, padx=20, pady=(0,10))
+    
+    cart_cols = ("Item", "Qty", "Price (₹)", "Amount (₹)")
+    cart_tree = ttk.Treeview(cart_frame, columns=cart_cols, show="headings", height=8, style='Custom.Treeview')
+    for c in cart_cols:
+        cart_tree.heading(c, text=c)
+        cart_tree.column(c, anchor="w" if c == "Item" else "center", width=240 if c == "Item" else 100)
+    
+    cart_scroll = ttk.Scrollbar(cart_frame, orient="vertical", command=cart_tree.yview)
+    cart_tree.configure(yscrollcommand=cart_scroll.set)
+    cart_tree.pack(side="left", fill="both", expand=True)
+    cart_scroll.pack(side="right", fill="y")
+    
+    total_label = tk.Label(win, text="💰 Total: ₹0.00", font=('Arial', 12, 'bold'), 
+                           fg=SUCCESS_COLOR, bg='white')
+    total_label.pack(anchor="e", padx=20)
+    
+    # cart: (category_id, brand) -> [item name, qty, price in paise]
+    cart = {}
+    
+    def refresh_cart():
+        for i in cart_tree.get_children():
+            cart_tree.delete(i)
+        total = 0
+        for key, (item_name, qty, price) in cart.items():
+            total += line_total(price, qty)
+            cart_tree.insert("", "end", iid=f"{key[0]}|{key[1] or ''}",
+                             values=(item_name, qty, f"₹{rupees(price)}", f"₹{rupees(line_total(price, qty))}"))
+        total_label.config(text=f"💰 Total: ₹{rupees(total)}")
+    
+    def add_item():
+        cat = category_map.get(category_combo.get())
+        if not cat:
+            messagebox.showerror("❌ Error", "Please select an item!")
+            return
+        try:
+            qty = int(e_qty.get())
+            if qty <= 0:
+                raise ValueError()
+        except ValueError:
+            messagebox.showerror("❌ Error", "Enter a valid positive whole quantity!")
+            return
+        cat_id, cat_name, _desc, price = cat
+        brand = None
+        if cat_name.lower() == "cold drinks":
+            if not brand_combo.get():
+                messagebox.showerror("❌ Error", "Please select a brand!")
+                return
+            if "Out of Stock" in brand_combo.get():
+                messagebox.showerror("❌ Error", f"{parse_brand_option(brand_combo.get())} is out of stock!")
+                return
+            brand = parse_brand_option(brand_combo.get())
+        key = (cat_id, brand)
+        if key in cart:
+            cart[key][1] += qty
+        else:
+            cart[key] = [f"{brand} ({cat_name})" if brand else cat_name, qty, to_paise(unit_price(price, brand))]
+        refresh_cart()
+        e_qty.delete(0, tk.END)
+        e_qty.insert(0, "1")
+    
+    def remove_selected():
+        for iid in cart_tree.selection():
+            cat_id, brand = iid.split("|", 1)
+            cart.pop((int(cat_id), brand or None), None)
+        refresh_cart()
+    
+    item_btns = tk.Frame(item_frame, bg='white')
+    item_btns.grid(row=2, column=0, columnspan=3, sticky="w", padx=10, pady=(0,10))
+    ttk.Button(item_btns, text="➕ Add to Order", command=add_item, 
+               style='Success.TButton').pack(side="left", padx=(0,10))
+    ttk.Button(item_btns, text="🗑️ Remove Selected", command=remove_selected, 
+               style='Danger.TButton').pack(side="left")
+    
+    # Customer details
+    customer_frame = tk.Frame(win, bg='white')
+    customer_frame.pack(fill="x", padx=20, pady=5)
+    
+    tk.Label(customer_frame, text="Customer Name (optional)", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=0, sticky="w", pady=(0,5))
+    e_customer = tk.Entry(customer_frame, width=30, font=('Arial', 10), relief='solid', bd=1)
+    e_customer.grid(row=1, column=0, sticky="ew", padx=(0,10))
+    
+    tk.Label(customer_frame, text="Customer Phone (optional)", font=('Arial', 10, 'bold'), 
+             fg=DARK_TEXT, bg='white').grid(row=0, column=1, sticky="w", pady=(0,5))
+    e_phone = tk.Entry(customer_frame, width=30, font=('Arial', 10), relief='solid', bd=1)
+    e_phone.grid(row=1, column=1, sticky="ew")
+    
+    customer_frame.columnconfigure(0, weight=1)
+    customer_frame.columnconfigure(1, weight=1)
+
+    # One key per cart: checking out the same cart again after an error or
+    # timeout returns the order already recorded instead of recording it twice
+    order_keys = {}
+
+    def order_key(lines):
+        return order_keys.setdefault(tuple(lines), uuid.uuid4().hex)
+
+    def checkout():
+        if not cart:
+            messagebox.showerror("❌ Error", "Add at least one item to the order!")
+            return
+        lines = [(cat_id, qty, brand) for (cat_id, brand), (_name, qty, _price) in cart.items()]
+        checkout_btn.config(state="disabled")
+        customer = (e_customer.get().strip(), e_phone.get().strip())
+        run_db(checkout_order, lines, order_key=order_key(lines), on_done=lambda result: order_recorded(result, lines, *customer))
+
+    def order_recorded(result, lines, customer_name, customer_phone):
+        if result is None:
+            # Database unavailable: queue the order if the mirror says the
+            # database would take it
+            problem = check_sale(lines)
+            if OFFLINE_MODE and not STRICT_STOCK and not problem:
+                order_journaled(lines, customer_name, customer_phone)
+                return
+            result = (False, problem or "Database unavailable")
+        ok, order = result
+        if not ok:
+            messagebox.showerror("Error", f"Failed to record order: {order}")
+            if win.winfo_exists():
+                checkout_btn.config(state="normal")
+            return
+        
+        profit_lines = "\n".join(
+            f"• {l['item_name']}: {l['quantity']} x ₹{l['profit_per_unit']:.2f} = ₹{l['total_profit']:.2f}"
+            for l in order['lines'])
+        margin = (order['total_profit'] / order['total_revenue'] * 100) if order['total_revenue'] > 0 else 0
+        profit_msg = f"""Order recorded successfully! 
+
+📊 PROFIT ANALYSIS:
+{profit_lines}
+• Total Revenue: ₹{order['total_revenue']:.2f}
+• Material Cost: ₹{order['total_cost']:.2f}
+• Total Profit: ₹{order['total_profit']:.2f}
+• Profit Margin: {margin:.1f}%"""
+        
+        bill_text, total_amount = generate_bill_text(order['bill_items'], customer_name, customer_phone)
+        show_bill_popup(bill_text, customer_phone, f"Order of {len(lines)} items", profit_msg)
+        
+        load_inventory()
+        update_stats()
+        if win.winfo_exists():
+            win.destroy()
+        notify_low_stock(order['low_items'])
+    
+    def order_journaled(lines, customer_name, customer_phone):
+        # Offline: keep the order in the local journal; it is written when
+        # the database is back
+        try:
+            sales_journal().append(lines, order_key(lines))
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to record order: {e}")
+            if win.winfo_exists():
+                checkout_btn.config(state="normal")
+            return
+        show_offline(True)
+        bill_items = [(name, qty, rupees(price)) for name, qty, price in cart.values()]
+        bill_text, total_amount = generate_bill_text(bill_items, customer_name, customer_phone)
+        show_bill_popup(bill_text, customer_phone, f"Order of {len(lines)} items",
+                        "Order recorded offline! \n\n📴 It is saved to the database, with its cost and profit, once the connection is back.")
+        load_inventory()
+        update_stats()
+        if win.winfo_exists():
+            win.destroy()
+
+    # Buttons frame
+    btn_frame = tk.Frame(win, bg='white')
+    btn_frame.pack(fill="x", padx=20, pady=15)
     
     ttk.Button(btn_frame, text="Cancel", command=win.destroy).pack(side="left", padx=(0,10))
-    ttk.Button(btn_frame, text="🛒 Confirm Sale", command=process_sale, style='Warning.TButton').pack(side="left")
+    checkout_btn = ttk.Button(btn_frame, text="✅ Checkout & Generate Bill", command=checkout, 
+                              style='Warning.TButton')
+    checkout_btn.pack(side="right")
     
-    e_qty.focus_set()
+    category_combo.focus_set()
 
 def show_bill_popup(bill_text, customer_phone="", sale_type="", profit_msg=""):
     """Show bill popup with e-bill option"""
@@ -1621,24 +2438,30 @@ def show_bill_popup(bill_text, customer_phone="", sale_type="", profit_msg=""):
             whatsapp_msg = f"🧾 *Your Bill from Canteen*\n\n{bill_text}\n\nThank you for your purchase! 😊"
             
             if TWILIO_ENABLED:
-                success, result = send_whatsapp_twilio(phone, whatsapp_msg)
-                if success:
-                    messagebox.showinfo("✅ E-Bill Sent!", 
-                                      f"E-Bill sent successfully via WhatsApp!\n\n"
-                                      f"📞 To: {phone}\n"
-                                      f"📧 Message ID: {result}")
-                else:
-                    messagebox.showerror("❌ Send Failed", f"Failed to send E-Bill via Twilio:\n{result}")
+                def sent(res):
+                    success, result = res
+                    if success:
+                        messagebox.showinfo("✅ E-Bill Sent!", 
+                                          f"E-Bill sent successfully via WhatsApp!\n\n"
+                                          f"📞 To: {phone}\n"
+                                          f"📧 Message ID: {result}")
+                    else:
+                        messagebox.showerror("❌ Send Failed", f"Failed to send E-Bill via Twilio:\n{result}")
+                
+                run_db(send_whatsapp_twilio, phone, whatsapp_msg, on_done=sent)
             else:
                 # Open WhatsApp Web as fallback
-                success, url = open_whatsapp_web(phone, whatsapp_msg)
-                if success:
-                    messagebox.showinfo("📱 WhatsApp Opened", 
-                                      f"WhatsApp Web opened with E-Bill!\n\n"
-                                      f"📞 To: {phone}\n\n"
-                                      f"Please click 'Send' in WhatsApp to deliver the E-Bill.")
-                else:
-                    messagebox.showerror("❌ Error", "Failed to open WhatsApp Web")
+                def opened(res):
+                    success, url = res
+                    if success:
+                        messagebox.showinfo("📱 WhatsApp Opened", 
+                                          f"WhatsApp Web opened with E-Bill!\n\n"
+                                          f"📞 To: {phone}\n\n"
+                                          f"Please click 'Send' in WhatsApp to deliver the E-Bill.")
+                    else:
+                        messagebox.showerror("❌ Error", "Failed to open WhatsApp Web")
+                
+                run_db(open_whatsapp_web, phone, whatsapp_msg, on_done=opened)
         except Exception as e:
             messagebox.showerror("❌ Error", f"Failed to send E-Bill: {e}")
     
@@ -1996,7 +2819,7 @@ def show_production_prediction():
     """Show tomorrow's production prediction popup"""
     win = tk.Toplevel(root)
     win.title("📊 Tomorrow's Production Prediction")
-    win.geometry("800x600")
+    win.geometry("900x600")
     win.configure(bg='white')
     win.resizable(True, True)
     win.transient(root)
@@ -2014,7 +2837,7 @@ def show_production_prediction():
     main_frame.pack(fill="both", expand=True, padx=20, pady=20)
     
     # Instructions
-    tk.Label(main_frame, text="📈 Based on current inventory levels and material requirements:", 
+    tk.Label(main_frame, text="📈 Based on current inventory levels, material requirements and past sales:", 
              font=('Arial', 12), fg=DARK_TEXT, bg='white').pack(anchor="w", pady=(0,15))
     
     # Prediction table
@@ -2022,17 +2845,21 @@ def show_production_prediction():
     pred_frame.pack(fill="both", expand=True)
     
     # Table headers
-    pred_cols = ("Category", "Max Units", "Limiting Factor")
+    pred_cols = ("Category", "Max Units", "Expected Demand", "Plan", "Limiting Factor")
     pred_tree = ttk.Treeview(pred_frame, columns=pred_cols, show="headings", height=15, style='Custom.Treeview')
     
     # Configure columns
     pred_tree.heading("Category", text="📋 Category")
     pred_tree.heading("Max Units", text="🔢 Max Units Tomorrow")
+    pred_tree.heading("Expected Demand", text="📈 Expected Demand")
+    pred_tree.heading("Plan", text="🧮 Best Plan")
     pred_tree.heading("Limiting Factor", text="⚠️ Limiting Factor")
     
-    pred_tree.column("Category", width=200, anchor="w")
-    pred_tree.column("Max Units", width=150, anchor="center")
-    pred_tree.column("Limiting Factor", width=400, anchor="w")
+    pred_tree.column("Category", width=180, anchor="w")
+    pred_tree.column("Max Units", width=140, anchor="center")
+    pred_tree.column("Expected Demand", width=130, anchor="center")
+    pred_tree.column("Plan", width=110, anchor="center")
+    pred_tree.column("Limiting Factor", width=300, anchor="w")
     
     # Add scrollbars
     pred_v_scroll = ttk.Scrollbar(pred_frame, orient="vertical", command=pred_tree.yview)
@@ -2043,64 +2870,84 @@ def show_production_prediction():
     pred_v_scroll.pack(side="right", fill="y")
     pred_h_scroll.pack(side="bottom", fill="x")
     
-    # Load predictions
-    predictions = predict_tomorrow_production()
-    
-    total_possible = 0
-    for category_name, max_units, limiting_factor in predictions:
-        if max_units > 0:
-            total_possible += max_units
-            tag = "can_produce"
-        else:
-            tag = "cannot_produce"
-        
-        pred_tree.insert("", "end", values=(category_name, max_units, limiting_factor), tags=(tag,))
-    
     # Configure tags for color coding
     pred_tree.tag_configure("can_produce", background="#e8f5e8")
     pred_tree.tag_configure("cannot_produce", background="#ffe8e8")
+    pred_tree.tag_configure("short_supply", background="#fff4e0")
     
     # Summary
     summary_frame = tk.Frame(main_frame, bg='white')
     summary_frame.pack(fill="x", pady=(20,0))
     
-    tk.Label(summary_frame, text=f"📊 Summary: {len([p for p in predictions if p[1] > 0])} categories can be produced tomorrow", 
-             font=('Arial', 12, 'bold'), fg=SUCCESS_COLOR, bg='white').pack(anchor="w")
-    
-    tk.Label(summary_frame, text=f"🔢 Total possible units across all categories: {total_possible}", 
-             font=('Arial', 11), fg=DARK_TEXT, bg='white').pack(anchor="w", pady=(5,0))
-    
     # Buttons - with more spacing to make them prominent
     btn_frame = tk.Frame(main_frame, bg='white')
     btn_frame.pack(fill="x", pady=(30,20))
     
-    def refresh_predictions():
+    def show_predictions(result):
+        predictions, plan = result
+        planned = {line[0]: line[1] for line in plan["lines"]} if plan else {}
+        
         # Clear existing items
         for item in pred_tree.get_children():
             pred_tree.delete(item)
         
-        # Reload predictions
-        new_predictions = predict_tomorrow_production()
-        new_total = 0
-        
-        for category_name, max_units, limiting_factor in new_predictions:
+        total_possible = 0
+        total_expected = 0
+        short_supply = 0
+        for category_name, max_units, expected, limiting_factor in predictions:
             if max_units > 0:
-                new_total += max_units
+                total_possible += max_units
                 tag = "can_produce"
             else:
                 tag = "cannot_produce"
+            if expected is None:
+                expected_text = "—"
+            else:
+                expected = round(expected)
+                total_expected += expected
+                expected_text = expected
+                # Stock will run out before demand is met
+                if expected > max_units:
+                    short_supply += 1
+                    if max_units > 0:
+                        tag = "short_supply"
             
-            pred_tree.insert("", "end", values=(category_name, max_units, limiting_factor), tags=(tag,))
+            pred_tree.insert("", "end", values=(category_name, max_units, expected_text, 
+                                                planned.get(category_name, "—"), limiting_factor), tags=(tag,))
         
         # Update summary
         for widget in summary_frame.winfo_children():
             widget.destroy()
         
-        tk.Label(summary_frame, text=f"📊 Summary: {len([p for p in new_predictions if p[1] > 0])} categories can be produced tomorrow", 
+        tk.Label(summary_frame, text=f"📊 Summary: {len([p for p in predictions if p[1] > 0])} categories can be produced tomorrow", 
                  font=('Arial', 12, 'bold'), fg=SUCCESS_COLOR, bg='white').pack(anchor="w")
         
-        tk.Label(summary_frame, text=f"🔢 Total possible units across all categories: {new_total}", 
+        tk.Label(summary_frame, text=f"🔢 Total possible units across all categories: {total_possible}", 
                  font=('Arial', 11), fg=DARK_TEXT, bg='white').pack(anchor="w", pady=(5,0))
+        
+        if any(p[2] is not None for p in predictions):
+            tk.Label(summary_frame, text=f"📈 Expected demand tomorrow: {total_expected} units"
+                                         f" • {short_supply} categories short of stock", 
+                     font=('Arial', 11), fg=WARNING_COLOR if short_supply else DARK_TEXT, bg='white').pack(anchor="w", pady=(5,0))
+        else:
+            tk.Label(summary_frame, text="📈 Expected demand needs at least two weeks of sales history", 
+                     font=('Arial', 11), fg=DARK_TEXT, bg='white').pack(anchor="w", pady=(5,0))
+        
+        if plan:
+            plan_units = sum(line[1] for line in plan["lines"])
+            plan_text = (f"🧮 Best plan (ingredients shared): {plan_units} units • Profit ₹{plan['total_profit']:.2f}")
+            if not plan["optimal"]:
+                plan_text += f" (best found, at most ₹{plan['lp_bound']:.2f} possible)"
+            if plan["capped"]:
+                plan_text += " • capped at expected demand"
+            tk.Label(summary_frame, text=plan_text, 
+                     font=('Arial', 11, 'bold'), fg=PRIMARY_COLOR, bg='white').pack(anchor="w", pady=(5,0))
+    
+    def load_predictions():
+        return predict_tomorrow_production(), plan_tomorrow_production()
+    
+    def refresh_predictions():
+        run_db(load_predictions, on_done=show_predictions)
     
     # Make buttons MUCH bigger and more visible
     refresh_btn = tk.Button(btn_frame, text="🔄 REFRESH PREDICTIONS", 
@@ -2114,21 +2961,112 @@ def show_production_prediction():
                          relief='raised', bd=3, padx=40, pady=20, cursor='hand2',
                          width=15, height=2, command=win.destroy)
     close_btn.pack(side="right", padx=20, pady=10)
+    
+    refresh_predictions()
+
+def show_shopping_list():
+    """Show what to buy for tomorrow's expected demand, grouped by supplier"""
+    def find_suppliers():
+        groups = get_shopping_list()
+        shopping = [(get_supplier_by_id(supplier_id) if supplier_id else None, items)
+                    for supplier_id, items in groups]
+        return shopping, fetch_suppliers(limit=10)
+    
+    run_db(find_suppliers, on_done=shopping_list_window)
+
+def shopping_list_window(result):
+    shopping, suppliers = result
+    win = tk.Toplevel(root)
+    win.title("🛒 Shopping List")
+    win.geometry("800x550")
+    win.configure(bg='white')
+    win.transient(root)
+    
+    # Header
+    header = tk.Frame(win, bg=PRIMARY_COLOR, height=60)
+    header.pack(fill="x")
+    header.pack_propagate(False)
+    
+    tk.Label(header, text="🛒 Shopping List for Tomorrow", font=('Arial', 14, 'bold'), 
+             fg='white', bg=PRIMARY_COLOR).pack(pady=20)
+    
+    main_frame = tk.Frame(win, bg='white')
+    main_frame.pack(fill="both", expand=True, padx=20, pady=20)
+    
+    tk.Label(main_frame, text="📈 Expected demand through the recipes, keeping every material above its threshold:", 
+             font=('Arial', 11), fg=DARK_TEXT, bg='white').pack(anchor="w", pady=(0,10))
+    
+    list_frame = tk.Frame(main_frame, bg='white')
+    list_frame.pack(fill="both", expand=True)
+    
+    list_cols = ("Needed", "In Stock", "Threshold", "To Order")
+    list_tree = ttk.Treeview(list_frame, columns=list_cols, show="tree headings", height=14, style='Custom.Treeview')
+    list_tree.heading("#0", text="👤 Supplier / 📦 Material")
+    list_tree.column("#0", width=260, anchor="w")
+    for c in list_cols:
+        list_tree.heading(c, text=c)
+        list_tree.column(c, width=120, anchor="center")
+    list_tree.tag_configure("supplier", background=LIGHT_BG, font=('Arial', 10, 'bold'))
+    
+    list_scroll = ttk.Scrollbar(list_frame, orient="vertical", command=list_tree.yview)
+    list_tree.configure(yscrollcommand=list_scroll.set)
+    list_tree.pack(side="left", fill="both", expand=True)
+    list_scroll.pack(side="right", fill="y")
+    
+    for pos, (supplier, items) in enumerate(shopping):
+        supplier_name = f"👤 {supplier[1]}" if supplier else "❓ No supplier assigned"
+        parent = list_tree.insert("", "end", iid=f"supplier-{pos}", text=f"{supplier_name} ({len(items)} items)", 
+                                  open=True, tags=("supplier",))
+        for item in items:
+            unit = item['unit']
+            list_tree.insert(parent, "end", text=f"📦 {item['name']}", values=(
+                f"{item['required']} {unit}", f"{item['new_q']} {unit}", 
+                f"{item['threshold']} {unit}", f"{item['order_qty']} {unit}"))
+    
+    if shopping:
+        summary = f"🛒 {sum(len(items) for _, items in shopping)} materials to order from {len(shopping)} suppliers"
+        color = WARNING_COLOR
+    else:
+        summary = "✅ Current stock covers tomorrow's expected demand"
+        color = SUCCESS_COLOR
+    tk.Label(main_frame, text=summary, font=('Arial', 11, 'bold'), fg=color, bg='white').pack(anchor="w", pady=(10,0))
+    
+    def notify_selected():
+        sel = list_tree.selection()
+        if not sel:
+            messagebox.showwarning("⚠️ Warning", "Please select a supplier or material!")
+            return
+        iid = list_tree.parent(sel[0]) or sel[0]
+        supplier, items = shopping[int(iid.split("-")[1])]
+        show_supplier_notify_popup(items, supplier, suppliers)
+    
+    btn_frame = tk.Frame(main_frame, bg='white')
+    btn_frame.pack(fill="x", pady=(10,0))
+    ttk.Button(btn_frame, text="📱 Notify Supplier", command=notify_selected, 
+               style='Success.TButton').pack(side="left")
+    ttk.Button(btn_frame, text="Close", command=win.destroy).pack(side="right")
 
-def show_supplier_notify_popup(low_item, supplier):
+def show_supplier_notify_popup(low_items, supplier, suppliers):
     """
-    low_item: dict with keys material_id, name, new_q, unit, threshold, supplier_id
+    low_items: dicts with keys material_id, name, new_q, unit, threshold, supplier_id,
+               plus required and order_qty for shopping list items (see get_shopping_list)
     supplier: tuple (id, name, whatsapp, phone, notes) or None
+    suppliers: the supplier rows to choose from
     """
-    # Check if a popup is already open for this material
+    names = ", ".join(item['name'] for item in low_items)
+    planned = any('order_qty' in item for item in low_items)
+    alert_title = "🛒 Supply Request" if planned else "⚠️ Low Stock Alert"
+    
+    # Check if a popup is already open for these materials
     for child in root.winfo_children():
-        if isinstance(child, tk.Toplevel) and low_item['name'] in child.title():
+        if isinstance(child, tk.Toplevel) and names in child.title():
             child.lift()  # Bring existing popup to front
             return
     
     win = tk.Toplevel(root)
-    win.title(f"⚠️ Low Stock Alert - {low_item['name']}")
-    win.geometry("700x650")  # Made larger to accommodate buttons
+    win.title(f"{alert_title} - {names}")
+    # Made larger to accommodate buttons, plus a line per extra material
+    win.geometry(f"700x{min(650 + 25 * (len(low_items) - 1), 900)}")
     win.configure(bg='white')
     win.resizable(True, True)  # Allow resizing to see content
     win.transient(root)
@@ -2139,28 +3077,37 @@ def show_supplier_notify_popup(low_item, supplier):
     header.pack(fill="x")
     header.pack_propagate(False)
     
-    tk.Label(header, text=f"⚠️ Low Stock Alert", font=('Arial', 16, 'bold'), 
+    tk.Label(header, text=alert_title, font=('Arial', 16, 'bold'), 
              fg='white', bg=DANGER_COLOR).pack(pady=10)
-    tk.Label(header, text=f"Material: {low_item['name']}", font=('Arial', 12), 
-             fg='white', bg=DANGER_COLOR).pack()
+    tk.Label(header, text=f"Material: {names}", font=('Arial', 12), 
+             fg='white', bg=DANGER_COLOR, wraplength=650).pack()
     
     # Alert info frame
     info_frame = tk.LabelFrame(win, text="📊 Stock Information", font=('Arial', 10, 'bold'), 
                               fg=DANGER_COLOR, bg='white', bd=2, relief='groove')
     info_frame.pack(fill="x", padx=20, pady=10)
     
-    tk.Label(info_frame, text=f"Current Stock: {low_item['new_q']} {low_item['unit']}", 
-             font=('Arial', 10), fg=DANGER_COLOR, bg='white').pack(anchor="w", padx=10, pady=5)
-    tk.Label(info_frame, text=f"Threshold Level: {low_item['threshold']} {low_item['unit']}", 
-             font=('Arial', 10), fg=DARK_TEXT, bg='white').pack(anchor="w", padx=10, pady=5)
+    if len(low_items) == 1 and not planned:
+        low_item = low_items[0]
+        tk.Label(info_frame, text=f"Current Stock: {low_item['new_q']} {low_item['unit']}", 
+                 font=('Arial', 10), fg=DANGER_COLOR, bg='white').pack(anchor="w", padx=10, pady=5)
+        tk.Label(info_frame, text=f"Threshold Level: {low_item['threshold']} {low_item['unit']}", 
+                 font=('Arial', 10), fg=DARK_TEXT, bg='white').pack(anchor="w", padx=10, pady=5)
+    else:
+        for item in low_items:
+            line = (f"{item['name']}: {item['new_q']} {item['unit']} in stock • "
+                    f"threshold {item['threshold']} {item['unit']}")
+            if 'required' in item:
+                line += f" • needed {item['required']} {item['unit']}"
+            below = float(item['new_q']) <= float(item['threshold'])
+            tk.Label(info_frame, text=line, font=('Arial', 10), 
+                     fg=DANGER_COLOR if below else DARK_TEXT, bg='white').pack(anchor="w", padx=10, pady=2)
 
     # Supplier selection frame
     supplier_frame = tk.LabelFrame(win, text="👤 Supplier Selection", font=('Arial', 10, 'bold'), 
                                   fg=PRIMARY_COLOR, bg='white', bd=2, relief='groove')
     supplier_frame.pack(fill="x", padx=20, pady=10)
     
-    suppliers = fetch_suppliers(limit=10)  # Increased limit
-    
     if suppliers:
         tk.Label(supplier_frame, text="Select Supplier:", font=('Arial', 10, 'bold'), 
                 fg=DARK_TEXT, bg='white').pack(anchor="w", padx=10, pady=(10,5))
@@ -2246,14 +3193,17 @@ def show_supplier_notify_popup(low_item, supplier):
         name = e_name.get().strip()
         whatsapp = e_wh.get().strip()
         phone = e_phone.get().strip()
-        ok, err = update_supplier(sid, name, whatsapp, phone)
-        if ok:
-            messagebox.showinfo("✅ Success", "Supplier details updated successfully!")
-            load_inventory()
-            update_stats()
-            win.destroy()
-        else:
-            messagebox.showerror("❌ Error", err)
+        def saved(result):
+            ok, err = result
+            if ok:
+                messagebox.showinfo("✅ Success", "Supplier details updated successfully!")
+                load_inventory()
+                update_stats()
+                win.destroy()
+            else:
+                messagebox.showerror("❌ Error", err)
+        
+        run_db(update_supplier, sid, name, whatsapp, phone, on_done=saved)
 
     def send_message_to_selected():
         if not suppliers:
@@ -2279,32 +3229,40 @@ def show_supplier_notify_popup(low_item, supplier):
         sup_whatsapp_edit = e_wh.get().strip() or sup_whatsapp
         sup_phone_edit = e_phone.get().strip() or sup_phone
 
-        # Build order message
-        threshold = float(low_item['threshold'])
-        new_q = float(low_item['new_q'])
-        suggested = max((threshold * 2) - new_q, threshold)
-        suggested = round(suggested, 2)
-        message = f"Hello {sup_name_edit},\n\n🚨 URGENT SUPPLY REQUEST 🚨\n\nWe require immediate supply for:\n📦 {low_item['name']}: {suggested} {low_item['unit']}\n📊 Current stock: {low_item['new_q']} {low_item['unit']}\n⚠️ Below threshold level\n\nPlease arrange delivery ASAP.\n\nThanks,\nCanteen Management"
+        # Build order message; shopping list items carry their planned quantity
+        item_lines = []
+        for item in low_items:
+            if 'order_qty' in item:
+                suggested = item['order_qty']
+            else:
+                threshold = float(item['threshold'])
+                new_q = float(item['new_q'])
+                suggested = max((threshold * 2) - new_q, threshold)
+                suggested = round(suggested, 2)
+            item_lines.append(f"📦 {item['name']}: {suggested} {item['unit']}\n📊 Current stock: {item['new_q']} {item['unit']}")
+        reason = "📈 Needed for tomorrow's expected demand" if planned else "⚠️ Below threshold level"
+        message = f"Hello {sup_name_edit},\n\n🚨 URGENT SUPPLY REQUEST 🚨\n\nWe require immediate supply for:\n" + "\n".join(item_lines) + f"\n{reason}\n\nPlease arrange delivery ASAP.\n\nThanks,\nCanteen Management"
 
         # If the user edited supplier details but didn't update DB, we still use edited number to send.
-        if TWILIO_ENABLED:
-            ok, info = send_whatsapp_twilio(sup_whatsapp_edit, message, supplier_id=sup_id)
+        def finished(result=None):
+            if win.winfo_exists():
+                win.destroy()
+            load_inventory()
+            update_stats()
+
+        def sent(result):
+            ok, info = result
             if ok:
                 messagebox.showinfo("✅ Message Sent", f"WhatsApp message sent successfully via Twilio!\nMessage ID: {info}")
-                win.destroy()
-                load_inventory()
-                update_stats()
+                finished()
             else:
                 messagebox.showwarning("⚠️ Twilio Failed", f"Twilio failed: {info}\nOpening WhatsApp Web as fallback...")
-                open_whatsapp_web(sup_whatsapp_edit, message, supplier_id=sup_id)
-                win.destroy()
-                load_inventory()
-                update_stats()
+                run_db(open_whatsapp_web, sup_whatsapp_edit, message, supplier_id=sup_id, on_done=finished)
+
+        if TWILIO_ENABLED:
+            run_db(send_whatsapp_twilio, sup_whatsapp_edit, message, supplier_id=sup_id, on_done=sent)
         else:
-            open_whatsapp_web(sup_whatsapp_edit, message, supplier_id=sup_id)
-            win.destroy()
-            load_inventory()
-            update_stats()
+            run_db(open_whatsapp_web, sup_whatsapp_edit, message, supplier_id=sup_id, on_done=finished)
 
     # Action buttons frame
     action_frame = tk.Frame(win, bg='white')
@@ -2393,9 +3351,15 @@ sales_frame.pack(fill="x", padx=15, pady=10)
 
 ttk.Button(sales_frame, text="Record Sale & Deduct Stock", command=sale_popup, 
            style='Warning.TButton').pack(fill="x", padx=10, pady=5)
+ttk.Button(sales_frame, text="🛒 New Order (Multiple Items)", command=order_popup, 
+           style='Success.TButton').pack(fill="x", padx=10, pady=5)
+ttk.Button(sales_frame, text="🍳 Cook Batch", command=cook_batch_popup, 
+           style='Primary.TButton').pack(fill="x", padx=10, pady=5)
 
 ttk.Button(sales_frame, text="📊 Tomorrow's Production Prediction", command=show_production_prediction, 
            style='Primary.TButton').pack(fill="x", padx=10, pady=5)
+ttk.Button(sales_frame, text="🛒 Shopping List for Tomorrow", command=show_shopping_list, 
+           style='Primary.TButton').pack(fill="x", padx=10, pady=5)
 
 ttk.Button(cat_btn_frame, text="🔄 Refresh Categories", command=load_categories, 
            style='Primary.TButton').pack(fill="x", pady=5)
@@ -2422,4 +3386,13 @@ def on_key_press(event):
 root.bind('<KeyPress>', on_key_press)
 root.focus_set()
 
+cache.start_listener()
+# Load the sales analytics arrays up front so the first report is instant
+run_db(refresh_sales_analytics)
+# Replays whatever the last run journaled but did not write
+flush_journal_periodically()
+if OFFLINE_MODE:
+    refresh_mirror_periodically()
 root.mainloop()
+cache.stop_listener()
+close_pool()
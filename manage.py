@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the canteen database.
+
+Usage:
+    python manage.py rebuild-profit-summary
+    python manage.py rebuild-sales-rollups
+    python manage.py export DIRECTORY [KIND ...]
+    python manage.py import DIRECTORY [KIND ...]
+"""
+
+import argparse
+import sys
+from inventory import rebuild_profit_summary, rebuild_sales_rollups
+from bulk import export_csv, import_csv, csv_path, KINDS
+
+def cmd_rebuild_profit_summary(args):
+    ok, result = rebuild_profit_summary()
+    if not ok:
+        print(f"❌ Rebuild failed: {result}")
+        return 1
+    print(f"✅ profit_summary rebuilt for {result} days")
+    return 0
+
+def cmd_rebuild_sales_rollups(args):
+    ok, result = rebuild_sales_rollups()
+    if not ok:
+        print(f"❌ Rebuild failed: {result}")
+        return 1
+    for table, rows in result.items():
+        print(f"✅ {table}: {rows} rows")
+    return 0
+
+def _kind(value):
+    if value not in KINDS:
+        raise argparse.ArgumentTypeError(f"invalid kind {value!r} (choose from {', '.join(KINDS)})")
+    return value
+
+def cmd_export(args):
+    ok, result = export_csv(args.directory, args.kinds or KINDS)
+    if not ok:
+        print(f"❌ Export failed: {result}")
+        return 1
+    for kind, rows in result.items():
+        print(f"✅ {csv_path(args.directory, kind)}: {rows} rows")
+    return 0
+
+def cmd_import(args):
+    ok, result = import_csv(args.directory, args.kinds or None)
+    if not ok:
+        print(f"❌ Import failed, nothing was changed:\n{result}")
+        return 1
+    for kind, counts in result.items():
+        print(f"✅ {kind}: {counts['rows']} rows, {counts['inserted']} added, {counts['updated']} updated")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Canteen database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("rebuild-profit-summary",
+                        help="recompute profit_summary from daily_sales"
+                        ).set_defaults(func=cmd_rebuild_profit_summary)
+    commands.add_parser("rebuild-sales-rollups",
+                        help="recompute the hourly/daily/monthly sales rollups from daily_sales"
+                        ).set_defaults(func=cmd_rebuild_sales_rollups)
+
+    export_parser = commands.add_parser("export",
+                                        help="write suppliers, materials, categories and recipes to CSV files")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("kinds", nargs="*", type=_kind, metavar="KIND",
+                               help=f"any of {', '.join(KINDS)} (default: all)")
+    export_parser.set_defaults(func=cmd_export)
+    import_parser = commands.add_parser("import",
+                                        help="add or update suppliers, materials, categories and recipes from CSV files")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("kinds", nargs="*", type=_kind, metavar="KIND",
+                               help=f"any of {', '.join(KINDS)} (default: every KIND.csv found)")
+    import_parser.set_defaults(func=cmd_import)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+# mirror.py
+"""
+Offline mirror: a local SQLite copy of raw_materials, categories,
+category_materials, suppliers and prepared_stock, so the counter keeps
+selling while PostgreSQL is unreachable.
+
+refresh_mirror() copies the tables whenever the database is reachable.
+fetch_inventory(), fetch_categories(), get_category_materials(),
+fetch_suppliers() and fetch_prepared_stock() fall back to the mirror when
+get_connection() returns None. Sales are queued in the sales journal (journal.py) either
+way, and apply_sale() deducts them from the mirror's stock so the
+screens show what is left. Restocks, waste and cooked batches made
+offline are queued there too, and apply_movement() applies them.
+
+Stock is synced as movements, never as absolute quantities: the journal
+replays every sale against the current database quantity (clamped at
+zero), and refresh_mirror() then takes the database's quantities and
+applies the sales still queued on top. Like the database, a recipe line
+is served from prepared goods first and only the rest is deducted from
+the raw materials. So sales made offline on two
+terminals, or a restock entered online meanwhile, all add up.
+
+CANTEEN_OFFLINE=false turns offline mode off: the fetch functions then
+return nothing and nothing is queued while the database is unreachable.
+"""
+
+import os
+import sqlite3
+import threading
+from decimal import Decimal
+from db import connection
+
+OFFLINE_MODE = os.getenv("CANTEEN_OFFLINE", "true").lower() == "true"
+MIRROR_PATH = os.getenv("CANTEEN_MIRROR",
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "canteen_mirror.db"))
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS raw_materials (
+        id INTEGER PRIMARY KEY, name TEXT, quantity REAL, unit TEXT,
+        threshold REAL, cost_per_unit REAL, supplier_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY, name TEXT, description TEXT, selling_price REAL
+    );
+    CREATE TABLE IF NOT EXISTS category_materials (
+        category_id INTEGER, material_id INTEGER, amount_per_unit REAL,
+        PRIMARY KEY (category_id, material_id)
+    );
+    CREATE TABLE IF NOT EXISTS suppliers (
+        id INTEGER PRIMARY KEY, name TEXT, whatsapp TEXT, phone TEXT, notes TEXT
+    );
+    CREATE TABLE IF NOT EXISTS prepared_stock (
+        category_id INTEGER PRIMARY KEY, quantity REAL, unit_cost REAL
+    );
+"""
+
+# Table -> columns copied, in the order the fetch functions return them
+_TABLES = {
+    "raw_materials": ("id", "name", "quantity", "unit", "threshold", "cost_per_unit", "supplier_id"),
+    "categories": ("id", "name", "description", "selling_price"),
+    "category_materials": ("category_id", "material_id", "amount_per_unit"),
+    "suppliers": ("id", "name", "whatsapp", "phone", "notes"),
+    "prepared_stock": ("category_id", "quantity", "unit_cost"),
+}
+
+_lock = threading.Lock()
+_db = None
+
+def _connection():
+    """The shared SQLite connection (created on first use); call with _lock held."""
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(MIRROR_PATH, check_same_thread=False)
+        _db.executescript(_SCHEMA)
+    return _db
+
+def _money(value, places="0.01"):
+    """SQLite REAL back to the Decimal psycopg2 returns for a DECIMAL column."""
+    return None if value is None else Decimal(str(value)).quantize(Decimal(places))
+
+def _deduct(db, lines):
+    """
+    Take order lines [(category_id, quantity, brand), ...] out of the
+    mirror's stock as inventory._plan_lines() does: a recipe line takes
+    what is ready from prepared_stock, the rest is cooked from raw materials.
+    """
+    for cat_id, qty, brand in lines:
+        if brand:
+            db.execute("UPDATE raw_materials SET quantity = MAX(quantity - ?, 0) WHERE name = ?",
+                       (qty, brand))
+            continue
+        row = db.execute("SELECT quantity FROM prepared_stock WHERE category_id = ?", (cat_id,)).fetchone()
+        take = min(qty, row[0]) if row and row[0] > 0 else 0
+        if take:
+            db.execute("UPDATE prepared_stock SET quantity = quantity - ? WHERE category_id = ?",
+                       (take, cat_id))
+        qty -= take
+        if qty > 0:
+            db.execute("""
+                UPDATE raw_materials
+                SET quantity = MAX(quantity - ? * (
+                    SELECT amount_per_unit FROM category_materials
+                    WHERE category_id = ? AND material_id = raw_materials.id), 0)
+                WHERE id IN (SELECT material_id FROM category_materials WHERE category_id = ?)
+            """, (qty, cat_id, cat_id))
+
+def _move(db, movement):
+    """
+    Apply a journaled stock movement (see inventory.flush_journaled_movement())
+    to the mirror. Returns the material's new quantity for an adjustment,
+    the units now prepared for a cooked batch.
+    """
+    if movement['kind'] == 'adjust':
+        db.execute("UPDATE raw_materials SET quantity = MAX(quantity + ?, 0) WHERE id = ?",
+                   (movement['delta'], movement['material_id']))
+        row = db.execute("SELECT quantity FROM raw_materials WHERE id = ?", (movement['material_id'],)).fetchone()
+        return _money(row[0]) if row else None
+    cat_id, units = movement['category_id'], movement['units']
+    row = db.execute("""
+        SELECT SUM(cm.amount_per_unit * rm.cost_per_unit)
+        FROM category_materials cm
+        JOIN raw_materials rm ON cm.material_id = rm.id
+        WHERE cm.category_id = ?
+    """, (cat_id,)).fetchone()
+    unit_cost = row[0] or 0
+    db.execute("""
+        UPDATE raw_materials
+        SET quantity = MAX(quantity - ? * (
+            SELECT amount_per_unit FROM category_materials
+            WHERE category_id = ? AND material_id = raw_materials.id), 0)
+        WHERE id IN (SELECT material_id FROM category_materials WHERE category_id = ?)
+    """, (units, cat_id, cat_id))
+    db.execute("""
+        INSERT INTO prepared_stock (category_id, quantity, unit_cost) VALUES (?, ?, ?)
+        ON CONFLICT (category_id) DO UPDATE SET
+            unit_cost = CASE WHEN quantity + excluded.quantity > 0
+                        THEN (quantity * unit_cost + excluded.quantity * excluded.unit_cost)
+                             / (quantity + excluded.quantity)
+                        ELSE excluded.unit_cost END,
+            quantity = quantity + excluded.quantity
+    """, (cat_id, units, unit_cost))
+    return int(db.execute("SELECT quantity FROM prepared_stock WHERE category_id = ?", (cat_id,)).fetchone()[0])
+
+def _replay(db, entry):
+    """Apply a journal entry (a sale order or a stock movement) to the mirror."""
+    if 'movement' in entry:
+        return _move(db, entry['movement'])
+    _deduct(db, entry['lines'])
+
+def refresh_mirror(pending=()):
+    """
+    Copy the mirrored tables from PostgreSQL, then replay pending (journal
+    entries not yet written there, oldest first) on the stock.
+    Returns True, or False if the database is unavailable.
+    """
+    with connection() as conn:
+        if not conn:
+            return False
+        try:
+            cur = conn.cursor()
+            rows = {}
+            for table, columns in _TABLES.items():
+                cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
+                rows[table] = cur.fetchall()
+            conn.rollback()
+        except Exception as e:
+            print("refresh mirror error:", e)
+            return False
+    with _lock:
+        db = _connection()
+        with db:
+            for table, columns in _TABLES.items():
+                db.execute(f"DELETE FROM {table}")
+                db.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [tuple(float(v) if isinstance(v, Decimal) else v for v in row) for row in rows[table]])
+            for entry in pending:
+                _replay(db, entry)
+    return True
+
+def apply_sale(lines):
+    """Deduct a journaled sale from the mirror's stock."""
+    with _lock:
+        db = _connection()
+        with db:
+            _deduct(db, lines)
+
+def apply_movement(movement):
+    """Apply a journaled stock movement to the mirror; returns what _move() does."""
+    with _lock:
+        db = _connection()
+        with db:
+            return _move(db, movement)
+
+def check_movement(movement):
+    """
+    Check a stock movement against the mirror the way the database would:
+    the material must exist; a batch needs its category, a recipe and
+    enough of every ingredient. Returns None, or why it would be refused.
+    """
+    with _lock:
+        db = _connection()
+        if movement['kind'] == 'adjust':
+            if not db.execute("SELECT 1 FROM raw_materials WHERE id = ?", (movement['material_id'],)).fetchone():
+                return f"Material {movement['material_id']} not found"
+            return None
+        cat_id, units = movement['category_id'], movement['units']
+        if not is_unit_count(units):
+            return "Batch size must be positive"
+        row = db.execute("SELECT name FROM categories WHERE id = ?", (cat_id,)).fetchone()
+        if not row:
+            return f"Category {cat_id} not found"
+        usage = db.execute("""
+            SELECT rm.name, cm.amount_per_unit * ?, rm.quantity, rm.unit
+            FROM category_materials cm
+            JOIN raw_materials rm ON cm.material_id = rm.id
+            WHERE cm.category_id = ?
+            ORDER BY rm.name
+        """, (units, cat_id)).fetchall()
+        if not usage:
+            return f"No materials mapped to {row[0]}"
+        short = [f"• {name}: need {need:.2f} {unit}, available {have:.2f} {unit}"
+                 for name, need, have, unit in usage if have < need]
+        if short:
+            return f"Cannot cook {units} x {row[0]}. Not enough stock:\n" + "\n".join(short)
+    return None
+
+def is_unit_count(quantity):
+    """True for a whole, positive number of units (sales are counted, not weighed)."""
+    return isinstance(quantity, int) and not isinstance(quantity, bool) and quantity > 0
+
+def check_sale(lines):
+    """
+    Check order lines [(category_id, quantity, brand), ...] against the
+    mirror the way checkout_order() would: quantities must be whole units,
+    the category and brand must exist, a recipe line needs a recipe for
+    whatever is not prepared, and a brand needs the stock. Returns None, or
+    why the sale would be refused.
+    """
+    for _cat_id, qty, _brand in lines:
+        if not is_unit_count(qty):
+            return f"Invalid quantity: {qty!r}"
+    with _lock:
+        db = _connection()
+        prepared = dict(db.execute("SELECT category_id, quantity FROM prepared_stock").fetchall())
+        brands = {}
+        for cat_id, qty, brand in lines:
+            row = db.execute("SELECT name FROM categories WHERE id = ?", (cat_id,)).fetchone()
+            if not row:
+                return f"Category {cat_id} not found"
+            if brand:
+                brands[brand] = brands.get(brand, 0) + qty
+                continue
+            take = min(qty, max(prepared.get(cat_id, 0), 0))
+            prepared[cat_id] = prepared.get(cat_id, 0) - take
+            if qty > take and not db.execute(
+                    "SELECT 1 FROM category_materials WHERE category_id = ? LIMIT 1", (cat_id,)).fetchone():
+                return f"No materials mapped to {row[0]}"
+        for brand, qty in sorted(brands.items()):
+            row = db.execute("SELECT quantity FROM raw_materials WHERE name = ?", (brand,)).fetchone()
+            if not row:
+                return f"{brand} not found in inventory"
+            if row[0] < qty:
+                return f"Not enough {brand} in stock! Available: {_money(row[0])}"
+    return None
+
+def fetch_inventory():
+    """Like inventory.fetch_inventory(), from the mirror."""
+    if not OFFLINE_MODE:
+        return []
+    with _lock:
+        rows = _connection().execute(
+            "SELECT id, name, quantity, unit, threshold, cost_per_unit, supplier_id FROM raw_materials ORDER BY id"
+        ).fetchall()
+    return [(mid, name, _money(quantity), unit, _money(threshold), _money(cost), supplier_id)
+            for mid, name, quantity, unit, threshold, cost, supplier_id in rows]
+
+def fetch_categories():
+    """Like categories.fetch_categories(), from the mirror."""
+    if not OFFLINE_MODE:
+        return []
+    with _lock:
+        rows = _connection().execute(
+            "SELECT id, name, description, selling_price FROM categories ORDER BY id").fetchall()
+    return [(cid, name, description, _money(price)) for cid, name, description, price in rows]
+
+def get_category_materials(category_id):
+    """Like categories.get_category_materials(), from the mirror."""
+    if not OFFLINE_MODE:
+        return []
+    with _lock:
+        rows = _connection().execute("""
+            SELECT cm.material_id, rm.name, cm.amount_per_unit, rm.quantity, rm.unit, rm.threshold, rm.supplier_id
+            FROM category_materials cm
+            JOIN raw_materials rm ON cm.material_id = rm.id
+            WHERE cm.category_id = ?
+        """, (category_id,)).fetchall()
+    return [(mid, name, _money(amount, "0.001"), _money(quantity), unit, _money(threshold), supplier_id)
+            for mid, name, amount, quantity, unit, threshold, supplier_id in rows]
+
+def fetch_prepared_stock():
+    """Like inventory.fetch_prepared_stock(), from the mirror (last_updated is not mirrored)."""
+    if not OFFLINE_MODE:
+        return []
+    with _lock:
+        rows = _connection().execute("""
+            SELECT ps.category_id, c.name, ps.quantity, ps.unit_cost
+            FROM prepared_stock ps
+            JOIN categories c ON c.id = ps.category_id
+            ORDER BY c.name
+        """).fetchall()
+    return [(cid, name, int(quantity), _money(cost), None) for cid, name, quantity, cost in rows]
+
+def fetch_suppliers(limit=3):
+    """Like suppliers.fetch_suppliers(), from the mirror."""
+    if not OFFLINE_MODE:
+        return []
+    with _lock:
+        return _connection().execute(
+            "SELECT id, name, whatsapp, phone, notes FROM suppliers ORDER BY id LIMIT ?", (limit,)).fetchall()
@@ -0,0 +1,92 @@
+# money.py
+"""
+Exact money and quantity arithmetic on integers.
+
+Rupee amounts are held as integer paise and material quantities as
+integer milli-units (thousandths of a kg, litre, piece, ...). That
+covers every money and quantity column in the schema exactly: prices are
+DECIMAL(10,2), recipe amounts DECIMAL(10,3). Sums are exact. A product
+such as amount x cost is formed exactly and rounded once, half away from
+zero, the same way PostgreSQL rounds a NUMERIC. Decimal only comes back
+at the edges, for the database and for display (rupees()).
+
+The arithmetic functions take Python ints or NumPy int64 arrays alike, so
+whole columns are priced in one vectorized pass:
+
+    cost = recipe_cost(to_milli(amounts), to_paise(costs))   # paise per unit
+    total = line_total(price, units)                         # paise
+    rupees(total)                                            # Decimal('37.50')
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+
+PAISE = 100   # paise per rupee
+MILLI = 1000  # milli-units per unit of a material (or of a dish sold)
+
+_CENT = Decimal("0.01")
+
+def _scale(value, factor):
+    """value * factor rounded half away from zero, as an int (or int64 array for sequences)."""
+    if value is None:
+        return 0
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return int(value) * factor
+    if isinstance(value, Decimal):
+        return int((value * factor).to_integral_value(ROUND_HALF_UP))
+    if isinstance(value, (float, np.floating, str)):
+        return int((Decimal(str(value)) * factor).to_integral_value(ROUND_HALF_UP))
+    # Arrays and sequences (of floats or Decimals): every value from the
+    # database has at most 2 or 3 decimals, so float scaling plus rounding
+    # half away from zero is exact well beyond any canteen's turnover.
+    scaled = np.asarray(value, dtype=np.float64) * factor
+    return (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+def to_paise(rupees_value):
+    """Rupees (Decimal, float, int, str, None, or an array of them) -> integer paise."""
+    return _scale(rupees_value, PAISE)
+
+def to_milli(quantity):
+    """Quantity (Decimal, float, int, str, None, or an array of them) -> integer milli-units."""
+    return _scale(quantity, MILLI)
+
+def div_round(numerator, denominator):
+    """Integer division rounded half away from zero; ints or int64 arrays."""
+    if isinstance(numerator, np.ndarray) or isinstance(denominator, np.ndarray):
+        numerator = np.asarray(numerator, dtype=np.int64)
+        magnitude = (np.abs(numerator) * 2 + np.abs(denominator)) // (np.abs(denominator) * 2)
+        return np.where((numerator < 0) != (np.asarray(denominator) < 0), -magnitude, magnitude)
+    if denominator == 0:
+        raise ZeroDivisionError("div_round by zero")
+    magnitude = (abs(numerator) * 2 + abs(denominator)) // (abs(denominator) * 2)
+    return -magnitude if (numerator < 0) != (denominator < 0) else magnitude
+
+def line_total(price_paise, units):
+    """Price in paise times a (possibly fractional) number of units, in paise."""
+    return div_round(price_paise * to_milli(units), MILLI)
+
+def recipe_cost(amounts_milli, costs_paise):
+    """
+    Cost in paise of one unit of a dish: the sum of amount x cost over its
+    materials, rounded once. Works on lists or arrays of equal length.
+    """
+    exact = np.dot(np.asarray(amounts_milli, dtype=np.int64), np.asarray(costs_paise, dtype=np.int64))
+    return int(div_round(int(exact), MILLI))
+
+def weighted_cost(parts):
+    """
+    Average cost in paise per unit over [(units, cost_paise), ...], e.g.
+    prepared and freshly cooked portions of one order line.
+    """
+    total_units = sum(to_milli(units) for units, _cost in parts)
+    if not total_units:
+        return 0
+    return div_round(sum(to_milli(units) * cost for units, cost in parts), total_units)
+
+def margin_percent(profit_paise, price_paise):
+    """Profit as a percentage of the selling price (0 for a free item)."""
+    return profit_paise / price_paise * 100 if price_paise > 0 else 0
+
+def rupees(paise):
+    """Integer paise -> Decimal rupees with 2 places (for the database and display)."""
+    return (Decimal(int(paise)) / PAISE).quantize(_CENT)
@@ -0,0 +1,367 @@
+# production.py
+import numpy as np
+from db import connection
+from money import PAISE, MILLI, to_paise, to_milli, div_round, rupees
+
+class RecipeMatrix:
+    """
+    The category_materials recipe table as a sparse (COO) matrix, together
+    with the raw_materials stock vector and the per-category / per-material
+    attributes needed to report on it.
+
+    Entry k says: one unit of category rows[k] uses amounts[k] of
+    material cols[k]. Categories and materials are addressed by position;
+    category_ids / material_ids map positions back to database ids.
+    """
+
+    def __init__(self, category_ids, category_names, selling_prices,
+                 material_ids, material_names, units, quantities, thresholds,
+                 costs, supplier_ids, rows, cols, amounts):
+        self.category_ids = np.asarray(category_ids, dtype=np.int64)
+        self.category_names = list(category_names)
+        self.selling_prices = np.asarray(selling_prices, dtype=np.float64)
+        self.material_ids = np.asarray(material_ids, dtype=np.int64)
+        self.material_names = list(material_names)
+        self.units = list(units)
+        self.quantities = np.asarray(quantities, dtype=np.float64)
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.costs = np.asarray(costs, dtype=np.float64)
+        self.supplier_ids = list(supplier_ids)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+
+    @property
+    def shape(self):
+        return len(self.category_ids), len(self.material_ids)
+
+    def dense(self):
+        """Recipe matrix as a dense (categories x materials) array."""
+        matrix = np.zeros(self.shape)
+        np.add.at(matrix, (self.rows, self.cols), self.amounts)
+        return matrix
+
+    def mapped(self):
+        """Boolean mask of categories that have at least one material mapped."""
+        mask = np.zeros(self.shape[0], dtype=bool)
+        mask[self.rows] = True
+        return mask
+
+    def capacity(self):
+        """
+        Units of every category the current stock could make on its own.
+        Returns (max_units, limiting) arrays: limiting holds the position of
+        the material that runs out first, or -1 if the category has no
+        usable recipe (max_units is 0 then).
+        """
+        n_categories = self.shape[0]
+        max_units = np.zeros(n_categories, dtype=np.int64)
+        limiting = np.full(n_categories, -1, dtype=np.int64)
+
+        valid = self.amounts > 0
+        rows, cols = self.rows[valid], self.cols[valid]
+        if not len(rows):
+            return max_units, limiting
+        possible = np.floor(np.maximum(self.quantities[cols], 0) / self.amounts[valid])
+
+        # Smallest ratio per category: sort by (category, ratio) and take
+        # the first entry of every category's run.
+        order = np.lexsort((possible, rows))
+        rows_sorted = rows[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = rows_sorted[1:] != rows_sorted[:-1]
+        max_units[rows_sorted[first]] = possible[order][first].astype(np.int64)
+        limiting[rows_sorted[first]] = cols[order][first]
+        return max_units, limiting
+
+    def requirements(self, units):
+        """
+        Material needed to make units[i] of every category i: the sparse
+        product recipe_matrix.T @ units, one weighted bincount over the entries.
+        """
+        units = np.asarray(units, dtype=np.float64)
+        return np.bincount(self.cols, weights=self.amounts * units[self.rows], minlength=self.shape[1])
+
+def load_recipe_matrix():
+    """
+    Load categories, raw materials and the recipes linking them in a single
+    query. Returns a RecipeMatrix, or None if the database is unavailable.
+    """
+    with connection() as conn:
+        if not conn:
+            return None
+        try:
+            cur = conn.cursor()
+            # FULL JOIN keeps categories without a recipe and materials not
+            # used by any recipe, so both axes are complete.
+            cur.execute("""
+                SELECT c.id, c.name, c.selling_price,
+                       rm.id, rm.name, rm.unit, rm.quantity, rm.threshold,
+                       rm.cost_per_unit, rm.supplier_id, cm.amount_per_unit
+                FROM categories c
+                LEFT JOIN category_materials cm ON cm.category_id = c.id
+                FULL JOIN raw_materials rm ON rm.id = cm.material_id
+                ORDER BY c.name, c.id, rm.id
+            """)
+            rows = cur.fetchall()
+        except Exception as e:
+            print("load_recipe_matrix error:", e)
+            return None
+
+    category_pos = {}
+    material_pos = {}
+    categories = ([], [], [])
+    materials = ([], [], [], [], [], [], [])
+    entries = ([], [], [])
+    for (cat_id, cat_name, price, mat_id, mat_name, unit, quantity, threshold,
+         cost, supplier_id, amount) in rows:
+        if cat_id is not None and cat_id not in category_pos:
+            category_pos[cat_id] = len(categories[0])
+            for column, value in zip(categories, (cat_id, cat_name, float(price or 0))):
+                column.append(value)
+        if mat_id is not None and mat_id not in material_pos:
+            material_pos[mat_id] = len(materials[0])
+            for column, value in zip(materials, (mat_id, mat_name, unit, float(quantity or 0),
+                                                 float(threshold or 0), float(cost or 0), supplier_id)):
+                column.append(value)
+        if cat_id is not None and mat_id is not None and amount is not None:
+            for column, value in zip(entries, (category_pos[cat_id], material_pos[mat_id], float(amount))):
+                column.append(value)
+
+    return RecipeMatrix(*categories, *materials, *entries)
+
+def production_capacity(matrix=None):
+    """
+    Per-category production capacity from current stock, as
+    [(category_name, max_units, limiting_factor), ...] ordered by name.
+    """
+    matrix = matrix or load_recipe_matrix()
+    if matrix is None:
+        return []
+    max_units, limiting = matrix.capacity()
+    mapped = matrix.mapped()
+    predictions = []
+    for pos, name in enumerate(matrix.category_names):
+        material = limiting[pos]
+        if not mapped[pos]:
+            predictions.append((name, 0, "No materials mapped"))
+        elif material < 0:
+            predictions.append((name, 0, "Invalid material amounts"))
+        else:
+            limiting_material = (f"{matrix.material_names[material]} "
+                                 f"({matrix.quantities[material]:.2f} {matrix.units[material]} available)")
+            predictions.append((name, int(max_units[pos]), limiting_material))
+    return predictions
+
+def material_requirements(demand, matrix=None):
+    """
+    Material requirements planning: explode demand ({category_id: units},
+    rounded up to whole units) through the recipes and compare the result
+    with stock. A material is short when making the demand would leave it
+    below its threshold; order_qty brings it back to the threshold.
+
+    Returns the shopping list grouped by supplier (unassigned last) as
+    [(supplier_id, [item, ...]), ...]. Each item is a dict with keys
+    material_id, name, unit, new_q (current stock), threshold, supplier_id,
+    required and order_qty, so it can go straight to a supplier alert.
+    """
+    matrix = matrix or load_recipe_matrix()
+    if matrix is None:
+        return []
+    units = np.zeros(matrix.shape[0])
+    positions = {category_id: pos for pos, category_id in enumerate(matrix.category_ids.tolist())}
+    for category_id, quantity in demand.items():
+        if category_id in positions:
+            units[positions[category_id]] = np.ceil(max(quantity, 0))
+
+    required = matrix.requirements(units)
+    shortfall = required + matrix.thresholds - np.maximum(matrix.quantities, 0)
+    # Round orders up to the cent so they always cover the shortfall
+    order_qty = np.ceil(np.round(shortfall * 100, 6)) / 100
+
+    groups = {}
+    for pos in np.flatnonzero(order_qty > 0).tolist():
+        supplier_id = matrix.supplier_ids[pos]
+        groups.setdefault(supplier_id, []).append({
+            "material_id": int(matrix.material_ids[pos]),
+            "name": matrix.material_names[pos],
+            "unit": matrix.units[pos],
+            "new_q": round(float(matrix.quantities[pos]), 2),
+            "threshold": round(float(matrix.thresholds[pos]), 2),
+            "supplier_id": supplier_id,
+            "required": round(float(required[pos]), 2),
+            "order_qty": float(order_qty[pos]),
+        })
+    return sorted(((supplier_id, sorted(items, key=lambda item: item["name"]))
+                   for supplier_id, items in groups.items()),
+                  key=lambda group: (group[0] is None, group[0] or 0))
+
+# Production planning: choose how many units of every category to make so
+# the whole menu earns the most, with all categories drawing on the same
+# stock. That is the integer program
+#
+#     maximize   profit . x
+#     subject to recipe_matrix.T @ x <= stock,  0 <= x <= cap,  x integer
+#
+# solved with a small dense simplex and branch and bound, both in NumPy.
+# Recipe amounts and stock are never negative, so x = 0 is always feasible
+# and no phase-one simplex is needed.
+
+# Branch-and-bound nodes explored before settling for the best plan so far
+PLAN_NODE_LIMIT = 500
+_EPS = 1e-9
+
+def _simplex(c, G, h):
+    """
+    Maximize c @ x subject to G @ x <= h, x >= 0, for h >= 0, with a dense
+    tableau. Pivots on the most negative reduced cost, switching to Bland's
+    rule (which cannot cycle) after a run of degenerate pivots.
+    Returns (x, objective), or None if the problem is unbounded.
+    """
+    m, n = G.shape
+    tableau = np.zeros((m + 1, n + m + 1))
+    tableau[:m, :n] = G
+    tableau[:m, n:n + m] = np.eye(m)
+    tableau[:m, -1] = h
+    tableau[-1, :n] = -c
+    basis = np.arange(n, n + m)
+    degenerate = 0
+    while True:
+        reduced = tableau[-1, :-1]
+        if degenerate < 50:
+            col = np.argmin(reduced)
+            if reduced[col] >= -_EPS:
+                break
+        else:
+            entering = np.flatnonzero(reduced < -_EPS)
+            if not len(entering):
+                break
+            col = entering[0]
+        column = tableau[:m, col]
+        candidates = np.flatnonzero(column > _EPS)
+        if not len(candidates):
+            return None
+        ratios = tableau[candidates, -1] / column[candidates]
+        tied = candidates[ratios <= ratios.min() + _EPS]
+        row = tied[np.argmin(basis[tied])]
+        degenerate = degenerate + 1 if tableau[row, -1] <= _EPS else 0
+        tableau[row] /= tableau[row, col]
+        pivot_row = tableau[row].copy()
+        tableau -= np.outer(tableau[:, col], pivot_row)
+        tableau[row] = pivot_row
+        basis[row] = col
+    x = np.zeros(n + m)
+    x[basis] = tableau[:m, -1]
+    return x[:n], tableau[-1, -1]
+
+def _fill_greedily(x, c, G, h, upper):
+    """Top up an integer plan with whole units, most profitable category first."""
+    x = x.copy()
+    while True:
+        remaining = h - G @ x
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fits = np.where(G > 0, np.floor(remaining[:, None] / G + _EPS), np.inf).min(axis=0)
+        fits = np.minimum(fits, upper - x)
+        fits[c <= 0] = 0
+        if not np.any(fits >= 1):
+            return x
+        best = np.argmax(np.where(fits >= 1, c, -np.inf))
+        x[best] += fits[best]
+
+def _branch_and_bound(c, G, h, upper, node_limit=PLAN_NODE_LIMIT):
+    """
+    Integer maximum of c @ x subject to G @ x <= h, 0 <= x <= upper (finite).
+    Returns (x, lp_bound, optimal); optimal is False when node_limit ran out
+    first, and x is then the best plan found.
+    """
+    n = len(c)
+    bounded = np.vstack([G, np.eye(n)])
+    root = _simplex(c, bounded, np.concatenate([h, upper]))
+    lp_bound = root[1]
+    best = _fill_greedily(np.floor(root[0] + _EPS), c, G, h, upper)
+    best_value = c @ best
+
+    # Depth-first over (lower, upper) bounds. Lower bounds are substituted
+    # out (x = lower + y), which keeps every node feasible at y = 0.
+    stack = [(np.zeros(n), upper.astype(np.float64))]
+    nodes = 0
+    while stack and nodes < node_limit:
+        lower, high = stack.pop()
+        nodes += 1
+        slack = h - G @ lower
+        if np.any(slack < -_EPS) or np.any(high < lower):
+            continue
+        solved = _simplex(c, bounded, np.concatenate([np.maximum(slack, 0), high - lower]))
+        value = c @ lower + solved[1]
+        if value <= best_value + 1e-6:
+            continue
+        x = lower + solved[0]
+        fraction = np.abs(x - np.round(x))
+        branch = np.argmax(fraction)
+        if fraction[branch] <= 1e-6:
+            best, best_value = np.round(x), value
+            continue
+        down_high = high.copy()
+        down_high[branch] = np.floor(x[branch])
+        up_lower = lower.copy()
+        up_lower[branch] = np.ceil(x[branch])
+        # Explore rounding up first: it tends to reach good plans sooner
+        stack.append((lower, down_high))
+        stack.append((up_lower, high))
+    return best, lp_bound, not stack
+
+def plan_production(caps=None, matrix=None):
+    """
+    Profit-maximizing production plan for the whole menu from current stock.
+    Unlike production_capacity(), categories compete for shared materials.
+    caps: optional {category_id: max units}, e.g. expected demand.
+
+    Profit is worked out in integer paise (money.py); only the LP relaxation
+    runs on floats. Returns a dict with
+      lines       - [(category_name, units, profit_per_unit, line_profit), ...]
+                    in menu order, money as Decimal rupees
+      total_profit (Decimal), lp_bound (float, upper bound on any plan's
+      profit), optimal
+      materials   - [(material_name, unit, used, available), ...] for the
+                    materials the plan uses
+    or None if the database is unavailable.
+    """
+    matrix = matrix or load_recipe_matrix()
+    if matrix is None:
+        return None
+    n_categories, n_materials = matrix.shape
+    valid = matrix.amounts > 0
+    rows, cols, amounts = matrix.rows[valid], matrix.cols[valid], matrix.amounts[valid]
+    G = np.zeros((n_materials, n_categories))
+    np.add.at(G, (cols, rows), amounts)
+    stock = np.maximum(matrix.quantities, 0)
+    # Cost of one unit: sum of amount x cost per category, rounded once
+    exact_cost = np.zeros(n_categories, dtype=np.int64)
+    np.add.at(exact_cost, matrix.rows, to_milli(matrix.amounts) * to_paise(matrix.costs[matrix.cols]))
+    recipe_cost = div_round(exact_cost, MILLI)
+    profit = to_paise(matrix.selling_prices) - recipe_cost
+
+    # Categories without a usable recipe are not planned; the others are
+    # bounded by what the stock could make of them alone.
+    max_units, _ = matrix.capacity()
+    upper = np.where(np.bincount(rows, minlength=n_categories) > 0, max_units, 0).astype(np.float64)
+    if caps:
+        for pos, category_id in enumerate(matrix.category_ids.tolist()):
+            if category_id in caps:
+                upper[pos] = min(upper[pos], np.floor(max(caps[category_id], 0)))
+
+    if n_categories and n_materials:
+        units, lp_bound, optimal = _branch_and_bound(profit.astype(np.float64), G, stock, upper)
+    else:
+        units, lp_bound, optimal = np.zeros(n_categories), 0.0, True
+    used = G @ units
+    units = np.round(units).astype(np.int64)
+    return {
+        "lines": [(name, int(units[pos]), rupees(profit[pos]), rupees(units[pos] * profit[pos]))
+                  for pos, name in enumerate(matrix.category_names)],
+        "total_profit": rupees(int(profit @ units)),
+        "lp_bound": float(lp_bound) / PAISE,
+        "optimal": optimal,
+        "materials": [(matrix.material_names[pos], matrix.units[pos], float(used[pos]), float(stock[pos]))
+                      for pos in np.flatnonzero(used > 0).tolist()],
+    }
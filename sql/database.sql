@@ -63,7 +63,11 @@ CREATE TABLE IF NOT EXISTS daily_sales (
     total_profit DECIMAL(10,2) NOT NULL,      -- Total profit in ₹
     sale_date DATE DEFAULT CURRENT_DATE,
     sale_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    created_by VARCHAR(100)
+    created_by VARCHAR(100),
+    order_key TEXT,                           -- client-generated key of the order (idempotent retries)
+    order_line SMALLINT,                      -- line number within that order
+    brand VARCHAR(255),                       -- raw material sold directly (Cold Drinks), else NULL
+    from_prepared INTEGER NOT NULL DEFAULT 0  -- units served from prepared goods, not cooked to order
 );
 
 -- Profit summary table for quick reporting
@@ -79,20 +83,86 @@ CREATE TABLE IF NOT EXISTS profit_summary (
     UNIQUE(summary_date)
 );
 
--- Stock Transactions Log (optional - for tracking all stock movements)
+-- Per-category sales rollups at three granularities for reporting
+-- (kept up to date by the daily_sales insert trigger, rebuildable with
+-- python manage.py rebuild-sales-rollups)
+CREATE TABLE IF NOT EXISTS sales_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,                -- sale_time truncated to the hour
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    quantity_sold INTEGER NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    total_cost DECIMAL(12,2) NOT NULL DEFAULT 0,
+    total_profit DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, category_id)
+);
+
+CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+    sale_date DATE NOT NULL,
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    quantity_sold INTEGER NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    total_cost DECIMAL(12,2) NOT NULL DEFAULT 0,
+    total_profit DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, category_id)
+);
+
+CREATE TABLE IF NOT EXISTS sales_rollup_monthly (
+    month DATE NOT NULL,                      -- first day of the month
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    quantity_sold INTEGER NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+    total_cost DECIMAL(14,2) NOT NULL DEFAULT 0,
+    total_profit DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, category_id)
+);
+
+-- Prepared goods ready at the counter (batch cooking). A category with a
+-- row here is sold from this counter first, so a sale touches one row
+-- instead of every ingredient; raw materials are deducted when a batch is
+-- cooked. unit_cost is the weighted average material cost of the units on hand.
+CREATE TABLE IF NOT EXISTS prepared_stock (
+    category_id INTEGER PRIMARY KEY REFERENCES categories(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+    unit_cost DECIMAL(10,2) NOT NULL DEFAULT 0,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Every batch cooked (referenced by its BATCH stock ledger rows)
+CREATE TABLE IF NOT EXISTS prepared_batches (
+    id SERIAL PRIMARY KEY,
+    category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+    quantity INTEGER NOT NULL,
+    unit_cost DECIMAL(10,2) NOT NULL,
+    notes TEXT,
+    cooked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Stock Transactions Log (ledger of every stock movement)
 CREATE TABLE IF NOT EXISTS stock_transactions (
     id SERIAL PRIMARY KEY,
     material_id INTEGER REFERENCES raw_materials(id) ON DELETE CASCADE,
-    transaction_type VARCHAR(20) NOT NULL, -- 'RESTOCK', 'SALE', 'ADJUSTMENT', 'WASTE'
+    transaction_type VARCHAR(20) NOT NULL, -- 'RESTOCK', 'SALE', 'ADJUSTMENT', 'WASTE', 'BATCH'
     quantity_change DECIMAL(10,2) NOT NULL, -- positive for additions, negative for deductions
     previous_quantity DECIMAL(10,2) NOT NULL,
     new_quantity DECIMAL(10,2) NOT NULL,
     reference_id INTEGER, -- could reference sale_id, purchase_id, etc.
     notes TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    created_by VARCHAR(100)
+    created_by VARCHAR(100),
+    op_key TEXT -- key of a stock movement journaled offline, so its replay is not applied twice
 );
 
+-- Order columns for databases created before they existed
+ALTER TABLE daily_sales ADD COLUMN IF NOT EXISTS order_key TEXT;
+ALTER TABLE daily_sales ADD COLUMN IF NOT EXISTS order_line SMALLINT;
+ALTER TABLE daily_sales ADD COLUMN IF NOT EXISTS brand VARCHAR(255);
+ALTER TABLE daily_sales ADD COLUMN IF NOT EXISTS from_prepared INTEGER NOT NULL DEFAULT 0;
+-- Likewise the offline movement key
+ALTER TABLE stock_transactions ADD COLUMN IF NOT EXISTS op_key TEXT;
+
 -- Add foreign key constraint for supplier_id in raw_materials
 ALTER TABLE raw_materials 
 ADD CONSTRAINT fk_raw_materials_supplier 
@@ -103,10 +173,19 @@ CREATE INDEX IF NOT EXISTS idx_raw_materials_name ON raw_materials(name);
 CREATE INDEX IF NOT EXISTS idx_raw_materials_supplier ON raw_materials(supplier_id);
 CREATE INDEX IF NOT EXISTS idx_stock_transactions_material ON stock_transactions(material_id);
 CREATE INDEX IF NOT EXISTS idx_stock_transactions_date ON stock_transactions(created_at);
+-- Keyset pagination of one material's ledger, newest first
+CREATE INDEX IF NOT EXISTS idx_stock_transactions_history ON stock_transactions(material_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_stock_transactions_op_key ON stock_transactions(op_key) WHERE op_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_prepared_batches_category ON prepared_batches(category_id, cooked_at);
 CREATE INDEX IF NOT EXISTS idx_category_materials_category ON category_materials(category_id);
 CREATE INDEX IF NOT EXISTS idx_category_materials_material ON category_materials(material_id);
 CREATE INDEX IF NOT EXISTS idx_daily_sales_date ON daily_sales(sale_date);
+-- A retried order finds its first attempt instead of being recorded twice
+CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_sales_order_key ON daily_sales(order_key, order_line);
 CREATE INDEX IF NOT EXISTS idx_daily_sales_category ON daily_sales(category_id);
+-- Keyset pagination of the sales history, newest first, optionally per category
+CREATE INDEX IF NOT EXISTS idx_daily_sales_history ON daily_sales(sale_date DESC, sale_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_daily_sales_category_history ON daily_sales(category_id, sale_date DESC, sale_time DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_profit_summary_date ON profit_summary(summary_date);
 
 -- Insert sample data for SCHOOL CANTEEN
@@ -205,34 +284,6 @@ INSERT INTO category_materials (category_id, material_id, amount_per_unit) VALUE
 (6, 22, 0.01)   -- 10g sugar
 ON CONFLICT (category_id, material_id) DO NOTHING;
 
--- Function to automatically log stock transactions (optional)
-CREATE OR REPLACE FUNCTION log_stock_transaction()
-RETURNS TRIGGER AS $$
-BEGIN
-    IF TG_OP = 'UPDATE' AND OLD.quantity != NEW.quantity THEN
-        INSERT INTO stock_transactions (
-            material_id, 
-            transaction_type, 
-            quantity_change, 
-            previous_quantity, 
-            new_quantity,
-            notes
-        ) VALUES (
-            NEW.id,
-            CASE 
-                WHEN NEW.quantity > OLD.quantity THEN 'RESTOCK'
-                ELSE 'DEDUCTION'
-            END,
-            NEW.quantity - OLD.quantity,
-            OLD.quantity,
-            NEW.quantity,
-            'Auto-logged from raw_materials update'
-        );
-    END IF;
-    RETURN NEW;
-END;
-$$ LANGUAGE plpgsql;
-
 -- Functions and Triggers (created after all tables exist)
 
 -- Function to calculate material cost for a category
@@ -251,7 +302,10 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Function to update daily profit summary
+-- Function to update daily profit summary incrementally: each INSERT
+-- statement on daily_sales adds its own totals to the matching day rows
+-- (one upsert per day touched), instead of re-aggregating the whole day.
+-- rebuild_profit_summary() in inventory.py recomputes it from scratch.
 CREATE OR REPLACE FUNCTION update_profit_summary()
 RETURNS TRIGGER AS $$
 BEGIN
@@ -264,7 +318,7 @@ BEGIN
         profit_margin_percent
     )
     SELECT 
-        NEW.sale_date,
+        sale_date,
         COUNT(*),
         SUM(total_revenue),
         SUM(total_cost),
@@ -274,34 +328,142 @@ BEGIN
                 ROUND((SUM(total_profit) / SUM(total_revenue)) * 100, 2)
             ELSE 0 
         END
-    FROM daily_sales 
-    WHERE sale_date = NEW.sale_date
+    FROM new_sales
     GROUP BY sale_date
     ON CONFLICT (summary_date) 
     DO UPDATE SET
-        total_sales_count = EXCLUDED.total_sales_count,
-        total_revenue = EXCLUDED.total_revenue,
-        total_cost = EXCLUDED.total_cost,
-        total_profit = EXCLUDED.total_profit,
-        profit_margin_percent = EXCLUDED.profit_margin_percent;
+        total_sales_count = profit_summary.total_sales_count + EXCLUDED.total_sales_count,
+        total_revenue = profit_summary.total_revenue + EXCLUDED.total_revenue,
+        total_cost = profit_summary.total_cost + EXCLUDED.total_cost,
+        total_profit = profit_summary.total_profit + EXCLUDED.total_profit,
+        profit_margin_percent = CASE 
+            WHEN profit_summary.total_revenue + EXCLUDED.total_revenue > 0 THEN 
+                ROUND(((profit_summary.total_profit + EXCLUDED.total_profit) /
+                       (profit_summary.total_revenue + EXCLUDED.total_revenue)) * 100, 2)
+            ELSE 0 
+        END;
     
-    RETURN NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to add each INSERT statement's sales to the hourly, daily and
+-- monthly rollups (one upsert per bucket and category touched)
+CREATE OR REPLACE FUNCTION update_sales_rollups()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Sales without a category are left out, like rebuild_sales_rollups() does
+    INSERT INTO sales_rollup_hourly AS r (
+        bucket, category_id, sales_count, quantity_sold, total_revenue, total_cost, total_profit
+    )
+    SELECT date_trunc('hour', sale_time), category_id, COUNT(*), SUM(quantity_sold),
+           SUM(total_revenue), SUM(total_cost), SUM(total_profit)
+    FROM new_sales
+    WHERE category_id IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (bucket, category_id) DO UPDATE SET
+        sales_count = r.sales_count + EXCLUDED.sales_count,
+        quantity_sold = r.quantity_sold + EXCLUDED.quantity_sold,
+        total_revenue = r.total_revenue + EXCLUDED.total_revenue,
+        total_cost = r.total_cost + EXCLUDED.total_cost,
+        total_profit = r.total_profit + EXCLUDED.total_profit;
+
+    INSERT INTO sales_rollup_daily AS r (
+        sale_date, category_id, sales_count, quantity_sold, total_revenue, total_cost, total_profit
+    )
+    SELECT sale_date, category_id, COUNT(*), SUM(quantity_sold),
+           SUM(total_revenue), SUM(total_cost), SUM(total_profit)
+    FROM new_sales
+    WHERE category_id IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (sale_date, category_id) DO UPDATE SET
+        sales_count = r.sales_count + EXCLUDED.sales_count,
+        quantity_sold = r.quantity_sold + EXCLUDED.quantity_sold,
+        total_revenue = r.total_revenue + EXCLUDED.total_revenue,
+        total_cost = r.total_cost + EXCLUDED.total_cost,
+        total_profit = r.total_profit + EXCLUDED.total_profit;
+
+    INSERT INTO sales_rollup_monthly AS r (
+        month, category_id, sales_count, quantity_sold, total_revenue, total_cost, total_profit
+    )
+    SELECT date_trunc('month', sale_date)::date, category_id, COUNT(*), SUM(quantity_sold),
+           SUM(total_revenue), SUM(total_cost), SUM(total_profit)
+    FROM new_sales
+    WHERE category_id IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (month, category_id) DO UPDATE SET
+        sales_count = r.sales_count + EXCLUDED.sales_count,
+        quantity_sold = r.quantity_sold + EXCLUDED.quantity_sold,
+        total_revenue = r.total_revenue + EXCLUDED.total_revenue,
+        total_cost = r.total_cost + EXCLUDED.total_cost,
+        total_profit = r.total_profit + EXCLUDED.total_profit;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Tell the application caches (cache.py) which row changed.
+-- Payload is 'table:key'; TG_ARGV[0] names the key column.
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('cache_invalidation',
+                          TG_TABLE_NAME || ':' || (to_jsonb(OLD) ->> TG_ARGV[0]));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- Identical payloads within a transaction are delivered once
+        PERFORM pg_notify('cache_invalidation',
+                          TG_TABLE_NAME || ':' || (to_jsonb(NEW) ->> TG_ARGV[0]));
+    END IF;
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
 -- Create triggers (after all tables and functions exist)
+-- Stock movements are written to stock_transactions by the application,
+-- in bulk and with a reference to the sale; drop the old per-row trigger.
 DROP TRIGGER IF EXISTS trigger_log_stock_changes ON raw_materials;
-CREATE TRIGGER trigger_log_stock_changes
-    AFTER UPDATE ON raw_materials
-    FOR EACH ROW
-    EXECUTE FUNCTION log_stock_transaction();
+DROP FUNCTION IF EXISTS log_stock_transaction();
 
 DROP TRIGGER IF EXISTS trigger_update_profit_summary ON daily_sales;
 CREATE TRIGGER trigger_update_profit_summary
     AFTER INSERT ON daily_sales
-    FOR EACH ROW
+    REFERENCING NEW TABLE AS new_sales
+    FOR EACH STATEMENT
     EXECUTE FUNCTION update_profit_summary();
 
+DROP TRIGGER IF EXISTS trigger_update_sales_rollups ON daily_sales;
+CREATE TRIGGER trigger_update_sales_rollups
+    AFTER INSERT ON daily_sales
+    REFERENCING NEW TABLE AS new_sales
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_sales_rollups();
+
+DROP TRIGGER IF EXISTS trigger_cache_raw_materials ON raw_materials;
+CREATE TRIGGER trigger_cache_raw_materials
+    AFTER INSERT OR UPDATE OR DELETE ON raw_materials
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_cache_invalidation('id');
+
+DROP TRIGGER IF EXISTS trigger_cache_categories ON categories;
+CREATE TRIGGER trigger_cache_categories
+    AFTER INSERT OR UPDATE OR DELETE ON categories
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_cache_invalidation('id');
+
+DROP TRIGGER IF EXISTS trigger_cache_category_materials ON category_materials;
+CREATE TRIGGER trigger_cache_category_materials
+    AFTER INSERT OR UPDATE OR DELETE ON category_materials
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_cache_invalidation('category_id');
+
+DROP TRIGGER IF EXISTS trigger_cache_suppliers ON suppliers;
+CREATE TRIGGER trigger_cache_suppliers
+    AFTER INSERT OR UPDATE OR DELETE ON suppliers
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_cache_invalidation('id');
+
 -- Useful queries for SCHOOL CANTEEN:
 
 -- 1. Check which items can be made with current stock